@@ -0,0 +1,199 @@
+# Copyright (c) 2011-2013, ImageCat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+batch processing entry point
+
+build exposure for given project files without the UI. each project is
+processed in a separate worker process as
+  verify_data -> build_exposure -> verify_result -> export_data
+log of each project is written to <project>.log (<project>_2.log, ... if 
+several projects have the same name)
+
+usage: python SIDD_batch.py [-w workers] [-l log_dir] [-n] project_file ...
+    -w workers  number of projects to process concurrently (default: number of CPUs)
+    -l log_dir  directory for project logs (default: same directory as project file)
+    -n          do not export exposure
+"""
+import sys
+import os
+import types
+import getopt
+import logging
+from multiprocessing import Pool, cpu_count
+
+from qgis.core import QgsApplication
+
+from sidd.appconfig import SIDDConfig
+from sidd.constants import logAPICall, SyncModes, ProjectStatus
+from sidd.project import Project
+from sidd.taxonomy import get_taxonomy
+from utils.system import get_app_dir, check_environ
+
+# exit codes, overall exit code is the highest of all projects
+[EXIT_OK, EXIT_NOT_READY, EXIT_FILE_NOT_FOUND, EXIT_ERROR, EXIT_USAGE] = range(5)
+
+def init_worker():
+    """ initialize QGIS for each worker process """
+    global qgis_app
+    qgis_app = QgsApplication([], False)
+    QgsApplication.setPrefixPath(os.environ['QGIS'], True)
+    QgsApplication.initQgis()
+
+def process_project(params):
+    """
+    build exposure for one project file
+    return (project_file, exit code)
+    """
+    (project_file, app_dir, log_file, do_export) = params
+
+    # per-project log file
+    handler = logging.FileHandler(log_file, 'w')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    logger = logging.getLogger('batch')
+
+    project = None
+    try:
+        if not os.path.exists(project_file):
+            logger.error('project file %s does not exist' % project_file)
+            return (project_file, EXIT_FILE_NOT_FOUND)
+
+        app_config = SIDDConfig(app_dir + '/app.cfg')
+        logAPICall.setLevel(app_config.get('logging', 'core', 30, types.IntType))
+        taxonomy = get_taxonomy(app_config.get('options', 'taxonomy', 'gem'))
+
+        logger.info('opening project %s' % project_file)
+        project = Project(app_config, taxonomy)
+        project.set_project_path(project_file)
+        project.sync(SyncModes.Read)
+
+        project.verify_data()
+        if project.status != ProjectStatus.ReadyForExposure:
+            logger.error('project is not ready for exposure: %s' % project.errors)
+            return (project_file, EXIT_NOT_READY)
+
+        logger.info('building exposure')
+        project.build_exposure()
+        project.verify_result()
+        for key, report in project.quality_reports.iteritems():
+            logger.info('%s: %s' % (key, report))
+
+        if do_export:
+            if project.export_path == '':
+                logger.warning('export path not set, exposure is not exported')
+            else:
+                logger.info('exporting exposure to %s' % project.export_path)
+                project.export_data()
+        logger.info('completed')
+        return (project_file, EXIT_OK)
+    except Exception as err:
+        logger.exception('error processing project: %s' % err)
+        return (project_file, EXIT_ERROR)
+    finally:
+        if project is not None:
+            project.clean_up()
+        root_logger.removeHandler(handler)
+        handler.close()
+
+def usage():
+    print >> sys.stderr, __doc__
+
+def parse_args(argv):
+    """
+    parse command line arguments
+    return (workers, log_dir, do_export, project_files), None if help is requested
+    raise getopt.GetoptError for invalid arguments
+    """
+    opts, project_files = getopt.getopt(argv, "w:l:nh")
+    workers = cpu_count()
+    log_dir = None
+    do_export = True
+    for o, a in opts:
+        if o == "-w":
+            try:
+                workers = int(a)
+            except ValueError:
+                raise getopt.GetoptError('number of workers must be an integer: %s' % a, o)
+            if workers < 1:
+                raise getopt.GetoptError('number of workers must be at least 1: %s' % a, o)
+        elif o == "-l":
+            log_dir = a
+        elif o == "-n":
+            do_export = False
+        elif o == "-h":
+            return None
+    if len(project_files) == 0:
+        raise getopt.GetoptError('no project file given')
+    return (workers, log_dir, do_export, project_files)
+
+def log_files(project_files, log_dir=None):
+    """
+    log file for each project, <project>.log in log_dir or directory of project file.
+    numbered as <project>_2.log, <project>_3.log ... if already used by other project
+    """
+    used = set()
+    logs = []
+    for project_file in project_files:
+        if log_dir is None:
+            directory = os.path.dirname(os.path.abspath(project_file))
+        else:
+            directory = log_dir
+        base = os.path.join(directory, os.path.splitext(os.path.basename(project_file))[0])
+        log_file, idx = base + '.log', 1
+        while os.path.normcase(os.path.abspath(log_file)) in used:
+            idx += 1
+            log_file = '%s_%d.log' % (base, idx)
+        used.add(os.path.normcase(os.path.abspath(log_file)))
+        logs.append(log_file)
+    return logs
+
+if __name__=='__main__':
+    # check for required environment parameters
+    try:
+        check_environ(['QGIS'])
+    except Exception, err:
+        print >> sys.stderr, 'Environ variable %s is required for application.' % err
+        sys.exit(EXIT_USAGE)
+
+    try:
+        args = parse_args(sys.argv[1:])
+    except getopt.GetoptError, err:
+        print >> sys.stderr, str(err)
+        usage()
+        sys.exit(EXIT_USAGE)
+    if args is None:
+        usage()
+        sys.exit(EXIT_OK)
+    (workers, log_dir, do_export, project_files) = args
+
+    logging.basicConfig(level=logging.INFO)
+
+    # one process per project, so memory held by QGIS is released after each project
+    # NOTE: projects may share shapefile cache directory, which is safe across 
+    #       processes (see utils.cache)
+    app_dir = get_app_dir()
+    pool = Pool(processes=min(workers, len(project_files)),
+                initializer=init_worker, maxtasksperchild=1)
+    exit_code = EXIT_OK
+    tasks = [(project_file, app_dir, log_file, do_export) 
+             for project_file, log_file in zip(project_files, log_files(project_files, log_dir))]
+    for project_file, code in pool.imap_unordered(process_project, tasks):
+        print '%s: %s' % (project_file, ['OK', 'NOT READY', 'FILE NOT FOUND', 'ERROR'][code])
+        exit_code = max(exit_code, code)
+    pool.close()
+    pool.join()
+    sys.exit(exit_code)
@@ -30,9 +30,9 @@ SIDD_APP_NAME = "SIDD"
 SIDD_VERSION = "1.0"
 SIDD_LASTUPDATED = "2013-07-15"
 
-# maximum number of items before switching from in-memory algorithms
-# to file-based algorithms
-MAX_FEATURES_IN_MEMORY = 10000
+# memory budget in bytes, if not set in app.cfg. in-memory algorithms are 
+# used as long as the process memory stays within the budget
+DEFAULT_MEMORY_BUDGET = 1e+09
 
 # 30 arc second
 DEFAULT_GRID_SIZE = 1 / 60. / 2.
@@ -45,6 +45,7 @@ LAT_FIELD_NAME = "LAT"
 HT_FIELD_NAME = "HT"
 ZONE_FIELD_NAME = "ZONE"
 TAX_FIELD_NAME = "TAXONOMY"
+TAX_ID_FIELD_NAME = "TAX_ID"
 CNT_FIELD_NAME = "NUM_BLDGS"
 AREA_FIELD_NAME = "AREA"
 COST_FIELD_NAME = "REPCOST"
@@ -18,7 +18,7 @@ Mapping scheme is a statiscal translation useful for assigning structural
 attributes for a building stock
 """
 
-from statistic import Statistics
+from statistic import Statistics, LeafTable
 from node import StatisticNode, StatisticModifier
 from exceptions import StatisticError, StatisticNodeError
 from ms import MappingScheme, MappingSchemeZone
\ No newline at end of file
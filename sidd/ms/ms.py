@@ -19,6 +19,7 @@ Module contains all mapping scheme handling class
 
 from xml.etree.ElementTree import ElementTree, fromstring
 from operator import attrgetter
+from weakref import ref
 
 from utils.xml import get_node_attrib
 from sidd.constants import logAPICall
@@ -27,6 +28,12 @@ from sidd.taxonomy import get_taxonomy
 from sidd.ms.statistic import Statistics
 from sidd.ms.node import StatisticNode
 
+def _zone_key(zone_name):
+    """ key for zone name in zone index, QString and str/unicode names are matched """
+    if isinstance(zone_name, basestring):
+        return zone_name
+    return unicode(zone_name)
+
 class MappingSchemeZone (object):
     """
     Zone representation object used to associate structural statistics
@@ -35,9 +42,24 @@ class MappingSchemeZone (object):
     
     def __init__(self, name):
         """ constructor """
-        self.name = name
+        self._name = name
+        # mapping scheme indexing zone by name, see MappingScheme._index_zones
+        self._scheme = None
         self.stats = None
     
+    @property
+    def name(self):
+        return self._name
+    
+    @name.setter
+    def name(self, name):
+        """ rename zone, index of mapping scheme holding zone is rebuilt on next lookup """
+        self._name = name
+        if self._scheme is not None:
+            scheme = self._scheme()
+            if scheme is not None:
+                scheme._zone_index = None
+    
     # TODO additional functionalities TBD
     
 class MappingScheme (object):
@@ -52,6 +74,11 @@ class MappingScheme (object):
         self.ms = {}
         self.taxonomy = taxonomy
         self.zones = []
+        # zone name => zone, see sort_zones 
+        self._zone_index = {}
+        self._indexed_zones = 0
+        # id of root node => zone, see get_assignment_by_node
+        self._root_index = {}
     
     def __str__(self):
         """ Returns string representation of a mapping scheme """
@@ -187,10 +214,10 @@ class MappingScheme (object):
                     zone.stats.name = zone.name
                     return                
         elif isinstance(node, StatisticNode):
-            for zone in self.zones: # found                
-                if zone.stats.has_node(node):
-                    zone.stats.delete_branch(node)
-                    return 
+            stats = self.get_assignment_by_node(node)
+            if stats is not None:
+                stats.delete_branch(node)
+                return 
         # node not correct type or not found in tree        
         raise SIDDException('given node does not belong to mapping scheme')
         
@@ -218,22 +245,46 @@ class MappingScheme (object):
     def get_assignment_by_name(self, zone_name):
         """ Retrieve statistic associated with given zone name """
         try:
-            for zone in self.zones:                
-                if (zone.name == zone_name):
-                    return zone.stats
+            key = _zone_key(zone_name)
+            if self._zone_index is None or self._indexed_zones != len(self.zones):
+                # zone renamed or zones list changed without sort_zones
+                self._index_zones()
+            zone = self._zone_index.get(key)
+            if zone is not None:
+                return zone.stats
         except:
             return None
     
     @logAPICall
+    def get_leaf_table(self, zone_name):
+        """ 
+        Retrieve compiled leaves (ms.LeafTable object) of statistic for given 
+        zone name, None if zone is not found. 
+        table is cached with the statistic until its tree is modified
+        """
+        stats = self.get_assignment_by_name(zone_name)
+        if stats is None:
+            return None
+        return stats.get_leaf_table()
+    
+    @logAPICall
     def get_assignment_by_node(self, node):
         """ Retrieve statistic contains given StatisticNode """
         if node is None:
             return None
-        for assignment in self.assignments():
-            stat = assignment[1]
-            if stat.has_node(node):
-                # found
-                return stat
+        # find root of node, then statistic with that root
+        root = node
+        while root.parent is not None:
+            root = root.parent
+        zone = self._root_index.get(id(root))
+        if zone is None or zone.stats.root is not root:
+            # statistic replaced or tree reloaded
+            self._root_index = dict([(id(zone.stats.root), zone) for zone in self.zones 
+                                     if zone.stats is not None])
+            zone = self._root_index.get(id(root))
+        if zone is not None and zone.stats.root is root and zone.stats.has_node(node):
+            # found
+            return zone.stats
         # not found
         return None
     
@@ -253,3 +304,12 @@ class MappingScheme (object):
 
     def sort_zones(self):
         self.zones.sort(key=attrgetter('name'))
+        self._index_zones()
+
+    def _index_zones(self):
+        """ rebuild index of zone name => zone, first zone is kept for repeated names """
+        self._zone_index = {}
+        for zone in self.zones:
+            self._zone_index.setdefault(_zone_key(zone.name), zone)
+            zone._scheme = ref(self)
+        self._indexed_zones = len(self.zones)
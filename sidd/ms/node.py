@@ -16,17 +16,32 @@
 """
 Module class for statistic node handling
 """
-from copy import deepcopy
+from weakref import ref
 
 from utils.xml import get_node_attrib
 from sidd.constants import logAPICall
 from sidd.ms.exceptions import StatisticNodeError 
 
+def _intern(value):
+    """ intern string values, so nodes for same attribute/value share one copy """
+    if type(value) is str:
+        return intern(value)
+    return value
+
 class StatisticModifier(object):
+    __slots__ = ('name', 'level', 'values')
+
     def __init__(self, name='', level=None):
-        self.name = name
+        self.name = _intern(name)
         self.level = level
         self.values = {}
+
+    @property
+    def clone(self):
+        """ get a copy of the modifier """
+        mod = StatisticModifier(self.name, self.level)
+        mod.values = self.values.copy()
+        return mod
     
     @property
     def is_default(self):
@@ -80,7 +95,7 @@ class StatisticModifier(object):
     
     @logAPICall
     def from_xml(self, xmlnode):
-        self.name = get_node_attrib(xmlnode, 'name')
+        self.name = _intern(get_node_attrib(xmlnode, 'name'))
         self.level = get_node_attrib(xmlnode, 'level')
         for mod_node in xmlnode.findall('modifiervalue'):
             if mod_node.attrib['value'] == 'None':
@@ -105,12 +120,21 @@ class StatisticNode (object):
     tree related information
     -level: level of node in a statistic tree
     -children: collection of child StatisticNode       
+
+    NOTE: large mapping schemes have many nodes, so attributes are kept in
+          slots instead of per instance dictionary
+    NOTE: node owns its children, parent is only weakly referenced so a
+          discarded tree is freed without waiting for garbage collection
     """
+    __slots__ = ('_parent', 'name', 'value', 'additional', 'is_skipped', 'is_default',
+                 'count', 'weight', 'modifiers', 'level', 'children', '_child_index', '_indexed_children',
+                 '__weakref__')
 
     # static members
     ###########################
     # additional values to be attached to the node
     AverageSize, UnitCost = range(2)
+    label_additional = ["avg_size", "unit_cost"]
 
     # constructor / destructor
     ###########################
@@ -119,10 +143,9 @@ class StatisticNode (object):
                  is_default=False, is_skipped=False):
         """ constructor """
         self.parent=parent
-        self.name=name
-        self.value=value
+        self.name=_intern(name)
+        self.value=_intern(value)
         self.additional = {}
-        self.label_additional = ["avg_size", "unit_cost"]
         self.is_skipped=is_skipped
         self.is_default=is_default        
         self.count=0
@@ -130,22 +153,27 @@ class StatisticNode (object):
         self.modifiers=[]                
         self.level=level
         self.children=[]
-    
-    def __del__(self):
-        """ destructor """
-        del self.parent
-        del self.name
-        del self.value
-        del self.is_default
-        del self.count
-        del self.modifiers
-        del self.level
-        for child in self.children:
-            del child
+        # value => child node, and number of children indexed, see get_child
+        self._child_index={}
+        self._indexed_children=0
     
     # property methods
     ###########################
     
+    @property
+    def parent(self):
+        """ parent node, None for root or detached node """
+        if self._parent is None:
+            return None
+        return self._parent()
+
+    @parent.setter
+    def parent(self, parent):
+        if parent is None:
+            self._parent = None
+        else:
+            self._parent = ref(parent)
+
     @property
     def is_leaf(self):
         """ is leaf if does not have children """
@@ -166,8 +194,11 @@ class StatisticNode (object):
     
     @property
     def clone(self):
-        """ get a cloned copy of the node and all its children """
-        return deepcopy(self)
+        """
+        get a cloned copy of the node and all its children
+        NOTE: cloned node is not attached to any parent
+        """
+        return self._copy(None)
 
     @property
     def ancestor_names(self):
@@ -255,8 +286,8 @@ class StatisticNode (object):
     @logAPICall
     def from_xml(self, xmlnode):
         """ construct node and children from XML """  
-        self.name = get_node_attrib(xmlnode, 'attribute')      
-        self.value = get_node_attrib(xmlnode, 'value')
+        self.name = _intern(get_node_attrib(xmlnode, 'attribute'))
+        self.value = _intern(get_node_attrib(xmlnode, 'value'))
         self.level = int(get_node_attrib(xmlnode, 'level'))
         self.weight = float(get_node_attrib(xmlnode, 'weight'))
         self.count = self.weight
@@ -282,6 +313,42 @@ class StatisticNode (object):
 
     # readonly methods
     ###########################
+    def _copy(self, parent):
+        """ copy of node and all its children, attached to given parent """
+        node = StatisticNode(parent, self.name, self.value, self.level,
+                             self.is_default, self.is_skipped)
+        node.count = self.count
+        node.weight = self.weight
+        node.additional = self.additional.copy()
+        node.modifiers = [mod.clone for mod in self.modifiers]
+        node.children = [child._copy(node) for child in self.children]
+        return node
+
+    def get_child(self, value):
+        """
+        child node with given value (compared as string), None if not found
+        NOTE: children list can be modified directly, so index is rebuilt if 
+              number of children changed or found child is no longer valid
+        """
+        key = str(value)
+        child = self._child_index.get(key)
+        if child is not None:
+            if child.parent is self and str(child.value) == key:
+                return child
+        elif self._indexed_children == len(self.children):
+            # index is up to date, not found
+            return None
+        # rebuild index, first child is kept for repeated values
+        self._child_index = {}
+        for child in self.children:
+            self._child_index.setdefault(str(child.value), child)
+        self._indexed_children = len(self.children)
+        return self._child_index.get(key)
+
+    def _invalidate_child_index(self):
+        """ force rebuild of index on next get_child, required when child values are changed """
+        self._indexed_children = -1
+
     @logAPICall
     def leaves(self, taxonomy, 
                with_modifier=True, order_attributes=False,
@@ -420,13 +487,14 @@ class StatisticNode (object):
     # tree modifying methods
     ###########################
     @logAPICall
-    def add(self, attr_vals, parse_order, level, additional_data={}):
+    def add(self, attr_vals, parse_order, level, additional_data={}, count=1):
         """ 
         recursively update statistic @ node and @ child nodes
         using attr_val, defaults, skips at idx
+        count is number of cases added, additional_data is total for all cases 
         """
         # increment count of current node
-        self.count+=1
+        self.count+=count
         
         # the ending condition for the recursive call
         # NOTE: is_leaf is not used here, this process should work on a empty tree
@@ -458,23 +526,22 @@ class StatisticNode (object):
         
         logAPICall.log('\tnode:%s' %(value), logAPICall.DEBUG_L2)
         
-        child_found = False
         # find children and add value/modifier
-        for child in self.children:
-            if (child.value is None and value is None) or str(child.value) == str(value):
-                logAPICall.log('found child with %s' % value, logAPICall.DEBUG_L2)
-                child_found = True                
-                # recursive call to process next level
-                child.add(attr_vals, parse_order, level+1, additional_data)
-                return 
+        child = self.get_child(value)
+        if child is not None:
+            logAPICall.log('found child with %s' % value, logAPICall.DEBUG_L2)
+            # recursive call to process next level
+            child.add(attr_vals, parse_order, level+1, additional_data, count)
+            return 
 
         # if no children found, then add new node for value and add modifier
-        if not child_found:
-            logAPICall.log('create new child with %s' % value, logAPICall.DEBUG_L2)
-            child = StatisticNode(self, attr_name, value, self.level+1, is_default, False)
-            self.children.append(child)
-            # recursive call to process next level
-            child.add(attr_vals, parse_order, level+1, additional_data)
+        logAPICall.log('create new child with %s' % value, logAPICall.DEBUG_L2)
+        child = StatisticNode(self, attr_name, value, self.level+1, is_default, False)
+        self.children.append(child)
+        self._child_index[str(value)] = child
+        self._indexed_children += 1
+        # recursive call to process next level
+        child.add(attr_vals, parse_order, level+1, additional_data, count)
         return        
     
     @logAPICall
@@ -489,7 +556,9 @@ class StatisticNode (object):
             child = self.children[0]
             if child.value is None:
                 # eliminate
+                child.parent = None
                 self.children = []
+                self._invalidate_child_index()
                 for grandchild in child.children:
                     grandchild.parent = self
                     self.children.append(grandchild)
@@ -533,6 +602,7 @@ class StatisticNode (object):
             # remove child
             weight = child.weight
             self.children.remove(child)
+            child.parent = None
             total_children -= 1            
             # evenly distribute deleted weight to sibling
             for child in self.children:
@@ -607,6 +677,7 @@ class StatisticNode (object):
             child.value = val
             child.weight = weight            
             idx += 1
+        self._invalidate_child_index()
         
     @logAPICall
     def update_children_complex(self, attribute, values, weights):
@@ -658,6 +729,7 @@ class StatisticNode (object):
                     # the children of the node to delete can still be preserved
                     child.value = added[0] 
                     added.remove(child.value)
+                    self._invalidate_child_index()
                 else:
                     # nothing to add, remove the children
                     to_delete.append(child.value)
@@ -18,8 +18,12 @@ Module class for statistic tree handling
 """
 from xml.etree import ElementTree
 from random import random 
+from math import log
+from array import array
+from itertools import izip
 
 from sidd.constants import logAPICall, ExtrapolateOptions
+from sidd.taxonomy import TaxonomyParseError
 from sidd.ms.exceptions import StatisticError
 from sidd.ms.node import StatisticNode
 
@@ -44,6 +48,8 @@ class Statistics (object):
         self.attributes = []
         self.leaves = []
         self.leaves_ordered = False
+        # compiled leaves for sampling, see get_leaf_table
+        self._leaf_table = None
         self.taxonomy = taxonomy
         self.skips.append(False)
         self.finalized = False
@@ -79,7 +85,16 @@ class Statistics (object):
 
     @logAPICall
     def has_node(self, node):
-        return self.root.matches(node)
+        """ test if node is part of the tree, by following its parents up to root """
+        while node is not None and node is not self.root:
+            parent = node.parent
+            if parent is None:
+                return False
+            # siblings with repeated value are not indexed, check list in that case
+            if parent.get_child(node.value) is not node and node not in parent.children:
+                return False
+            node = parent
+        return node is not None
 
     @logAPICall
     def add_case(self, taxstr, parse_order=None, parse_modifiers=True, additional_data={}, add_times=1):
@@ -87,6 +102,7 @@ class Statistics (object):
         add new case of the structural type (taxstr) to the distribution tree
         using given parse_order
         additional_data is aggregated at the leaf node only                
+        case is counted add_times, with a single traversal of the tree
         """
         # assert valid condition
         if self.finalized:
@@ -98,9 +114,48 @@ class Statistics (object):
 
         # parse string
         bldg_attrs = self.taxonomy.parse(taxstr)
+        if add_times < 1:
+            return
+        # additional data is given for single case
+        if add_times != 1:
+            additional_data = dict([(key, value * add_times) 
+                                    for key, value in additional_data.iteritems()])
         # update tree starting from root
-        for i in range(add_times):
-            self.root.add(bldg_attrs, parse_order, 0, additional_data)
+        self.root.add(bldg_attrs, parse_order, 0, additional_data, add_times)
+
+    @logAPICall
+    def add_cases(self, cases, parse_order=None, parse_modifiers=True):
+        """
+        add pre-aggregated cases to the distribution tree using given parse_order
+        cases is dictionary of taxstr => (count, size_sum, cost_sum), with 
+        size_sum/cost_sum set to None if not available. 
+        each distinct taxstr is added with a single traversal of the tree
+        return list of (taxstr, error) for cases that cannot be parsed
+        """
+        # assert valid condition
+        if self.finalized:
+            raise StatisticError('Statistics is already finalized and cannot be modified')
+        
+        # set parse_order
+        if parse_order is None:
+            parse_order = self.default_parse_order
+        
+        errors = []
+        for taxstr, (count, size_sum, cost_sum) in cases.iteritems():
+            try:
+                bldg_attrs = self.taxonomy.parse(taxstr)
+            except TaxonomyParseError as err:
+                errors.append((taxstr, err))
+                continue
+            if count < 1:
+                continue
+            additional_data = {}
+            if size_sum is not None:
+                additional_data[StatisticNode.AverageSize] = size_sum
+            if cost_sum is not None:
+                additional_data[StatisticNode.UnitCost] = cost_sum
+            self.root.add(bldg_attrs, parse_order, 0, additional_data, count)
+        return errors
 
     @logAPICall
     def finalize(self):
@@ -143,13 +198,11 @@ class Statistics (object):
         if len(values) == 0:
             return None
         node = self.root
-        # non-recursive search implementation
-        # can be optimized by using a recursive search        
+        # non-recursive search implementation, with indexed lookup of children
         for value in values:
-            for child in node.children: 
-                if value == child.value:
-                    node = child
-                    break
+            child = node.get_child(value)
+            if child is not None:
+                node = child
         if node == self.root:   # this means not find
             return None
         return node
@@ -167,6 +220,8 @@ class Statistics (object):
         # recursive delete, see StatisticNodes.delete_node
         parent = node.parent
         parent.delete_node(node)
+        # leaves are refreshed on next use
+        self.leaves = []
     
     @logAPICall
     def test_repeated_value(self, dest_node, branch):
@@ -226,6 +281,8 @@ class Statistics (object):
         # adjust weights proportionally
         if update_stats:
             node.balance_weights()
+        # leaves are refreshed on next use
+        self.leaves = []
     
     @logAPICall
     def delete_branch(self, node):
@@ -239,7 +296,10 @@ class Statistics (object):
         
         parent = node.parent
         parent.children.remove(node)
+        node.parent = None
         parent.balance_weights()
+        # leaves are refreshed on next use
+        self.leaves = []
         
 #        children_count = len(parent.children)
 #        if  children_count > 1:
@@ -262,6 +322,22 @@ class Statistics (object):
             raise StatisticError('stat must be finalized before modification')
         # recursively set weights, see StatisticNodes.set_child_weights
         node.set_child_weights(weights)
+        # leaves are refreshed on next use
+        self.leaves = []
+    
+    @logAPICall
+    def get_leaf_table(self):
+        """
+        leaves compiled into LeafTable for sampling
+        table is compiled again only when leaves are refreshed, which happens 
+        after the tree is modified through add_branch, delete_branch, 
+        delete_node or set_child_weights
+        """
+        if len(self.leaves)==0:
+            self.refresh_leaves(with_modifier=True, order_attributes=True)
+        if self._leaf_table is None or self._leaf_table.leaves is not self.leaves:
+            self._leaf_table = LeafTable(self.leaves)
+        return self._leaf_table
     
     @logAPICall
     def get_samples(self, total, method):
@@ -269,39 +345,7 @@ class Statistics (object):
         create n samples using statistic tree
         pre-condition: finalize() must be called first
         """
-        samples = {}
-        if len(self.leaves)==0:
-            self.refresh_leaves(with_modifier=True, order_attributes=True)
-        
-        if method == ExtrapolateOptions.Fraction or method == ExtrapolateOptions.FractionRounded:            
-            # multiple weights, size and replacement cost
-            for val, wt, node in self.leaves:
-                t_count = wt * total
-                if method == ExtrapolateOptions.FractionRounded:
-                    t_count = round(t_count)
-                size = node.get_additional_float(StatisticNode.AverageSize)
-                cost = node.get_additional_float(StatisticNode.UnitCost)
-                samples[val] = (val, t_count, t_count*size, t_count*size*cost)
-        else: 
-            # method=ExtrapolateOptions.RandomWalk
-            def get_leaf(leaves, thresh):                                
-                for val, wt, node in leaves:
-                    if wt < thresh:
-                        thresh -= wt
-                    else:
-                        return val, node
-                return val, node
-            
-            for i in range(total):
-                val, node = get_leaf(self.leaves, random())
-                size = node.get_additional_float(StatisticNode.AverageSize)
-                cost = node.get_additional_float(StatisticNode.UnitCost)   
-                if samples.has_key(val):
-                    t_val, t_count, t_size, t_cost = samples[val]
-                    samples[val] = (val, t_count+1, t_size+size, t_cost+size*cost)
-                else:
-                    samples[val]=(val, 1, size, size*cost)
-        return samples.values()
+        return self.get_leaf_table().get_samples(total, method)
     
     @logAPICall
     def get_tree(self):
@@ -335,6 +379,7 @@ class Statistics (object):
         # create new stats tree
         self.root = StatisticNode(None, 'root')
         self.root.from_xml(xmlnode)
+        self.leaves = []
     
     @logAPICall
     def from_xml_str(self, xmlstr):
@@ -343,3 +388,102 @@ class Statistics (object):
             raise StatisticError('input must be string')
         self.from_xml(ElementTree.fromstring(xmlstr))
 
+class LeafTable (object):
+    """
+    leaves of statistic tree compiled into arrays, for sampling 
+    the same distribution many times
+    - values: taxonomy string of each leaf
+    - weights, sizes, costs: weight, average size and unit cost of each leaf
+    """
+    
+    def __init__(self, leaves):
+        """ compile given list of (value, weight, node) """
+        self.leaves = leaves
+        self.values = [val for val, wt, node in leaves]
+        self.weights = array('d', [wt for val, wt, node in leaves])
+        self.sizes = array('d', [node.get_additional_float(StatisticNode.AverageSize) 
+                                 for val, wt, node in leaves])
+        self.costs = array('d', [node.get_additional_float(StatisticNode.UnitCost)
+                                 for val, wt, node in leaves])
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def get_samples(self, total, method):
+        """
+        create n samples from leaves
+        return list of (value, count, total size, total cost)
+        """
+        samples = {}
+        if method == ExtrapolateOptions.Fraction or method == ExtrapolateOptions.FractionRounded:            
+            # multiple weights, size and replacement cost
+            for val, wt, size, cost in izip(self.values, self.weights, self.sizes, self.costs):
+                t_count = wt * total
+                if method == ExtrapolateOptions.FractionRounded:
+                    t_count = round(t_count)
+                samples[val] = (val, t_count, t_count*size, t_count*size*cost)
+        else: 
+            # method=ExtrapolateOptions.RandomWalk
+            # same distribution as drawing leaf for each sample by weight,
+            # but counts of all leaves are drawn at once (multinomial) 
+            # size and replacement cost are applied once for each leaf
+            counts = self._multinomial(total)
+            for val, count, size, cost in izip(self.values, counts, self.sizes, self.costs):
+                if count == 0:
+                    continue
+                size *= count
+                if samples.has_key(val):
+                    t_val, t_count, t_size, t_cost = samples[val]
+                    samples[val] = (val, t_count+count, t_size+size, t_cost+size*cost)
+                else:
+                    samples[val]=(val, count, size, size*cost)
+        return samples.values()
+    
+    def _multinomial(self, total):
+        """
+        random count for each leaf, total samples distributed by leaf weight.
+        drawn as sequence of binomials, count of each leaf given samples left
+        for it and following leaves
+        """
+        weights = self.weights
+        remaining_wt = sum(weights)
+        if remaining_wt <= 0:
+            # no weights, all leaves equally likely
+            weights = [1.0] * len(weights)
+            remaining_wt = float(len(weights))
+        counts = [0] * len(weights)
+        remaining = total
+        for idx, wt in enumerate(weights):
+            if remaining <= 0 or remaining_wt <= 0:
+                break
+            counts[idx] = _binomial(remaining, wt / remaining_wt)
+            remaining -= counts[idx]
+            remaining_wt -= wt
+        # rounding in remaining weight, assign what is left to last leaf with weight
+        if remaining > 0:
+            for idx in range(len(weights)-1, -1, -1):
+                if weights[idx] > 0:
+                    counts[idx] += remaining
+                    break
+        return counts
+
+def _binomial(n, p):
+    """
+    random number of successes out of n trials with success probability p.
+    trials to next success are drawn directly (geometric distribution), 
+    so expected time is proportional to n * min(p, 1-p)
+    """
+    if n <= 0 or p <= 0:
+        return 0
+    if p >= 1:
+        return n
+    if p > 0.5:
+        return n - _binomial(n, 1.0 - p)
+    log_q = log(1.0 - p)
+    count, trials = 0, 0
+    while True:
+        trials += int(log(1.0 - random()) / log_q) + 1
+        if trials > n:
+            return count
+        count += 1
+
@@ -19,10 +19,10 @@ module constains class for loading footprint shapefiles
 from os.path import exists
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QGis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, \
-                      QgsVectorFileWriter, QgsFeature, QgsField, QgsGeometry
+from qgis.core import QGis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsField
 
-from utils.shapefile import load_shapefile, remove_shapefile, layer_features, layer_field_exists, layer_field_index
+from utils.shapefile import load_shapefile, remove_shapefile, layer_features, layer_field_exists, layer_field_index, \
+                            FeatureSink
 from utils.system import get_unique_filename
 
 from sidd.constants import logAPICall, \
@@ -73,6 +73,14 @@ class FootprintLoader(Operator):
         infile = self.inputs[0].value
         
         tmp_fp_layername = 'fp_%s' % get_unique_filename()
+        output_file = '%sfpc_%s.shp' % (self._tmp_dir, get_unique_filename())
+
+        # reuse centroids created from same input file if available
+        cache_key = self._get_cache_key([infile], [self._fp_ht_field])
+        if self._fetch_cached(cache_key, output_file):
+            self._load_output(output_file, tmp_fp_layername)
+            return
+
         tmp_fp_layer = load_shapefile(infile, tmp_fp_layername)
         if not tmp_fp_layer:
             raise OperatorError('Error loading footprint file' % (infile), self.__class__)
@@ -102,11 +110,9 @@ class FootprintLoader(Operator):
             3 : QgsField(AREA_FIELD_NAME, QVariant.Double),
             4 : QgsField(HT_FIELD_NAME, QVariant.Int),
         }
-        output_file = '%sfpc_%s.shp' % (self._tmp_dir, get_unique_filename())
         logAPICall.log('create outputfile %s ... ' % output_file, logAPICall.DEBUG)        
         try:
-            writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-            f = QgsFeature()
+            writer = FeatureSink(output_file, fields, QGis.WKBPoint, self._crs)
             gid = 0
             for _f in layer_features(tmp_fp_layer):
                 # NOTE: geom.transform does projection in place to underlying
@@ -128,35 +134,36 @@ class FootprintLoader(Operator):
                 
                 # write to file
                 gid += 1
-                f.setGeometry(QgsGeometry.fromPoint(t_centroid))
-                f.addAttribute(0, QVariant(gid))
-                f.addAttribute(1, QVariant(t_centroid.x()))
-                f.addAttribute(2, QVariant(t_centroid.y()))
-                f.addAttribute(3, QVariant(area))
                 if ht_idx != -1:
-                    f.addAttribute(4, _f.attributeMap()[ht_idx])
+                    ht = _f.attributeMap()[ht_idx].toInt()[0]
                 else:
-                    f.addAttribute(4, QVariant(0))
-                writer.addFeature(f)            
-            del writer, f
+                    ht = 0
+                writer.write_point([gid, t_centroid.x(), t_centroid.y(), area, ht],
+                                   t_centroid.x(), t_centroid.y())
+            writer.close()
         except Exception as err:
             remove_shapefile(output_file)
             raise OperatorError("error creating footprint centroids: %s" % err, self.__class__)
 
-        fp_layer = load_shapefile(output_file, tmp_fp_layername)
-        if not fp_layer:
-            raise OperatorError('Error loading footprint centroid file' % (output_file), self.__class__)        
-        
         # clean up
         del tmp_fp_layer
+
+        self._store_cached(cache_key, output_file)
+        self._load_output(output_file, tmp_fp_layername)
+
+    # protected method override
+    ###########################
+
+    def _load_output(self, output_file, output_layername):
+        """ load footprint centroid file and store in output """
+        fp_layer = load_shapefile(output_file, output_layername)
+        if not fp_layer:
+            raise OperatorError('Error loading footprint centroid file' % (output_file), self.__class__)        
         
         # store data in output
         self.outputs[0].value = fp_layer
         self.outputs[1].value = output_file
 
-    # protected method override
-    ###########################
-
     def _verify_inputs(self, inputs):
         """ perform operator specific input validation """
 
@@ -19,11 +19,10 @@ module constains class for loading footprint shapefiles
 from os.path import exists
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QGis, QgsCoordinateTransform, \
-                      QgsVectorFileWriter, QgsFeature, QgsField
+from qgis.core import QGis, QgsCoordinateTransform, QgsField
 
 from utils.shapefile import load_shapefile, load_shapefile_verify, remove_shapefile, \
-                      layer_features, layer_field_index
+                      layer_features, layer_field_index, FeatureSink
 from utils.system import get_unique_filename
 
 from sidd.constants import logAPICall, \
@@ -75,7 +74,14 @@ class PopGridLoader(Operator):
         # load and verify
         popgrid_file = self.inputs[0].value
         pop_field = self.inputs[1].value
-        
+        output_file = '%spop_grid_%s.shp' % (self._tmp_dir, get_unique_filename())
+
+        # reuse population grid created from same input file if available
+        cache_key = self._get_cache_key([popgrid_file], [pop_field])
+        if self._fetch_cached(cache_key, output_file):
+            self._load_output(output_file, 'popgrid_%s' % get_unique_filename())
+            return
+
         popgrid_layername = 'zone_%s' % get_unique_filename()
         try:
             tmp_popgrid_layer = load_shapefile_verify(popgrid_file, popgrid_layername,
@@ -97,11 +103,9 @@ class PopGridLoader(Operator):
             1 : QgsField(CNT_FIELD_NAME, QVariant.Double),
         }
         pop_idx = layer_field_index(tmp_popgrid_layer, pop_field)
-        output_file = '%spop_grid_%s.shp' % (self._tmp_dir, get_unique_filename())
         logAPICall.log('create outputfile %s ... ' % output_file, logAPICall.DEBUG)        
         try:
-            writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-            f = QgsFeature()
+            writer = FeatureSink(output_file, fields, QGis.WKBPoint, self._crs)
             gid = 0
             for _f in layer_features(tmp_popgrid_layer):
                 # NOTE: geom.transform does projection in place to underlying C object
@@ -114,30 +118,31 @@ class PopGridLoader(Operator):
                 
                 # 3. write to file
                 gid += 1
-                f.setGeometry(geom)
-                f.addAttribute(0, QVariant(gid))
-                f.addAttribute(1, _f.attributeMap()[pop_idx])
-                writer.addFeature(f)            
-            del writer, f
+                writer.write([gid, _f.attributeMap()[pop_idx].toDouble()[0]], geom)
+            writer.close()
         except Exception as err:
             remove_shapefile(output_file)
             raise OperatorError("error creating footprint centroids: %s" % err, self.__class__)
 
-        popgrid_layername = 'popgrid_%s' % get_unique_filename()
-        popgrid_layer = load_shapefile(output_file, popgrid_layername)
-        if not popgrid_layer:
-            raise OperatorError('Error loading footprint centroid file' % (output_file), self.__class__)        
-        
         # clean up
         del tmp_popgrid_layer
-        
-        # store data in output
-        self.outputs[0].value = popgrid_layer
-        self.outputs[1].value = output_file
+
+        self._store_cached(cache_key, output_file)
+        self._load_output(output_file, 'popgrid_%s' % get_unique_filename())
 
     # protected method override
     ###########################
 
+    def _load_output(self, output_file, output_layername):
+        """ load population grid file and store in output """
+        popgrid_layer = load_shapefile(output_file, output_layername)
+        if not popgrid_layer:
+            raise OperatorError('Error loading population grid file %s' % (output_file), self.__class__)
+
+        # store data in output
+        self.outputs[0].value = popgrid_layer
+        self.outputs[1].value = output_file
+
     def _verify_inputs(self, inputs):
         """ perform operator specific input validation """
 
@@ -23,9 +23,9 @@ import datetime
 from os.path import exists
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QGis, QgsVectorFileWriter, QgsFeature, QgsField, QgsGeometry, QgsPoint
+from qgis.core import QGis, QgsField
 
-from utils.shapefile import load_shapefile_verify, remove_shapefile
+from utils.shapefile import load_shapefile_verify, remove_shapefile, FeatureSink
 from utils.system import get_unique_filename
 
 from sidd.taxonomy.gem import GemTaxonomyAttribute
@@ -107,10 +107,14 @@ class GEMDBSurveyLoader(Operator):
         project = self.inputs[2].value
         
         tmp_survey_file = '%ssurvey_%s.shp' % (self._tmp_dir, get_unique_filename())
-        # load survey        
+        # load survey, reuse survey loaded with same input and height/year ranges if available
+        cache_key = self._get_cache_key([survey],
+                                        [self.inputs[1].value, project,
+                                         getattr(self, 'ht_ranges', None), getattr(self, 'yr_ranges', None)])
         try:
-            self._loadSurvey(survey, tmp_survey_file, project)
-            
+            if not self._fetch_cached(cache_key, tmp_survey_file):
+                self._loadSurvey(survey, tmp_survey_file, project)
+                self._store_cached(cache_key, tmp_survey_file)
         except Exception as err:
             remove_shapefile(tmp_survey_file)
             raise OperatorError("Error Loading Survey\n%s" % err,
@@ -164,8 +168,7 @@ class GEMDBSurveyLoader(Operator):
         conn.close()
         
     def _buildSurveyLayer(self, data,  shapefilepath):
-        writer = QgsVectorFileWriter(shapefilepath, "utf-8", self._fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-        f = QgsFeature()
+        writer = FeatureSink(shapefilepath, self._fields, QGis.WKBPoint, self._crs)
         for row in data:
             obj_uid = str(row[0])
             lon = self._tofloat(row[1])
@@ -176,17 +179,9 @@ class GEMDBSurveyLoader(Operator):
             tax_string = self._make_gem_taxstring(row[6:])
             ht = self._get_height(row[6:]) 
             
-            f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
-            f.addAttribute(0, QVariant(obj_uid))
-            f.addAttribute(1, QVariant(lon))
-            f.addAttribute(2, QVariant(lat))
-            f.addAttribute(3, QVariant(tax_string))
-            f.addAttribute(4, QVariant(sample_grp))
-            f.addAttribute(5, QVariant(plan_area))
-            f.addAttribute(6, QVariant(ht))
-            f.addAttribute(7, QVariant(rep_cost))
-            writer.addFeature(f)
-        del writer, f
+            writer.write_point([obj_uid, lon, lat, tax_string, sample_grp, plan_area, ht, rep_cost],
+                               lon, lat)
+        writer.close()
         
     def _make_gem_taxstring(self, data):
         (mat_type_l, mat_tech_l, mas_rein_l, mas_mort_l, steel_con_l, 
@@ -361,23 +356,17 @@ class CSVSurveyLoader(GEMDBSurveyLoader):
         """ constructor """
         super(CSVSurveyLoader, self).__init__(options, name)
     
-    def _loadSurvey(self, csvpath, shapefilepath):
+    def _loadSurvey(self, csvpath, shapefilepath, proj_uid=None):
         # load data
         data = csv.reader(open(csvpath, 'r'), delimiter=',', quotechar='"')
         # skip header, there is probably a better way to accomplish this
         data.next()
-        writer = QgsVectorFileWriter(shapefilepath, "utf-8", self._fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-        f = QgsFeature()
+        writer = FeatureSink(shapefilepath, self._fields, QGis.WKBPoint, self._crs)
         gid = 0
         for row in data:
             lon = float(row[0])
             lat = float(row[1])
-            f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
             gid+=1
-            f.addAttribute(0, QVariant(gid))
-            f.addAttribute(1, QVariant(lon))
-            f.addAttribute(2, QVariant(lat))
-            f.addAttribute(3, QVariant(row[2]))
-            writer.addFeature(f)
-        del writer, f        
+            writer.write_point([gid, lon, lat, row[2]], lon, lat)
+        writer.close()        
         
\ No newline at end of file
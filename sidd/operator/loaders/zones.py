@@ -19,9 +19,10 @@ module constains class for loading zone shapefiles
 from os.path import exists
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QGis, QgsCoordinateTransform, QgsVectorFileWriter, QgsFeature, QgsField
+from qgis.core import QGis, QgsCoordinateTransform, QgsFeature, QgsField
 
-from utils.shapefile import load_shapefile_verify, remove_shapefile, layer_features, layer_field_index, load_shapefile
+from utils.shapefile import load_shapefile_verify, remove_shapefile, layer_features, layer_field_index, load_shapefile, \
+                            FeatureSink
 from utils.system import get_unique_filename
 
 from sidd.constants import logAPICall, GID_FIELD_NAME
@@ -74,8 +75,16 @@ class ZoneLoader(Operator):
         # load data
         zone_file = self.inputs[0].value
         zone_field = self.inputs[1].value
-        
+
         zone_layername = 'zone_%s' % get_unique_filename()
+        output_file = '%szone_%s.shp' % (self._tmp_dir, get_unique_filename())
+
+        # reuse zones created from same input file and fields if available
+        cache_key = self._get_cache_key([zone_file], [_in.value for _in in self.inputs[1:]])
+        if self._fetch_cached(cache_key, output_file):
+            self._load_output(output_file, zone_layername)
+            return
+
         try:
             tmp_zone_layer = load_shapefile_verify(zone_file, zone_layername,
                                                    [zone_field])
@@ -90,7 +99,6 @@ class ZoneLoader(Operator):
             transform_required = False
         
         # output grid
-        output_file = '%szone_%s.shp' % (self._tmp_dir, get_unique_filename())
         logAPICall.log('create outputfile %s ... ' % output_file, logAPICall.DEBUG)
         try:
             # get the indices to use
@@ -99,7 +107,7 @@ class ZoneLoader(Operator):
             fields = self._getFields(tmp_zone_layer)
             fields2 = fields.copy()
             fields2[0] = QgsField(GID_FIELD_NAME, QVariant.Int) # add GID field
-            writer = QgsVectorFileWriter(output_file, "utf-8", fields2, QGis.WKBPolygon, self._crs, "ESRI Shapefile")
+            writer = FeatureSink(output_file, fields2, QGis.WKBPolygon, self._crs)
             
             # loop and create output file
             f = QgsFeature()
@@ -119,25 +127,31 @@ class ZoneLoader(Operator):
                         f.addAttribute(fkey, _f.attributeMap()[fidx])
                 writer.addFeature(f)
             
-            del writer, f
+            writer.close()
+            del f
         except Exception as err:
             remove_shapefile(output_file)
             raise OperatorError("error creating zone: %s" % err, self.__class__)
 
-        zone_layer = load_shapefile(output_file, zone_layername)
-        if not zone_layer:
-            raise OperatorError('Error loading footprint centroid file' % (output_file), self.__class__)        
-        
         # clean up
         del tmp_zone_layer
 
-        # store data in output
-        self.outputs[0].value = zone_layer
-        self.outputs[1].value = output_file
+        self._store_cached(cache_key, output_file)
+        self._load_output(output_file, zone_layername)
 
     # protected method override
     ###########################
 
+    def _load_output(self, output_file, output_layername):
+        """ load zone file and store in output """
+        zone_layer = load_shapefile(output_file, output_layername)
+        if not zone_layer:
+            raise OperatorError('Error loading zone file %s' % (output_file), self.__class__)
+
+        # store data in output
+        self.outputs[0].value = zone_layer
+        self.outputs[1].value = output_file
+
     def _verify_inputs(self, inputs):
         """ perform operator specific input validation """
         if not exists(inputs[0].value):
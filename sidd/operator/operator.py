@@ -16,12 +16,20 @@
 """
 base class for SIDD operators 
 """
+import hashlib
+from itertools import izip
+
 from qgis.core import QgsCoordinateReferenceSystem
 
-from sidd.constants import logAPICall, LON_FIELD_NAME, LAT_FIELD_NAME, TAX_FIELD_NAME, GID_FIELD_NAME
+from sidd.constants import logAPICall, LON_FIELD_NAME, LAT_FIELD_NAME, TAX_FIELD_NAME, GID_FIELD_NAME, \
+                           DEFAULT_MEMORY_BUDGET
 from data import OperatorData
 from exception import OperatorError, OperatorDataError
-from utils.shapefile import layer_field_index
+from utils.shapefile import layer_field_index, layer_feature_batches, LayerWriter
+from utils.grid import GridCoverage
+from utils.memory import MemoryBudget
+
+from sidd.taxonomy import TaxonomyDictionary
 
 class Operator(object):
     """
@@ -33,6 +41,8 @@ class Operator(object):
     _inputs = []
     # list of outputs, outputs will be validated before operation
     _outputs = []
+    # estimated memory used by each record kept in memory by operator 
+    bytes_per_record = 200
 
     # static factory method 
     ###########################
@@ -64,6 +74,10 @@ class Operator(object):
         self._lat_field = LAT_FIELD_NAME 
         self._tax_field = TAX_FIELD_NAME
         self._gid_field = GID_FIELD_NAME 
+        
+        # collect run statistics if profiler is set
+        if isinstance(options, dict) and options.get('profiler', None) is not None:
+            self.do_operation = options['profiler'].wrap(self, self.do_operation)
 
     # self documenting method signatures
     ###########################
@@ -191,6 +205,146 @@ class Operator(object):
         """
         raise NotImplementedError("abstract method not implemented")     
     
+    # common cache methods
+    ###########################
+
+    def _get_cache(self):
+        """ return shapefile cache shared by operators, None if caching is not enabled """
+        if isinstance(self._options, dict):
+            return self._options.get('cache', None)
+        return None
+
+    def _get_cache_key(self, files=[], params=[]):
+        """ 
+        return key identifying output of this operator for given input files and parameters
+        or None if caching is not enabled
+        """
+        cache = self._get_cache()
+        if cache is None:
+            return None
+        return cache.get_key(self.__class__.__name__, files, params)
+
+    def _fetch_cached(self, key, output_file):
+        """ copy cached shapefile into output_file. return True if found in cache """
+        if key is None:
+            return False
+        if self._get_cache().fetch(key, output_file):
+            logAPICall.log('%s reused cached output %s' % (self.name, key), logAPICall.DEBUG)
+            return True
+        return False
+
+    def _store_cached(self, key, output_file):
+        """ store shapefile in cache """
+        if key is not None:
+            self._get_cache().store(key, output_file)
+
+    def _zone_coverage(self, zone_layer):
+        """
+        grid cell x zone coverage matrix for zones in given layer, with zones 
+        identified by GID. matrix is kept in project (grid_coverage option) 
+        and in shapefile cache if enabled, and reused as long as zone 
+        geometries do not change
+        """
+        gids, geometries = [], []
+        digest = hashlib.md5()
+        for batch in layer_feature_batches(zone_layer, [GID_FIELD_NAME], with_geometry=True):
+            for gid, wkt in izip(batch[GID_FIELD_NAME], batch['geometry']):
+                gids.append(gid)
+                geometries.append(wkt)
+                digest.update('%s|%s\n' % (gid, wkt))
+        key = digest.hexdigest()
+
+        store, max_workers = None, 1
+        if isinstance(self._options, dict):
+            store = self._options.get('grid_coverage', None)
+            max_workers = self._options.get('max_workers', 1)
+        if store is not None and store.has_key(key):
+            logAPICall.log('%s reused grid coverage %s' % (self.name, key), logAPICall.DEBUG)
+            return store[key]
+
+        cache = self._get_cache()
+        cache_key = None
+        coverage = None
+        if cache is not None:
+            cache_key = cache.get_key('GridCoverage', [], [key])
+            coverage = cache.fetch_data(cache_key)
+        if coverage is not None:
+            logAPICall.log('%s reused cached grid coverage %s' % (self.name, key), logAPICall.DEBUG)
+        else:
+            coverage = GridCoverage()
+            # zones are split into tiles processed in parallel if allowed
+            coverage.add_zones(gids, geometries, max_workers)
+            if cache is not None:
+                cache.store_data(cache_key, coverage)
+        if store is not None:
+            # only matrix for current zones is kept
+            store.clear()
+            store[key] = coverage
+        return coverage
+
+    # common output methods
+    ###########################
+
+    def _create_layer_writer(self, output_file, fields, geometry_type):
+        """
+        return writer for intermediate layer passed on to next operator.
+        layer is kept in memory unless it has more features than allowed by
+        memory_layer_features option, only then output_file is created
+        """
+        max_features = 0
+        if isinstance(self._options, dict):
+            max_features = self._options.get('memory_layer_features', 0)
+        if max_features > 0:
+            max_features = min(max_features, self._max_records())
+        return LayerWriter(output_file, fields, geometry_type, self._crs, max_features, 
+                           self._memory_budget())
+
+    def _taxonomy_dictionary(self):
+        """ 
+        taxonomy dictionary shared by all operators in project, 
+        new dictionary if not set in options 
+        """
+        dictionary = None
+        if isinstance(self._options, dict):
+            dictionary = self._options.get('taxonomy_dictionary', None)
+        if dictionary is None:
+            dictionary = TaxonomyDictionary()
+        return dictionary
+
+    def _expand_taxonomy(self):
+        """ test if taxonomy IDs should be expanded into taxonomy strings on export """
+        if isinstance(self._options, dict):
+            return self._options.get('export.expand_taxonomy', True)
+        return True
+
+    # memory budget methods
+    ###########################
+
+    def _memory_budget(self):
+        """ memory budget shared by all operators, default budget if not set in options """
+        budget = None
+        if isinstance(self._options, dict):
+            budget = self._options.get('memory_budget', None)
+        if budget is None:
+            budget = MemoryBudget(DEFAULT_MEMORY_BUDGET)
+        return budget
+
+    def _max_records(self):
+        """ 
+        number of records of bytes_per_record that operator can keep in memory. 
+        available memory is shared with operators that may run concurrently 
+        """
+        max_workers = 1
+        if isinstance(self._options, dict):
+            max_workers = max(1, self._options.get('max_workers', 1))
+        return self._memory_budget().max_records(self.bytes_per_record, max_workers)
+
+    def _output_file(self, writer):
+        """ output_file created by given writer, None if layer is kept in memory """
+        if writer.in_memory:
+            return None
+        return writer.output_file
+
     # common input test methods
     ###########################
     
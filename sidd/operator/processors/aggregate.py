@@ -17,18 +17,17 @@
 module contains class for creating mapping scheme from survey data
 """
 
-import bsddb
-import os 
 import math
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QGis, QgsVectorFileWriter, QgsFeature, QgsField, QgsGeometry, QgsPoint
+from qgis.core import QGis, QgsField
 
-from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile
+from utils.shapefile import load_shapefile, layer_feature_batches, remove_shapefile, FeatureSink
 from utils.system import get_unique_filename
+from utils.accumulator import CellAccumulator
 
 from sidd.constants import logAPICall, \
-                           CNT_FIELD_NAME, DEFAULT_GRID_SIZE, MAX_FEATURES_IN_MEMORY
+                           CNT_FIELD_NAME, DEFAULT_GRID_SIZE
 from sidd.operator import Operator, OperatorError
 from sidd.operator.data import OperatorDataTypes
 
@@ -77,30 +76,14 @@ class FootprintAggregator(Operator):
 
         # aggregate footprint into grids
         logAPICall.log('aggregate statistic for grid ...', logAPICall.DEBUG)
-        total_features = fp_layer.dataProvider().featureCount()
-        if total_features > MAX_FEATURES_IN_MEMORY:
-            # use bsddb to store temporary lat/lon
-            tmp_db_file = '%sdb_%s.db' % (self._tmp_dir, get_unique_filename())
-            db = bsddb.btopen(tmp_db_file, 'c')
-            use_db = True
-        else:
-            db = {}
-            use_db = False
-
-        zone_idx = layer_field_index(fp_layer, zone_field)
-        for f in layer_features(fp_layer):
-            geom = f.geometry()
-            zone_str = str(f.attributeMap()[zone_idx].toString())
-            centroid  = geom.centroid().asPoint()
+        tmp_acc_file = '%sacc_%s.dat' % (self._tmp_dir, get_unique_filename())
+        accumulator = CellAccumulator(tmp_acc_file)
+        for batch in layer_feature_batches(fp_layer, [zone_field], with_centroid=True):
             # use floor, this truncates all points within grid to grid's
-            # bottom-left corner                        
-            x = math.floor(centroid.x() / DEFAULT_GRID_SIZE)
-            y = math.floor(centroid.y() / DEFAULT_GRID_SIZE)
-            key = '%s %d %d' % (zone_str, x,y)
-            if db.has_key(key):
-                db[key] = str(int(db[key]) + 1)
-            else:
-                db[key] = '1'
+            # bottom-left corner
+            rows = [int(math.floor(cy / DEFAULT_GRID_SIZE)) for cy in batch['y']]
+            cols = [int(math.floor(cx / DEFAULT_GRID_SIZE)) for cx in batch['x']]
+            accumulator.add_cells(batch[zone_field], rows, cols)
         
         # output grid
         logAPICall.log('create grid ...', logAPICall.DEBUG)
@@ -113,23 +96,17 @@ class FootprintAggregator(Operator):
         grid_layername = 'grid_%s' % get_unique_filename()
         grid_file = '%s%s.shp' % (self._tmp_dir, grid_layername)
         try:
-            writer = QgsVectorFileWriter(grid_file, "utf-8", fields, QGis.WKBPoint , self._crs, "ESRI Shapefile")
-            f = QgsFeature()
-            for key, val in db.iteritems():
-                (zone_str, x, y) = key.split(' ')
+            writer = FeatureSink(grid_file, fields, QGis.WKBPoint, self._crs)
+            for zone_str, y, x, val in accumulator.cells():
                 # point were aggregated to grid's bottom-left corner
                 # add half grid size to place point at center of grid
-                point = QgsPoint(int(x)*DEFAULT_GRID_SIZE+(DEFAULT_GRID_SIZE/2.0), 
-                                 int(y)*DEFAULT_GRID_SIZE+(DEFAULT_GRID_SIZE/2.0))
-                f.setGeometry(QgsGeometry.fromPoint(point))
-                f.addAttribute(0, QVariant(point.x()))
-                f.addAttribute(1, QVariant(point.y()))
-                f.addAttribute(2, QVariant(val))
-                f.addAttribute(3, QVariant(zone_str))
-                writer.addFeature(f)
-            del writer
+                lon = x*DEFAULT_GRID_SIZE+(DEFAULT_GRID_SIZE/2.0)
+                lat = y*DEFAULT_GRID_SIZE+(DEFAULT_GRID_SIZE/2.0)
+                writer.write_point([lon, lat, float(val), zone_str], lon, lat)
+            writer.close()
         except Exception as err:
             remove_shapefile(grid_file)
+            accumulator.close()
             raise OperatorError("error creating joined grid: " % err, self.__class__)
         
         grid_layer = load_shapefile(grid_file, grid_layername)
@@ -137,9 +114,7 @@ class FootprintAggregator(Operator):
             raise OperatorError('Error loading created grid file' % (grid_file), self.__class__)
                 
         # clean up                
-        if use_db:
-            db.close()
-            os.remove(tmp_db_file)
+        accumulator.close()
             
         # done
         self.outputs[0].value = grid_layer
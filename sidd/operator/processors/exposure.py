@@ -16,18 +16,20 @@
 """
 module contains class for applying mapping scheme
 """
-import bsddb 
+from itertools import izip
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QgsVectorFileWriter, QgsFeature, QgsField
+from qgis.core import QgsField
 
-from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile
+from utils.shapefile import load_shapefile, layer_feature_batches, layer_field_index, remove_shapefile, \
+                           FeatureSink
 from utils.system import get_unique_filename
-from utils.grid import latlon_to_grid, grid_to_latlon
+from utils.grid import latlon_to_grids, grid_to_latlon
+from utils.accumulator import KeyValueAggregator
  from sidd.constants import logAPICall, ExtrapolateOptions, \
     GID_FIELD_NAME, LON_FIELD_NAME, LAT_FIELD_NAME, CNT_FIELD_NAME, TAX_FIELD_NAME, \
-    ZONE_FIELD_NAME, AREA_FIELD_NAME, COST_FIELD_NAME, \
-    MAX_FEATURES_IN_MEMORY
+    TAX_ID_FIELD_NAME, ZONE_FIELD_NAME, AREA_FIELD_NAME, COST_FIELD_NAME
+from sidd.taxonomy import get_lookup_file
 from sidd.operator import Operator, OperatorError
 from sidd.operator.data import OperatorDataTypes
 
@@ -35,6 +37,11 @@ from sidd.operator.data import OperatorDataTypes
 from grids import ToGrid
 
 class GridMSApplier(Operator):    
+    """
+    apply mapping scheme to building counts of grid cells
+    NOTE: building types are written as taxonomy IDs, with lookup table 
+          of IDs to taxonomy strings written next to exposure file
+    """
     def __init__(self, options=None, name='Grid Mapping Scheme Applier'):
         super(GridMSApplier, self).__init__(options, name)
         self._tmp_dir = options['tmp_dir']
@@ -46,7 +53,7 @@ class GridMSApplier(Operator):
         self._fields = {0: QgsField(GID_FIELD_NAME, QVariant.Int),
                         1: QgsField(LON_FIELD_NAME, QVariant.Double),
                         2: QgsField(LAT_FIELD_NAME, QVariant.Double),
-                        3: QgsField(TAX_FIELD_NAME, QVariant.String, "", 255),
+                        3: QgsField(TAX_ID_FIELD_NAME, QVariant.Int),
                         4: QgsField(ZONE_FIELD_NAME, QVariant.String),
                         5: QgsField(CNT_FIELD_NAME, QVariant.Int),
                         6: QgsField(AREA_FIELD_NAME, QVariant.Double),
@@ -123,67 +130,59 @@ class GridMSApplier(Operator):
         gid_idx = layer_field_index(src_layer, GID_FIELD_NAME)
         if gid_idx == -1:
             raise OperatorError("field %s not found in input layer" % GID_FIELD_NAME, self.__class__)
-        area_idx = layer_field_index(src_layer, AREA_FIELD_NAME)
-        
-        provider.select(provider.attributeIndexes(), provider.extent())
-        provider.rewind()
+        read_fields = [GID_FIELD_NAME, zone_field, count_field]
+        has_area = layer_field_index(src_layer, AREA_FIELD_NAME) > 0
+        if has_area:
+            read_fields.append(AREA_FIELD_NAME)
 
+        dictionary = self._taxonomy_dictionary()
         try:
-            writer = QgsVectorFileWriter(exposure_file, "utf-8", self._fields, provider.geometryType(), self._crs, "ESRI Shapefile")
-            out_feature = QgsFeature()
+            writer = FeatureSink(exposure_file, self._fields, provider.geometryType(), self._crs)
             
-            gid = 0
-            for in_feature in layer_features(src_layer):
-                geom = in_feature.geometry()
-                centroid = geom.centroid().asPoint ()
-                gid = in_feature.attributeMap()[gid_idx]
-                zone_str = str(in_feature.attributeMap()[zone_idx].toString())
-                count = in_feature.attributeMap()[count_idx].toDouble()[0]
-                if area_idx > 0:
-                    area = in_feature.attributeMap()[area_idx].toDouble()[0]
-                else:
-                    area = 0
+            for batch in layer_feature_batches(src_layer, read_fields,
+                                               with_centroid=True, with_geometry=True):
+                for _idx in xrange(len(batch[GID_FIELD_NAME])):
+                    count = int(batch[count_field][_idx]+0.5)
+                    if count == 0:
+                        continue                            
                 
-                count = int(count+0.5)
-                if count == 0:
-                    continue                            
+                    gid = batch[GID_FIELD_NAME][_idx]
+                    zone_str = batch[zone_field][_idx]
+                    if has_area:
+                        area = batch[AREA_FIELD_NAME][_idx]
+                    else:
+                        area = 0
+                    # geometry only created for cells with buildings
+                    geom = writer.geometry(batch['geometry'][_idx])
+                    centroid_x, centroid_y = batch['x'][_idx], batch['y'][_idx]
                 
-                stats = ms.get_assignment_by_name(zone_str)
+                    leaf_table = ms.get_leaf_table(zone_str)
                 
-                # use default stats if missing
-                if stats is None:
-                    raise Exception("no mapping scheme found for zone %s" % zone_str)
+                    # use default stats if missing
+                    if leaf_table is None:
+                        raise Exception("no mapping scheme found for zone %s" % zone_str)
                 
-                for _sample in stats.get_samples(count, self._extrapolationOption):
-                    # write out if there are structures assigned
-                    _type = _sample[0]
-                    _cnt = _sample[1]
+                    for _sample in leaf_table.get_samples(count, self._extrapolationOption):
+                        # write out if there are structures assigned
+                        _type = dictionary.get_id(_sample[0])
+                        _cnt = _sample[1]
                     
-                    if area > 0:
-                        # use area provided by footprint/zone if defined
-                        _size = area * ( float(_sample[1]) / count )
-                        if _sample[3] > 0 and _sample[2] > 0:
-                            _cost = (_sample[3] / _sample[2]) * area
+                        if area > 0:
+                            # use area provided by footprint/zone if defined
+                            _size = area * ( float(_sample[1]) / count )
+                            if _sample[3] > 0 and _sample[2] > 0:
+                                _cost = (_sample[3] / _sample[2]) * area
+                            else:
+                                _cost = 0
                         else:
-                            _cost = 0
-                    else:
-                        # use mapping scheme generic area otherwise
-                        _size = _sample[2]
-                        _cost = _sample[3]
+                            # use mapping scheme generic area otherwise
+                            _size = _sample[2]
+                            _cost = _sample[3]
                     
-                    if _cnt > 0:
-                        out_feature.setGeometry(geom)
-                        #out_feature.addAttribute(0, QVariant(gid))
-                        out_feature.addAttribute(0, gid)
-                        out_feature.addAttribute(1, QVariant(centroid.x()))
-                        out_feature.addAttribute(2, QVariant(centroid.y()))
-                        out_feature.addAttribute(3, QVariant(_type))
-                        out_feature.addAttribute(4, QVariant(zone_str))
-                        out_feature.addAttribute(5, QVariant(_cnt))
-                        out_feature.addAttribute(6, QVariant(_size))
-                        out_feature.addAttribute(7, QVariant(_cost))
-                        writer.addFeature(out_feature)
-            del writer, out_feature
+                        if _cnt > 0:
+                            writer.write([gid, centroid_x, centroid_y, _type, zone_str, _cnt, _size, _cost], geom)
+            writer.close()
+            dictionary.write(get_lookup_file(exposure_file))
         except Exception as err:
             remove_shapefile(exposure_file)
             raise OperatorError("error creating exposure file: %s" % err, self.__class__)
@@ -263,27 +262,20 @@ class SurveyAggregator(GridMSApplier, ToGrid):
         #       because the data layer maybe is not loaded yet
         self._test_layer_loaded(svy_layer)
         
-        total_features = svy_layer.dataProvider().featureCount()
-        if total_features > MAX_FEATURES_IN_MEMORY:
-            # use bsddb to store temporary lat/lon
-            tmp_db_file = '%sdb_%s.db' % (self._tmp_dir, get_unique_filename())
-            db = bsddb.btopen(tmp_db_file, 'c')            
-        else:
-            db = {}
-
         # tally statistics for each grid_id/building type combination
-        tax_idx = layer_field_index(svy_layer, TAX_FIELD_NAME)
-        for f in layer_features(svy_layer):
-            geom = f.geometry()
-            centroid  = geom.centroid().asPoint()
-            grid_id = latlon_to_grid(centroid.y(), centroid.x())                        
-            tax_str = str(f.attributeMap()[tax_idx].toString())
-
-            key = '%s %s' % (tax_str, grid_id)
-            if db.has_key(key):
-                db[key] = str(int(db[key]) + 1) # value as string required by bsddb
-            else:
-                db[key] = '1'                   # value as string required by bsddb
+        # building type is tallied by its taxonomy ID
+        # NOTE: only combinations found in survey are kept, each cell
+        #       usually has few of all building types in survey
+        dictionary = self._taxonomy_dictionary()
+        get_id = dictionary.get_id
+        accumulator = KeyValueAggregator(self._tmp_dir, self._max_records(),
+                                         budget=self._memory_budget())
+        for batch in layer_feature_batches(svy_layer, [TAX_FIELD_NAME], with_centroid=True):
+            totals = {}
+            for key in izip(latlon_to_grids(batch['y'], batch['x']),
+                            [get_id(tax_str) for tax_str in batch[TAX_FIELD_NAME]]):
+                totals[key] = totals.get(key, 0) + 1
+            accumulator.add_items(totals.iteritems())
 
         # loop through all zones and assign mapping scheme
         # outputs
@@ -291,28 +283,20 @@ class SurveyAggregator(GridMSApplier, ToGrid):
         exposure_file = '%s%s.shp' % (self._tmp_dir, exposure_layername)
 
         try:
-            writer = QgsVectorFileWriter(exposure_file, "utf-8", 
-                                         self._fields, self._outputGeometryType(), self._crs, 
-                                         "ESRI Shapefile")
-            f = QgsFeature()            
-            gid = 0
-            for key, val in db.iteritems():
-                (tax_str, grid_id) = key.split(' ')
-                lon, lat = grid_to_latlon(int(grid_id))
+            writer = FeatureSink(exposure_file, self._fields, self._outputGeometryType(), self._crs)
+            for (grid_id, tax_id), val in accumulator.items():
+                lon, lat = grid_to_latlon(grid_id)
                 
-                f.setGeometry(self._outputGeometryFromGridId(grid_id))
-                f.addAttribute(0, QVariant(grid_id))
-                f.addAttribute(1, QVariant(lon))
-                f.addAttribute(2, QVariant(lat))
-                f.addAttribute(3, QVariant(tax_str))
-                f.addAttribute(4, QVariant(''))
-                f.addAttribute(5, QVariant(val))
-                writer.addFeature(f)
-                gid += 1
-            del writer, f
+                x_min, y_min, x_max, y_max = self._outputExtentFromGridId(grid_id)
+                writer.write_rect([grid_id, lon, lat, tax_id, '', int(val)],
+                                  x_min, y_min, x_max, y_max)
+            writer.close()
+            dictionary.write(get_lookup_file(exposure_file))
         except Exception as err:
             remove_shapefile(exposure_file)
             raise OperatorError("error creating exposure file: %s" % err, self.__class__)
+        finally:
+            accumulator.close()
         
         # load shapefile as layer        
         exposure_layer = load_shapefile(exposure_file, exposure_layername)
@@ -17,12 +17,14 @@
 module to support grid exposure database write out
 """
 from math import floor, ceil
+from itertools import izip
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QGis, QgsVectorFileWriter, QgsFeature, QgsField, QgsGeometry, QgsPoint, QgsRectangle
-from qgis.analysis import QgsOverlayAnalyzer
+from qgis.core import QGis, QgsFeature, QgsField, QgsGeometry, QgsRectangle
 
-from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile
+from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile, \
+                            FeatureSink, ZoneIndex
+from utils.grid import grids_to_latlon, grid_unique
 from utils.system import get_unique_filename
 
 from sidd.constants import logAPICall, DEFAULT_GRID_SIZE 
@@ -133,17 +135,13 @@ class GridWriter(Operator):
                        % (x_min, x_max, y_min, y_max, x_off, y_off, xtotal, ytotal),
                        logAPICall.DEBUG_L2)
         
-        writer = QgsVectorFileWriter(path, "utf-8", self._fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-        f = QgsFeature()
+        writer = FeatureSink(path, self._fields, QGis.WKBPoint, self._crs)
         for x in range(xtotal):
             for y in range(ytotal):
                 lon = x_min + (x * x_off) + (x_off/2.0)
                 lat = y_min + (y * y_off) + (y_off/2.0)
-                f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
-                f.addAttribute(0, QVariant(lon))
-                f.addAttribute(1, QVariant(lat))
-                writer.addFeature(f)
-        del writer
+                writer.write_point([lon, lat], lon, lat)
+        writer.close()
 
 class GridFromRegionWriter(GridWriter):
     """ class to create exposure grid according to GED spec """
@@ -182,55 +180,24 @@ class GridFromRegionWriter(GridWriter):
         #       because the data layer maybe is not loaded yet
         self._test_layer_loaded(zone_layer)
                 
-        x_off = self._x_off
-        y_off = self._y_off
-
-        extent = zone_layer.extent()
-        [x_min, y_min, x_max, y_max] = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
-
-        # create grid based on extent of given region 
-        tmp_grid1 = 'grid_' + get_unique_filename()
-        tmp_grid1_file = self._tmp_dir + tmp_grid1 + '.shp'
-
-        try:
-            self._write_grid_shapefile(tmp_grid1_file,
-                                       x_min, y_min, x_max, y_max,
-                                       x_off, y_off)
-        except:
-            remove_shapefile(tmp_grid1_file)
-            raise OperatorError('error creating temporary grid', self.__class__)        
-        
-        tmp_grid1_layer = load_shapefile(tmp_grid1_file, tmp_grid1)
-        
-        # temporary grid for joined shape with all grid points not within region removed 
-        tmp_grid2 = 'grid_' + get_unique_filename()
-        tmp_grid2_file = self._tmp_dir + tmp_grid2 + '.shp'
-        tmp_grid2_layer = None
+        # grid cells overlapping region are taken from grid coverage of zones,  
+        # only grid points within region are kept
         try:
-            analyzer = QgsOverlayAnalyzer()        
-            analyzer.intersection(tmp_grid1_layer, zone_layer, tmp_grid2_file)
-            tmp_grid2_layer = load_shapefile(tmp_grid2_file, tmp_grid2)
-        except:
-            raise OperatorError('error creating grid', self.__class__)
+            grid_ids = self._zone_coverage(zone_layer).grid_ids
+            index = ZoneIndex(zone_layer, [])
+        except Exception as err:
+            raise OperatorError('error creating grid: %s' % err, self.__class__)
 
         # create result layer
         grid_layername = 'grid_%s' % get_unique_filename()
         grid_file = self._tmp_dir + grid_layername + '.shp'
         try:
-            writer = QgsVectorFileWriter(grid_file, "utf-8", self._fields,
-                                         QGis.WKBPoint, self._crs, "ESRI Shapefile")
-            f = QgsFeature()
-            lon_idx = layer_field_index(tmp_grid2_layer, self._lon_field)
-            lat_idx = layer_field_index(tmp_grid2_layer, self._lat_field)        
-            for _f in layer_features(tmp_grid2_layer):
-                lon = _f.attributeMap()[lon_idx].toDouble()[0]
-                lat = _f.attributeMap()[lat_idx].toDouble()[0]
-                
-                f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
-                f.addAttribute(0, QVariant(lon))
-                f.addAttribute(1, QVariant(lat))
-                writer.addFeature(f)                
-            del writer
+            writer = FeatureSink(grid_file, self._fields, QGis.WKBPoint, self._crs)
+            lats, lons = grids_to_latlon(grid_unique(grid_ids))
+            for lon, lat, zone in izip(lons, lats, index.locate_points(lons, lats)):
+                if zone != -1:
+                    writer.write_point([lon, lat], lon, lat)
+            writer.close()
         except  Exception as err:
             logAPICall.log(str(err), logAPICall.ERROR)
             raise OperatorError('error writing out grid', self.__class__)
@@ -239,11 +206,6 @@ class GridFromRegionWriter(GridWriter):
         if not grid_layer:
             raise OperatorError('Error loading result grid file' % (grid_file), self.__class__)        
         
-        # clean up
-        del analyzer, tmp_grid1_layer, tmp_grid2_layer
-        remove_shapefile(tmp_grid1_file)
-        remove_shapefile(tmp_grid2_file)
-        
         self.outputs[0].value = grid_layer
         self.outputs[1].value = grid_file
 
@@ -311,8 +273,7 @@ class GridGeometryWriter(Operator):
         
         half_grid = DEFAULT_GRID_SIZE / 2.0
         try:            
-            writer = QgsVectorFileWriter(output_file, "utf-8", grid_fields,
-                                         QGis.WKBPolygon, grid_layer.crs(), "ESRI Shapefile")
+            writer = FeatureSink(output_file, grid_fields, QGis.WKBPolygon, grid_layer.crs())
             out_f = QgsFeature()
             for in_f in layer_features(grid_layer):
                 in_point = in_f.geometry().asPoint()                
@@ -321,7 +282,7 @@ class GridGeometryWriter(Operator):
                 out_f.setGeometry(out_geom)
                 out_f.setAttributeMap(in_f.attributeMap())
                 writer.addFeature(out_f)
-            del writer
+            writer.close()
         except  Exception as err:
             logAPICall.log(str(err), logAPICall.ERROR)
             raise OperatorError('error writing out grid: %s' % err, self.__class__)
@@ -16,20 +16,18 @@
 """
 module contains class for creating mapping scheme from survey data
 """
-import bsddb
 import os
-from math import floor, ceil
+from itertools import izip, repeat
 
 from PyQt4.QtCore import QVariant, QString
-from qgis.core import QGis, QgsVectorFileWriter, QgsFeature, QgsField, QgsGeometry, \
+from qgis.core import QGis, QgsField, QgsGeometry, \
                       QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform
-from qgis.analysis import QgsOverlayAnalyzer
 
-from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile                             
+from utils.shapefile import layer_features, layer_field_index, layer_feature_batches, layer_zone_join
 from utils.system import get_unique_filename
-from utils.grid import latlon_to_grid, grid_to_latlon
+from utils.grid import latlon_to_grid, latlon_to_grids, grid_to_latlon
 from sidd.constants import logAPICall, GID_FIELD_NAME, AREA_FIELD_NAME, CNT_FIELD_NAME, HT_FIELD_NAME, \
-                           MAX_FEATURES_IN_MEMORY, DEFAULT_GRID_SIZE, DEFAULT_HALF_GRID_SIZE
+                           DEFAULT_GRID_SIZE, DEFAULT_HALF_GRID_SIZE
 from sidd.operator import Operator, OperatorError
 from sidd.operator.data import OperatorDataTypes
 
@@ -75,39 +73,26 @@ class ToGrid(Operator):
         return self._outputGeometryFromGridId(latlon_to_grid(lat, lon)) 
 
     def _outputGeometryFromGridId(self, grid_id):
-        [lat, lon] = grid_to_latlon(int(grid_id))    
-        return QgsGeometry.fromRect(QgsRectangle(lon-DEFAULT_HALF_GRID_SIZE, lat-DEFAULT_HALF_GRID_SIZE,
-                                                 lon+DEFAULT_HALF_GRID_SIZE, lat+DEFAULT_HALF_GRID_SIZE))
-
-    def _create_grid(self, grid_name, grid_file, x_min, y_min, x_max, y_max, x_off, y_off):
-        x_off2, y_off2 = x_off / 2.0, y_off / 2.0
-        x_min = floor(x_min / x_off) * x_off
-        x_max = ceil(x_max / x_off) * x_off
-        y_min = floor(y_min / y_off) * y_off
-        y_max = ceil(y_max / y_off) * y_off
-        
-        xtotal = int((x_max - x_min) / x_off)+1
-        ytotal = int((y_max - y_min) / y_off)+1
+        return QgsGeometry.fromRect(QgsRectangle(*self._outputExtentFromGridId(grid_id)))
 
-        logAPICall.log('x_min %f x_max %f y_min %f y_max %f x_off %f y_off %f xtotal %d, ytotal %d'
-                       % (x_min, x_max, y_min, y_max, x_off, y_off, xtotal, ytotal),
-                       logAPICall.DEBUG_L2)
-        fields = {
-            0 : QgsField('GRID_GID', QVariant.String),            
-        }
-        writer = QgsVectorFileWriter(grid_file, "utf-8", fields, QGis.WKBPolygon, self._crs, "ESRI Shapefile")
-        f = QgsFeature()
-        for x in range(xtotal):
-            for y in range(ytotal):
-                lon = x_min + (x * x_off) + (x_off2)
-                lat = y_min + (y * y_off) + (y_off2)                
-                #out_geom = QgsGeometry.fromRect(QgsRectangle(lon-x_off2, lat-y_off2,
-                #                                             lon+x_off2, lat+y_off2))                                
-                f.setGeometry(self._outputGeometryFromLatLon(lat, lon))                
-                f.addAttribute(0, QVariant(latlon_to_grid(lat, lon)))                
-                writer.addFeature(f)
-        del writer 
-        return load_shapefile(grid_file, grid_name)        
+    def _outputExtentFromGridId(self, grid_id):
+        """ return (x_min, y_min, x_max, y_max) of grid cell """
+        [lat, lon] = grid_to_latlon(int(grid_id))    
+        return (lon-DEFAULT_HALF_GRID_SIZE, lat-DEFAULT_HALF_GRID_SIZE,
+                lon+DEFAULT_HALF_GRID_SIZE, lat+DEFAULT_HALF_GRID_SIZE)
+
+    def _zone_values(self, zone_layer, fields):
+        """ dictionary of zone GID => list of values of given fields """
+        zone_values = {}
+        for batch in layer_feature_batches(zone_layer, [GID_FIELD_NAME] + fields):
+            for _idx, gid in enumerate(batch[GID_FIELD_NAME]):
+                zone_values[gid] = [batch[field][_idx] for field in fields]
+        return zone_values
+
+    def _distribute(self, coverage, zone_values, field_idx):
+        """ distribute given zone value to grid cells, in same order as coverage entries """
+        return coverage.distribute(dict((gid, float(values[field_idx]))
+                                        for gid, values in zone_values.iteritems()))
 
     def _create_zone_statistics(self, zone_layer, zone_field, count_field, zone_stat, zone_names):
         # project geometry into mercator and get area in m2
@@ -139,12 +124,12 @@ class ToGrid(Operator):
         stat[ToGrid.STAT_COUNT_IDX] +=count
         stat[ToGrid.STAT_AREA_IDX] +=area
             
-    def _load_output(self, output_file, output_layername):
-        output_layer = load_shapefile(output_file, output_layername)
+    def _load_output(self, writer, output_layername):
+        output_layer = writer.layer(output_layername)
         if not output_layer:
-            raise OperatorError('Error loading grid file' % (output_file), self.__class__)        
+            raise OperatorError('Error loading grid file %s' % (writer.output_file), self.__class__)        
         self.outputs[0].value = output_layer
-        self.outputs[1].value = output_file
+        self.outputs[1].value = self._output_file(writer)
 
 class ZoneToGrid(ToGrid):
     def __init__(self, options=None, name='Grid Zone Merger'):
@@ -182,53 +167,14 @@ class ZoneToGrid(ToGrid):
         self._test_layer_field_exists(zone_layer, zone_field)        
         self._test_layer_field_exists(zone_layer, count_field)
         
-        # local variables 
-        analyzer = QgsOverlayAnalyzer()
-        area_idx = ToGrid.STAT_AREA_IDX
-        #cnt_idx = ToGrid.STAT_COUNT_IDX
-        
-        # 1. find building count and total area for each zone
-        zone_names, zone_stat= {}, {}
-        try:
-            self._create_zone_statistics(zone_layer, zone_field, count_field, 
-                                         zone_stat, zone_names)
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)    
-    
-        # 2. create grids around extent of zone 
-        tmp_grid1 = 'grid_' + get_unique_filename()
-        tmp_grid1_file = self._tmp_dir + tmp_grid1 + '.shp'
-        try:
-            extent = zone_layer.extent()
-            [x_min, y_min, x_max, y_max] = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
-            tmp_grid_lyr1 = self._create_grid(tmp_grid1, tmp_grid1_file, \
-                                              x_min, y_min, x_max, y_max, \
-                                              DEFAULT_GRID_SIZE, DEFAULT_GRID_SIZE)            
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)    
-        
-        # 3. intersect grids and zones to obtain polygons with 
+        # use grid cells covered by each zone with
         # - grid_id and zone_id
-        # - ratio of grid covered by zone (polygon area / zone area) 
-        # apply ratio to zone building count to obtain count assigned to polygon                  
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)
-        try:
-            # do intersection
-            analyzer.intersection(tmp_grid_lyr1, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile(tmp_join_file, tmp_join)
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)
-        
-        # do tally        
-        zone_gid_idx = layer_field_index(tmp_join_layer, GID_FIELD_NAME)
-        grid_gid_idx = layer_field_index(tmp_join_layer, "GRID_GID")
-        bldg_cnt_idx = layer_field_index(tmp_join_layer, count_field)
-        bldg_area_idx = layer_field_index(tmp_join_layer, area_field)
-        mercator_transform = QgsCoordinateTransform(tmp_join_layer.crs(),
-                                                    self.mercator_crs)          
+        # - ratio of zone covered by grid cell (cell area within zone / zone area) 
+        # apply ratio to zone building count to obtain count assigned to grid cell
+        read_fields = [zone_field, count_field]
+        has_area = layer_field_index(zone_layer, area_field) > 0
+        if has_area:
+            read_fields.append(area_field)
 
         fields = {
             0 : QgsField(GID_FIELD_NAME, QVariant.String),            
@@ -238,43 +184,26 @@ class ZoneToGrid(ToGrid):
         }    
         output_layername = 'grid_%s' % get_unique_filename()
         output_file = '%s%s.shp' % (self._tmp_dir, output_layername)                
-        writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPolygon, self._crs, "ESRI Shapefile")
-        f = QgsFeature() 
-        for _f in layer_features(tmp_join_layer):
-            # get area of polygon            
-            geom = _f.geometry()
-            geom.transform(mercator_transform)
-            area = geom.area()
+        writer = self._create_layer_writer(output_file, fields, QGis.WKBPolygon)
+        try:
+            coverage = self._zone_coverage(zone_layer)
+            zone_values = self._zone_values(zone_layer, read_fields)
 
-            # generate all stats of interest
-            zone_gid = _f.attributeMap()[zone_gid_idx].toString()
-            grid_gid = _f.attributeMap()[grid_gid_idx].toString()
-            stat = zone_stat[zone_gid]
-            
             # calculate count/area as proportion of total zone area
-            bldg_cnt = _f.attributeMap()[bldg_cnt_idx].toDouble()[0] * (area/stat[area_idx])
-            if bldg_area_idx> 0:
-                bldg_area = _f.attributeMap()[bldg_area_idx].toDouble()[0] * (area/stat[area_idx])                
+            bldg_cnts = self._distribute(coverage, zone_values, 1)
+            if has_area:
+                bldg_areas = self._distribute(coverage, zone_values, 2)
             else:
-                bldg_area = 0 
-
-            # create output record
-            f.setGeometry(self._outputGeometryFromGridId(grid_gid))
-            f.addAttribute(0, grid_gid)
-            f.addAttribute(1, zone_names[QString(zone_gid)])
-            f.addAttribute(2, bldg_cnt)
-            f.addAttribute(3, bldg_area)
-            writer.addFeature(f)        
-        del writer    
-
-        # clean up
-        del tmp_grid_lyr1
-        del tmp_join_layer
-        remove_shapefile(tmp_grid1_file)
-        remove_shapefile(tmp_join_file)
+                bldg_areas = repeat(0)
+            for (grid_gid, zone_gid, ratio), bldg_cnt, bldg_area in izip(coverage.entries(), bldg_cnts, bldg_areas):
+                # create output record
+                writer.write_rect([str(grid_gid), str(zone_values[zone_gid][0]), bldg_cnt, bldg_area],
+                                  *self._outputExtentFromGridId(grid_gid))
+        except Exception as err:
+            raise OperatorError(str(err), self.__class__)
                 
         # store data in output
-        self._load_output(output_file, output_layername)
+        self._load_output(writer, output_layername)
 
 class FootprintZoneToGrid(ZoneToGrid):
     def __init__(self, options=None, name='Grid Zone Merger'):
@@ -324,18 +253,12 @@ class FootprintZoneToGrid(ZoneToGrid):
         # area_field is not required
         
         # local variables 
-        analyzer = QgsOverlayAnalyzer()
         area_idx = ToGrid.STAT_AREA_IDX
         cnt_idx = ToGrid.STAT_COUNT_IDX
         
         zone_names, zone_stat, zone_stat2, zone_totals = {}, {}, {}, {}
         
         # 1. find building count and total area for each zone
-        # project geometry into mercator and get area in m2
-        mercator_crs = QgsCoordinateReferenceSystem()        
-        mercator_crs.createFromEpsg(3395)        
-        mercator_transform = QgsCoordinateTransform(zone_layer.crs(), mercator_crs)
-        
         try:
             # use zone geometry area 
             self._create_zone_statistics(zone_layer, zone_field, count_field, 
@@ -343,15 +266,6 @@ class FootprintZoneToGrid(ZoneToGrid):
         except Exception as err:
             raise OperatorError(str(err), self.__class__)
 
-        # 2. create grids around extent of zone 
-        tmp_grid1 = 'grid_' + get_unique_filename()
-        tmp_grid1_file = self._tmp_dir + tmp_grid1 + '.shp'
-        extent = zone_layer.extent()
-        [x_min, y_min, x_max, y_max] = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
-        tmp_grid_lyr1 = self._create_grid(tmp_grid1, tmp_grid1_file, \
-                                          x_min, y_min, x_max, y_max, \
-                                          DEFAULT_GRID_SIZE, DEFAULT_GRID_SIZE)            
-
         # tally total building area if there is defined
         bldg_area_idx = layer_field_index(zone_layer, area_field)
         zone_area = {}
@@ -359,7 +273,7 @@ class FootprintZoneToGrid(ZoneToGrid):
         if bldg_area_idx > 0:
             zone_has_area = True
             zone_gid_idx = layer_field_index(zone_layer, GID_FIELD_NAME)
-            for _f in layer_features(zone_layer):            
+            for _f in layer_features(zone_layer, [GID_FIELD_NAME, area_field], False):            
                 gid = _f.attributeMap()[zone_gid_idx].toString()            
                 area = _f.attributeMap()[bldg_area_idx].toDouble()[0]            
                 if zone_area.has_key(gid):
@@ -367,78 +281,51 @@ class FootprintZoneToGrid(ZoneToGrid):
                 else: 
                     zone_area[gid] = area
         
-        # 3. intersect grids and zones to obtain polygons with 
+        # 2. find grid cells covered by each zone with 
         # - grid_id and zone_id
-        # - ratio of grid covered by zone (polygon area / zone area) 
-        # apply ratio to zone building count to obtain count assigned to polygon                  
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)
+        # - ratio of zone covered by grid cell (cell area within zone / zone area) 
+        # apply ratio to zone building count to obtain count assigned to grid cell
+        zone_has_count = layer_field_index(zone_layer, count_field) > 0
         try:
-            # do intersection
-            analyzer.intersection(tmp_grid_lyr1, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile(tmp_join_file, tmp_join)
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)
-        
-        # do tally
-        zone_gid_idx = layer_field_index(tmp_join_layer, GID_FIELD_NAME)
-        grid_gid_idx = layer_field_index(tmp_join_layer, "GRID_GID")
-        bldg_cnt_idx = layer_field_index(tmp_join_layer, count_field)
-        for _f in layer_features(tmp_join_layer):
-            geom = _f.geometry()
-            geom.transform(mercator_transform)
-            area = geom.area()
-            
-            # generate all stats of interest
-            zone_gid = _f.attributeMap()[zone_gid_idx].toString()
-            grid_gid = _f.attributeMap()[grid_gid_idx].toString()
-            stat = zone_stat[zone_gid]            
-            # calculate count/area as proportion of total zone area
-            area_ratio = (area/stat[area_idx])
-            if bldg_cnt_idx > 0:
-                bldg_cnt = _f.attributeMap()[bldg_cnt_idx].toDouble()[0] * area_ratio
+            coverage = self._zone_coverage(zone_layer)
+            if zone_has_count:
+                bldg_cnts = self._distribute(coverage, self._zone_values(zone_layer, [count_field]), 0)
             else:
-                bldg_cnt = 0
-            if zone_has_area: 
-                area = zone_area[zone_gid] * area_ratio
-            else:
-                area = stat[area_idx] * area_ratio                 
-            self._update_stat(zone_stat2, '%s|%s'%(grid_gid, zone_gid), bldg_cnt, area)
-        
-        # 4. find total buildings in each zone based on footprint
-        # - simply join the files and tally count and total area 
-        tmp_join1 = 'joined_%s' % get_unique_filename()
-        tmp_join1_file = '%s%s.shp' % (self._tmp_dir, tmp_join1)        
-        try:
-            # do intersection
-            analyzer.intersection(fp_layer, tmp_join_layer, tmp_join1_file)
-            tmp_join1_layer = load_shapefile(tmp_join1_file, tmp_join1)
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
+                bldg_cnts = repeat(0)
+            for (grid_gid, zone_gid, area_ratio), bldg_cnt in izip(coverage.entries(), bldg_cnts):
+                # generate all stats of interest
+                zone_gid = QString(str(zone_gid))
+                stat = zone_stat[zone_gid]            
+                # calculate count/area as proportion of total zone area
+                if zone_has_area: 
+                    area = zone_area[zone_gid] * area_ratio
+                else:
+                    area = stat[area_idx] * area_ratio                 
+                self._update_stat(zone_stat2, '%s|%s'%(grid_gid, zone_gid), bldg_cnt, area)
         except Exception as err:
             raise OperatorError(str(err), self.__class__)
         
-        # do tally
+        # 3. find total buildings in each zone based on footprint
+        # - simply join footprint with zones and tally count and total area 
+        #   in grid cell containing the footprint
         zone_fp_stat = {}
-        zone_gid_idx = layer_field_index(tmp_join1_layer, '%s_'% GID_FIELD_NAME)
-        grid_gid_idx = layer_field_index(tmp_join1_layer, "GRID_GID")        
-        fp_area_idx = layer_field_index(tmp_join1_layer, AREA_FIELD_NAME)
-        fp_ht_idx = layer_field_index(tmp_join1_layer, HT_FIELD_NAME)
         fp_has_height = False
-        for _f in layer_features(tmp_join1_layer):
-            zone_gid = _f.attributeMap()[zone_gid_idx].toString()
-            grid_gid = _f.attributeMap()[grid_gid_idx].toString()
-            area = _f.attributeMap()[fp_area_idx].toDouble()[0] # area comes from geometry, always exists
-            ht = _f.attributeMap()[fp_ht_idx].toDouble()[0]
-            if ht > 0:
-                fp_has_height = True
-                area *= ht      # this is actual area to be aggregated at the end
-            self._update_stat(zone_fp_stat, '%s|%s'%(grid_gid, zone_gid), 1, area)
-            self._update_stat(zone_totals, zone_gid, 1, area)
+        try:
+            for batch in layer_zone_join(fp_layer, [AREA_FIELD_NAME, HT_FIELD_NAME], zone_layer, [GID_FIELD_NAME]):
+                grid_gids = latlon_to_grids(batch['y'], batch['x'])
+                for _idx, grid_gid in enumerate(grid_gids):
+                    zone_gid = QString(str(batch[GID_FIELD_NAME][_idx]))
+                    area = float(batch[AREA_FIELD_NAME][_idx]) # area comes from geometry, always exists
+                    ht = float(batch[HT_FIELD_NAME][_idx])
+                    if ht > 0:
+                        fp_has_height = True
+                        area *= ht      # this is actual area to be aggregated at the end
+                    self._update_stat(zone_fp_stat, '%s|%s'%(grid_gid, zone_gid), 1, area)
+                    self._update_stat(zone_totals, zone_gid, 1, area)
+        except Exception as err:
+            raise OperatorError(str(err), self.__class__)
         
-        # 5. generate grid with adjusted building counts
+        # 4. generate grid with adjusted building counts
         fields = {
             0 : QgsField(GID_FIELD_NAME, QVariant.String),            
             1 : QgsField(zone_field, QVariant.String),
@@ -447,8 +334,7 @@ class FootprintZoneToGrid(ZoneToGrid):
         }
         output_layername = 'grid_%s' % get_unique_filename()
         output_file = '%s%s.shp' % (self._tmp_dir, output_layername)                
-        writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPolygon, self._crs, "ESRI Shapefile")
-        f = QgsFeature()
+        writer = self._create_layer_writer(output_file, fields, QGis.WKBPolygon)
         for key in zone_stat2.keys():
             (grid_gid, zone_gid) = str(key).split("|")
             s_zone = zone_stat[QString(zone_gid)]           # overall statistics for the zone from zone file (always exists)
@@ -485,24 +371,11 @@ class FootprintZoneToGrid(ZoneToGrid):
                 # no area defined
                 area = 0 # max(s_zone_grid[area_idx], s_fp[area_idx])
                 
-            f.setGeometry(self._outputGeometryFromGridId(grid_gid))
-            f.addAttribute(0, grid_gid)
-            f.addAttribute(1, zone_names[QString(zone_gid)])
-            f.addAttribute(2, grid_count)
-            f.addAttribute(3, area)
-            writer.addFeature(f)
-        del writer
-        
-        # clean up
-        del tmp_grid_lyr1
-        del tmp_join_layer
-        del tmp_join1_layer
-        remove_shapefile(tmp_grid1_file)
-        remove_shapefile(tmp_join_file)
-        remove_shapefile(tmp_join1_file)
+            writer.write_rect([grid_gid, str(zone_names[QString(zone_gid)].toString()), grid_count, area],
+                              *self._outputExtentFromGridId(grid_gid))
                 
         # store data in output
-        self._load_output(output_file, output_layername)
+        self._load_output(writer, output_layername)
 
 
 class PopgridZoneToGrid(ToGrid):
@@ -548,21 +421,6 @@ class PopgridZoneToGrid(ToGrid):
         # if count field is not defined, then generate building count from footprints
         
         # local variables 
-        analyzer = QgsOverlayAnalyzer()
-
-        # intersect grids and zones to obtain polygons with 
-        # - population and zone_id
-        # - apply ratio to population to obtain building count                  
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)
-        try:
-            # do intersection
-            analyzer.intersection(popgrid_layer, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile(tmp_join_file, tmp_join)
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)
 
         # generate grid with  building counts
         fields = {
@@ -572,29 +430,18 @@ class PopgridZoneToGrid(ToGrid):
         }
         output_layername = 'grid_%s' % get_unique_filename()
         output_file = '%s%s.shp' % (self._tmp_dir, output_layername)                
-        writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPolygon, self._crs, "ESRI Shapefile")
-        f = QgsFeature()
-        pop_idx = layer_field_index(tmp_join_layer, CNT_FIELD_NAME)
-        zone_idx = layer_field_index(tmp_join_layer, zone_field) 
-        for _f in layer_features(tmp_join_layer):
-            pop_count = _f.attributeMap()[pop_idx].toDouble()[0]
-            zone = _f.attributeMap()[zone_idx].toString()
-            
-            # 1. get geometry
-            geom = _f.geometry()
-            # 2. get original centroid point and project is required
-            centroid  = geom.centroid().asPoint()
-            grid_gid = latlon_to_grid(centroid.y(), centroid.x())
-            f.setGeometry(self._outputGeometryFromGridId(grid_gid))
-            f.addAttribute(0, grid_gid)
-            f.addAttribute(1, zone)
-            f.addAttribute(2, pop_count / pop_to_bldg)
-            writer.addFeature(f)
-        del writer
-        
-        # clean up
-        del tmp_join_layer
-        remove_shapefile(tmp_join_file)
+        writer = self._create_layer_writer(output_file, fields, QGis.WKBPolygon)
+        try:
+            # join population grid points with zones to obtain 
+            # - population and zone
+            # - apply ratio to population to obtain building count                  
+            for batch in layer_zone_join(popgrid_layer, [CNT_FIELD_NAME], zone_layer, [zone_field]):
+                grid_gids = latlon_to_grids(batch['y'], batch['x'])
+                for grid_gid, pop_count, zone in izip(grid_gids, batch[CNT_FIELD_NAME], batch[zone_field]):
+                    writer.write_rect([str(grid_gid), str(zone), float(pop_count) / pop_to_bldg],
+                                      *self._outputExtentFromGridId(grid_gid))
+        except Exception as err:
+            raise OperatorError(str(err), self.__class__)
                 
         # store data in output
-        self._load_output(output_file, output_layername)
+        self._load_output(writer, output_layername)
@@ -16,27 +16,28 @@
 """
 module contains class for creating mapping scheme from survey data
 """
-import bsddb
-import os
 from math import floor, ceil
+from itertools import izip
 
 from PyQt4.QtCore import QVariant, QString
-from qgis.core import QGis, QgsVectorFileWriter, QgsFeature, QgsField, QgsGeometry, \
+from qgis.core import QGis, QgsFeature, QgsField, QgsGeometry, \
                       QgsPoint, QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform
-from qgis.analysis import QgsOverlayAnalyzer
 
 from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile, \
-                            layer_multifields_stats, load_shapefile_verify 
+                            layer_zone_join, FeatureSink 
 from utils.system import get_unique_filename
+from utils.accumulator import KeyValueAggregator, keep_first
 from utils.grid import latlon_to_grid, grid_to_latlon
 from sidd.constants import logAPICall, GID_FIELD_NAME, AREA_FIELD_NAME, CNT_FIELD_NAME, HT_FIELD_NAME, \
-                           MAX_FEATURES_IN_MEMORY, DEFAULT_GRID_SIZE
+                           DEFAULT_GRID_SIZE
 from sidd.operator import EmptyOperator, OperatorError
 from sidd.operator.data import OperatorDataTypes
 
 class ZoneGridMerger(EmptyOperator):
     """
     """
+    # zone, zone GID, lon/lat key of grid point
+    bytes_per_record = 300
     # construction / destructor
     ###########################
     
@@ -94,53 +95,28 @@ class ZoneGridMerger(EmptyOperator):
         zone_count_stats = {}
         gid_idx = layer_field_index(zone_layer, self._gid_field)         
         count_idx = layer_field_index(zone_layer, count_field)
-        for _f in layer_features(zone_layer):
+        for _f in layer_features(zone_layer, [self._gid_field, count_field], False):
             gid = _f.attributeMap()[gid_idx].toString()
             zone_stats[gid] = 0
             zone_count_stats[gid] = _f.attributeMap()[count_idx].toDouble()[0]
         
         # create storage for temporary output data
-        use_grid_db = grid_layer.dataProvider().featureCount() > MAX_FEATURES_IN_MEMORY
-        if False:
-            tmp_grid_db_file = '%sdb_%s.db' % (self._tmp_dir, get_unique_filename())
-            grid_points = bsddb.btopen(tmp_grid_db_file, 'c')
-        else:
-            grid_points = {}
+        # distinct grid points, spills to disk if number of points is too large
+        grid_points = KeyValueAggregator(self._tmp_dir, self._max_records(), keep_first,
+                                         self._memory_budget())
         
         # merge to create stats
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)        
-        analyzer = QgsOverlayAnalyzer()        
-        try:
-            analyzer.intersection(grid_layer, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile_verify(tmp_join_file, tmp_join,[zone_field, count_field])
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)
-        
-        stats = layer_multifields_stats(tmp_join_layer, [zone_field, count_field])
-        if stats == False:
-            raise OperatorError("error creating statistic based on input files",
-                                self.__class__)
-
-        zone_idx = layer_field_index(tmp_join_layer, zone_field)
-        count_idx = layer_field_index(tmp_join_layer, count_field)
-        lon_idx = layer_field_index(tmp_join_layer, self._lon_field)
-        lat_idx = layer_field_index(tmp_join_layer, self._lat_field)
-        gid_idx = layer_field_index(tmp_join_layer, self._gid_field)        
-        
         try:        
-            for _f in layer_features(tmp_join_layer):
-                lon = _f.attributeMap()[lon_idx].toDouble()[0]
-                lat = _f.attributeMap()[lat_idx].toDouble()[0]
-                zone_str = str(_f.attributeMap()[zone_idx].toString()).upper()
-                count_val = _f.attributeMap()[count_idx].toDouble()[0]
-                gid = _f.attributeMap()[gid_idx].toString()
+            for batch in layer_zone_join(grid_layer, [self._lon_field, self._lat_field],
+                                         zone_layer, [zone_field, self._gid_field]):
+                for lon, lat, zone_str, gid in izip(batch[self._lon_field], batch[self._lat_field],
+                                                    batch[zone_field], batch[self._gid_field]):
+                    zone_str = str(zone_str).upper()
+                    gid = QString(str(gid))
 
-                # update stats
-                zone_stats[gid] += 1
-                grid_points[self._make_key(zone_str, gid, lon, lat)] = 1
+                    # update stats
+                    zone_stats[gid] += 1
+                    grid_points.add(self._make_key(zone_str, gid, lon, lat), 1)
         except Exception as err:
             raise OperatorError("error processing joined layer: " % err, self.__class__)
 
@@ -163,7 +139,7 @@ class ZoneGridMerger(EmptyOperator):
 
                     #self._write_feature(writer, f, lon, lat, zone_str, count_val)
                     zone_stats[gid] += 1                                        
-                    grid_points[self._make_key(zone_str, gid, lon, lat)] = 1                             
+                    grid_points.add(self._make_key(zone_str, gid, lon, lat), 1)
         except Exception as err:
             raise OperatorError("error processing missing points: " % err, self.__class__)
 
@@ -177,11 +153,9 @@ class ZoneGridMerger(EmptyOperator):
         grid_layername = 'grid_%s' % (get_unique_filename())
         grid_file = '%s%s.shp' % (self._tmp_dir, grid_layername)
         try:
-            f = QgsFeature()
-            writer = QgsVectorFileWriter(grid_file, "utf-8", fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-            for key, value in grid_points.iteritems():                
+            writer = FeatureSink(grid_file, fields, QGis.WKBPoint, self._crs)
+            for key, value in grid_points.items():
                 [zone, zone_gid, lon, lat] = self._parse_key(key)                
-                f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
                 """                
                 f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
                 f.addAttribute(0, QVariant(lon))
@@ -192,42 +166,33 @@ class ZoneGridMerger(EmptyOperator):
                 """
                 value = float(value) / zone_stats[zone_gid] * zone_count_stats[zone_gid]
                 #grid_points[key] = value 
-                self._write_feature(writer, f, lon, lat, zone, value)
-            del writer
+                self._write_feature(writer, lon, lat, zone, value)
+            writer.close()
         except Exception as err:
             raise OperatorError("error creating joined grid file: " % err, self.__class__)
+        finally:
+            grid_points.close()
             
         # load result layer
         grid_layer = load_shapefile(grid_file, grid_layername)
         if not grid_layer:
             raise OperatorError('Error loading joined grid file' % (grid_file), self.__class__)
         
-        # clean up
-        del tmp_join_layer
-        remove_shapefile(tmp_join_file)
-        
         self.outputs[0].value = grid_layer
         self.outputs[1].value = grid_file
 
     # protected methods
     ###########################
     def _make_key(self, zone_str, gid, lon, lat):
-        return '%s,%s,%.5f,%.5f' % (zone_str, gid, lon, lat)
+        return (zone_str, str(gid), round(lon, 5), round(lat, 5))
     
     def _parse_key(self, key):
-        (zone_str, gid, lon, lat) = str(key).split(",")
+        (zone_str, gid, lon, lat) = key
         gid = QString(gid) 
-        lat = float(lat)
-        lon = float(lon)
         return (zone_str, gid, lon, lat)
     
-    def _write_feature(self, writer, f, lon, lat, zone, zone_ratio):
-        f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
-        f.addAttribute(0, QVariant(lon))
-        f.addAttribute(1, QVariant(lat))
-        f.addAttribute(2, QVariant(zone))            
-        f.addAttribute(3, QVariant(zone_ratio))
-        writer.addFeature(f)
+    def _write_feature(self, writer, lon, lat, zone, zone_ratio):
+        writer.write_point([lon, lat, str(zone), zone_ratio], lon, lat)
 
 class ZoneFootprintMerger(EmptyOperator):
     def __init__(self, options=None, name='Zone & Footprint Merger'):
@@ -273,42 +238,22 @@ class ZoneFootprintMerger(EmptyOperator):
         zone_field = self.inputs[1].value                
         fp_layer = self.inputs[2].value
         
-        # merge with zone to get assignment
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)        
-        analyzer = QgsOverlayAnalyzer()        
-        try:
-            analyzer.intersection(fp_layer, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile_verify(tmp_join_file, tmp_join,[zone_field])
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
-        except Exception as err:
-            raise OperatorError(str(err), self.__class__)
-        
         fields = {
             0 : QgsField(self._lon_field, QVariant.Double),
             1 : QgsField(self._lat_field, QVariant.Double),
             2 : QgsField(zone_field, QVariant.String),
         }
-        zone_idx = layer_field_index(tmp_join_layer, zone_field)
         fp_layername = 'fpc_%s' % get_unique_filename()
         fp_file = '%s%s.shp' % (self._tmp_dir, fp_layername)
         try:
-            writer = QgsVectorFileWriter(fp_file, "utf-8", fields, QGis.WKBPoint, self._crs, "ESRI Shapefile")
-            f = QgsFeature()
-            for _f in layer_features(tmp_join_layer):                
-                centroid = _f.geometry().centroid().asPoint()
-                lon = centroid.x()
-                lat = centroid.y()
-                zone_str = str(_f.attributeMap()[zone_idx].toString()).upper()
-
-                f.setGeometry(QgsGeometry.fromPoint(QgsPoint(lon, lat)))
-                f.addAttribute(0, QVariant(lon))
-                f.addAttribute(1, QVariant(lat))
-                f.addAttribute(2, QVariant(zone_str))
-                writer.addFeature(f)
+            # merge with zone to get assignment
+            writer = FeatureSink(fp_file, fields, QGis.WKBPoint, self._crs)
+            for batch in layer_zone_join(fp_layer, [], zone_layer, [zone_field]):
+                for lon, lat, zone_str in izip(batch['x'], batch['y'], batch[zone_field]):
+                    zone_str = str(zone_str).upper()
+                    writer.write_point([lon, lat, zone_str], lon, lat)
             
-            del writer
+            writer.close()
         except Exception as err:
             logAPICall.log(err, logAPICall.ERROR)
             remove_shapefile(fp_file)
@@ -318,10 +263,6 @@ class ZoneFootprintMerger(EmptyOperator):
         fp_layer = load_shapefile(fp_file, fp_layername)
         if not fp_layer:
             raise OperatorError('Error loading footprint centroid file' % (fp_file), self.__class__)        
-                
-        # clean up
-        del tmp_join_layer        
-        remove_shapefile(tmp_join_file)
         
         self.outputs[0].value = fp_layer
         self.outputs[1].value = fp_file
@@ -377,38 +318,31 @@ class ZoneFootprintCounter(EmptyOperator):
         zone_count_field = self.inputs[2].value
         fp_layer = self.inputs[3].value
 
-        # merge with zone 
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)        
-        analyzer = QgsOverlayAnalyzer()
+        # merge with zone and count footprint in each zone
+        read_fields = [AREA_FIELD_NAME]
+        has_ht = layer_field_index(fp_layer, HT_FIELD_NAME) > 0
+        if has_ht:
+            read_fields.append(HT_FIELD_NAME)
+        stats = {}
         try:
-            analyzer.intersection(fp_layer, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile(tmp_join_file, tmp_join)
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
+            for batch in layer_zone_join(fp_layer, read_fields, zone_layer, [GID_FIELD_NAME]):
+                for _idx in xrange(len(batch[GID_FIELD_NAME])):
+                    gid = QString(str(batch[GID_FIELD_NAME][_idx]))
+                    if has_ht:      
+                        ht = float(batch[HT_FIELD_NAME][_idx])
+                    else:
+                        ht = 0                        
+                    # if height is not defined, it is set to 0
+                    # this will cause the system to ignore area generate without having to
+                    # remove the field
+                    area = float(batch[AREA_FIELD_NAME][_idx]) * ht # 
+                    if not stats.has_key(gid):
+                        stats[gid] = (1, area)
+                    else:
+                        stat = stats[gid] 
+                        stats[gid] = (stat[0]+1, stat[1]+area)
         except Exception as err:
             raise OperatorError(str(err), self.__class__)
-        
-        # count footprint in each zone
-        gid_idx = layer_field_index(tmp_join_layer, GID_FIELD_NAME + "_")
-        area_idx = layer_field_index(tmp_join_layer, AREA_FIELD_NAME)
-        ht_idx = layer_field_index(tmp_join_layer, HT_FIELD_NAME)
-        stats = {}
-        for _feature in layer_features(tmp_join_layer):
-            gid = _feature.attributeMap()[gid_idx].toString()
-            if ht_idx > 0:      
-                ht = _feature.attributeMap()[ht_idx].toDouble()[0]
-            else:
-                ht = 0                        
-            # if height is not defined, it is set to 0
-            # this will cause the system to ignore area generate without having to
-            # remove the field
-            area = _feature.attributeMap()[area_idx].toDouble()[0] * ht # 
-            if not stats.has_key(gid):
-                stats[gid] = (1, area)
-            else:
-                stat = stats[gid] 
-                stats[gid] = (stat[0]+1, stat[1]+area)
             
         output_layername = 'zone_%s' % get_unique_filename()
         output_file = '%s%s.shp' % (self._tmp_dir, output_layername)
@@ -420,7 +354,7 @@ class ZoneFootprintCounter(EmptyOperator):
                 2 : QgsField(CNT_FIELD_NAME, QVariant.Int),
                 3 : QgsField(AREA_FIELD_NAME, QVariant.Int),
             }
-            writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPolygon, self._crs, "ESRI Shapefile")                     
+            writer = self._create_layer_writer(output_file, fields, QGis.WKBPolygon)                     
             f = QgsFeature()            
             for _f in layer_features(zone_layer):
                 
@@ -441,21 +375,17 @@ class ZoneFootprintCounter(EmptyOperator):
                 f.addAttribute(3, QVariant(area))
                 writer.addFeature(f)
             
-            del writer, f
+            del f
+            output_layer = writer.layer(output_layername)
         except Exception as err:            
             remove_shapefile(output_file)
             raise OperatorError("error creating zone: %s" % err, self.__class__)
 
-        # clean up
-        del tmp_join_layer
-        remove_shapefile(tmp_join_file)
-
         # store data in output
-        output_layer = load_shapefile(output_file, output_layername)
         if not output_layer:
-            raise OperatorError('Error loading footprint centroid file' % (output_file), self.__class__)        
+            raise OperatorError('Error loading zone file %s' % (output_file), self.__class__)        
         self.outputs[0].value = output_layer
-        self.outputs[1].value = output_file
+        self.outputs[1].value = self._output_file(writer)
 
 class ZonePopgridCounter(EmptyOperator):
     
@@ -505,31 +435,20 @@ class ZonePopgridCounter(EmptyOperator):
         popgrid_layer = self.inputs[2].value
         pop_to_bldg = float(self.inputs[3].value)
         
-        # merge with zone 
-        tmp_join = 'joined_%s' % get_unique_filename()
-        tmp_join_file = '%s%s.shp' % (self._tmp_dir, tmp_join)        
-        analyzer = QgsOverlayAnalyzer()
+        # merge with zone and count population in each zone
+        stats = {}
         try:
-            analyzer.intersection(popgrid_layer, zone_layer, tmp_join_file)
-            tmp_join_layer = load_shapefile(tmp_join_file, tmp_join)
-        except AssertionError as err:
-            raise OperatorError(str(err), self.__class__)
+            for batch in layer_zone_join(popgrid_layer, [CNT_FIELD_NAME], zone_layer, [GID_FIELD_NAME]):
+                for _gid, _count in izip(batch[GID_FIELD_NAME], batch[CNT_FIELD_NAME]):
+                    # retrieve count from statistic
+                    _gid = QString(str(_gid))
+                    if stats.has_key(_gid):
+                        stats[_gid]+=float(_count) / pop_to_bldg
+                    else:
+                        stats[_gid]=float(_count)  / pop_to_bldg          
         except Exception as err:
             raise OperatorError(str(err), self.__class__)
         
-        # count footprint in each zone
-        stats = {}
-        _gid_idx = layer_field_index(tmp_join_layer, GID_FIELD_NAME + "_")        
-        _cnt_idx = layer_field_index(tmp_join_layer, CNT_FIELD_NAME)
-        for _f in layer_features(tmp_join_layer):
-            # retrieve count from statistic
-            _gid = _f.attributeMap()[_gid_idx].toString()
-            _count = _f.attributeMap()[_cnt_idx].toString()
-            if stats.has_key(_gid):
-                stats[_gid]+=float(_count) / pop_to_bldg
-            else:
-                stats[_gid]=float(_count)  / pop_to_bldg          
-        
         output_layername = 'zone_%s' % get_unique_filename()
         output_file = '%s%s.shp' % (self._tmp_dir, output_layername)
         logAPICall.log('create outputfile %s ... ' % output_file, logAPICall.DEBUG)
@@ -539,7 +458,7 @@ class ZonePopgridCounter(EmptyOperator):
                 1 : QgsField(zone_field, QVariant.String),
                 2 : QgsField(CNT_FIELD_NAME, QVariant.Int),
             }
-            writer = QgsVectorFileWriter(output_file, "utf-8", fields, QGis.WKBPolygon, self._crs, "ESRI Shapefile")                     
+            writer = self._create_layer_writer(output_file, fields, QGis.WKBPolygon)                     
             f = QgsFeature()            
             for _f in layer_features(zone_layer):
                 
@@ -557,19 +476,15 @@ class ZonePopgridCounter(EmptyOperator):
                 f.addAttribute(2, QVariant(bldg_count))
                 writer.addFeature(f)
             
-            del writer, f
+            del f
+            output_layer = writer.layer(output_layername)
         except Exception as err:            
             remove_shapefile(output_file)
             raise OperatorError("error creating zone: %s" % err, self.__class__)
 
-        # clean up
-        del tmp_join_layer
-        remove_shapefile(tmp_join_file)
-
         # store data in output
-        output_layer = load_shapefile(output_file, output_layername)
         if not output_layer:
-            raise OperatorError('Error loading footprint centroid file' % (output_file), self.__class__)        
+            raise OperatorError('Error loading zone file %s' % (output_file), self.__class__)        
         self.outputs[0].value = output_layer
-        self.outputs[1].value = output_file
+        self.outputs[1].value = self._output_file(writer)
     
\ No newline at end of file
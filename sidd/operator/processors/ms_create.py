@@ -16,15 +16,15 @@
 """
 module contains class for creating mapping scheme from survey data
 """
-from qgis.analysis import QgsOverlayAnalyzer
+from collections import OrderedDict
 
-from utils.shapefile import load_shapefile, layer_features, layer_field_index, remove_shapefile, \
-                            layer_field_stats
-from utils.system import get_unique_filename, get_temp_dir, get_dictionary_value
+from utils.shapefile import layer_features, layer_field_index, layer_field_stats, layer_zone_join, \
+                           field_to_float, field_to_int
+from utils.system import get_temp_dir, get_dictionary_value
 
 from sidd.constants import logAPICall, AREA_FIELD_NAME, GRP_FIELD_NAME, TAX_FIELD_NAME, HT_FIELD_NAME, COST_FIELD_NAME
 from sidd.ms import MappingScheme, MappingSchemeZone, Statistics, StatisticNode
-from sidd.taxonomy import get_taxonomy, TaxonomyParseError
+from sidd.taxonomy import get_taxonomy
 from sidd.operator import Operator, OperatorError
 from sidd.operator.data import OperatorDataTypes
 
@@ -87,6 +87,28 @@ class EmptyMSCreator(Operator):
         """ perform operator specific output validation """
         pass
 
+    # internal helper methods
+    ###########################
+
+    def _tally_case(self, cases, tax_str, additional):
+        """ 
+        aggregate case into cases, as taxstr => [count, size_sum, cost_sum] 
+        see Statistics.add_cases
+        """
+        if cases.has_key(tax_str):
+            case = cases[tax_str]
+        else:
+            case = cases[tax_str] = [0, None, None]
+        case[0] += 1
+        for key, idx in ((StatisticNode.AverageSize, 1), (StatisticNode.UnitCost, 2)):
+            if additional.has_key(key):
+                case[idx] = additional[key] + (case[idx] or 0)
+
+    def _add_cases(self, stats, cases):
+        """ add aggregated cases to stats, log cases that cannot be parsed """
+        for tax_str, err in stats.add_cases(cases, self._parse_order, self._parse_modifiers):
+            logAPICall.log("error parsing case %s, %s" % (str(tax_str), str(err)), logAPICall.WARNING)
+
 class EmptyZonesMSCreator(EmptyMSCreator):
     def __init__(self, options=None, name='Empty Zones MSCreator'):
         super(EmptyZonesMSCreator, self).__init__(options, name)    
@@ -164,8 +186,6 @@ class SurveyZonesMSCreator(EmptyMSCreator):
         
         logAPICall.log('survey %s, taxfield %s, zone %s, zone_field, %s' % (survey_layer.name(), tax_field, zone_layer.name(), zone_field),
                        logAPICall.DEBUG)
-        tmp_join_layername = 'join_%s' % get_unique_filename()
-        tmp_join_file = self._tmp_dir + tmp_join_layername + '.shp'
 
         # load zone classes
         try:
@@ -173,49 +193,40 @@ class SurveyZonesMSCreator(EmptyMSCreator):
         except AssertionError as err:
             raise OperatorError(str(err), self.__class__)
         
-        # merge to create stats
-        logAPICall.log('merge survey & zone', logAPICall.DEBUG)
-        analyzer = QgsOverlayAnalyzer()        
-        analyzer.intersection(survey_layer, zone_layer, tmp_join_file)
-        tmp_join_layer = load_shapefile(tmp_join_file, tmp_join_layername)
-        
         logAPICall.log('create mapping schemes', logAPICall.DEBUG)
         ms = MappingScheme(self._taxonomy)
         for _zone, _count in zone_classes.iteritems():
             stats = Statistics(self._taxonomy)
             ms.assign(MappingSchemeZone(_zone), stats)
         
-        # loop through all input features
-        zone_idx = layer_field_index(tmp_join_layer, zone_field)
-        tax_idx = layer_field_index(tmp_join_layer, tax_field)
-        area_idx = layer_field_index(tmp_join_layer, AREA_FIELD_NAME)
-        cost_idx = layer_field_index(tmp_join_layer, COST_FIELD_NAME)
-        
-        for _f in layer_features(tmp_join_layer):
-            _zone_str = str(_f.attributeMap()[zone_idx].toString())            
-            _tax_str = str(_f.attributeMap()[tax_idx].toString())
-            additional = {}
-            _area = _f.attributeMap()[area_idx].toDouble()[0]
-            if _area > 0:
-                additional = {StatisticNode.AverageSize: _area} 
-            _cost = _f.attributeMap()[cost_idx].toDouble()[0]
-            if _cost > 0:
-                additional = {StatisticNode.UnitCost: _cost}                            
-            logAPICall.log('zone %s => %s' % (_zone_str, _tax_str) , logAPICall.DEBUG_L2)
-            try:
-                ms.get_assignment_by_name(_zone_str).add_case(_tax_str, self._parse_order, self._parse_modifiers, additional)
-            except TaxonomyParseError as perr:
-                logAPICall.log("error parsing case %s, %s" % (str(_tax_str), str(perr)), logAPICall.WARNING)
+        # loop through all survey points, with zone containing each point
+        # identical cases are aggregated first and added to statistics once
+        logAPICall.log('merge survey & zone', logAPICall.DEBUG)
+        zone_cases = {}
+        for batch in layer_zone_join(survey_layer, [tax_field, AREA_FIELD_NAME, COST_FIELD_NAME],
+                                     zone_layer, [zone_field]):
+            for _idx in xrange(len(batch[zone_field])):
+                _zone_str = str(batch[zone_field][_idx])
+                _tax_str = str(batch[tax_field][_idx])
+                additional = {}
+                _area = field_to_float(batch[AREA_FIELD_NAME][_idx])
+                if _area > 0:
+                    additional = {StatisticNode.AverageSize: _area} 
+                _cost = field_to_float(batch[COST_FIELD_NAME][_idx])
+                if _cost > 0:
+                    additional = {StatisticNode.UnitCost: _cost}                            
+                logAPICall.log('zone %s => %s' % (_zone_str, _tax_str) , logAPICall.DEBUG_L2)
+                if not zone_cases.has_key(_zone_str):
+                    zone_cases[_zone_str] = OrderedDict()
+                self._tally_case(zone_cases[_zone_str], _tax_str, additional)
+        for _zone_str, cases in zone_cases.iteritems():
+            self._add_cases(ms.get_assignment_by_name(_zone_str), cases)
         
         # store data in output
         for _zone, _stats in ms.assignments():
             _stats.finalize()
             _stats.get_tree().value = _zone.name
 
-        # clean up        
-        del tmp_join_layer, analyzer
-        remove_shapefile(tmp_join_file)
-        
         self.outputs[0].value = ms
 
 class SurveyOnlyMSCreator(EmptyMSCreator):    
@@ -257,7 +268,9 @@ class SurveyOnlyMSCreator(EmptyMSCreator):
         area_idx = layer_field_index(survey_layer, AREA_FIELD_NAME)
         cost_idx = layer_field_index(survey_layer, COST_FIELD_NAME)
         
-        for _f in layer_features(survey_layer):
+        # identical cases are aggregated first and added to statistics once
+        cases = OrderedDict()
+        for _f in layer_features(survey_layer, [tax_field, AREA_FIELD_NAME, COST_FIELD_NAME], False):
             _tax_str = str(_f.attributeMap()[tax_idx].toString())
             additional = {}
             _area = _f.attributeMap()[area_idx].toDouble()[0]
@@ -266,10 +279,8 @@ class SurveyOnlyMSCreator(EmptyMSCreator):
             _cost = _f.attributeMap()[cost_idx].toDouble()[0]
             if _cost > 0:
                 additional = {StatisticNode.UnitCost: _cost}                            
-            try:
-                stats.add_case(_tax_str, self._parse_order, self._parse_modifiers, additional)
-            except TaxonomyParseError as perr:
-                logAPICall.log("error parsing case %s, %s" % (str(_tax_str), str(perr)), logAPICall.WARNING)
+            self._tally_case(cases, _tax_str, additional)
+        self._add_cases(stats, cases)
         
         # store data in output
         stats.finalize()        
@@ -352,29 +363,10 @@ class StratifiedMSCreator(EmptyMSCreator):
         except AssertionError as err:
             raise OperatorError(str(err), self.__class__)
 
-        # join survey with zones        
-        logAPICall.log('merge survey & zone', logAPICall.DEBUG)
-        tmp_join_layername = 'join_%s' % get_unique_filename()
-        tmp_join_file = self._tmp_dir + tmp_join_layername + '.shp'        
-        analyzer = QgsOverlayAnalyzer()        
-        analyzer.intersection(svy_layer, zone_layer, tmp_join_file)        
-        tmp_join_layer = load_shapefile(tmp_join_file, tmp_join_layername)
-        
-        logAPICall.log('compile zone statistics', logAPICall.DEBUG)
-        zone_idx = layer_field_index(tmp_join_layer, zone_field)
-        svy_samp_idx = layer_field_index(tmp_join_layer, GRP_FIELD_NAME)
-        svy_ht_idx = layer_field_index(tmp_join_layer, HT_FIELD_NAME)
-        
-        svy_size_idx = layer_field_index(tmp_join_layer, AREA_FIELD_NAME)
-        if svy_size_idx == -1:
-            raise OperatorError("Field %s does not exist in %s" %(AREA_FIELD_NAME, svy_layer.name()))
-        tax_idx = layer_field_index(tmp_join_layer, TAX_FIELD_NAME)
-        if tax_idx == -1:
-            raise OperatorError("Field %s does not exist in %s" %(TAX_FIELD_NAME, svy_layer.name()))
-        
         # empty fields for holding the stats
         _zone_n_exp, _zone_p_exp, _zone_a_exp, _zone_e_exp = {}, {}, {}, {}
         _zone_group_counts, _zone_group_stories, _zone_group_weight = {}, {}, {}
+        _zone_samples = {}
         _zone_total_area, _zone_total_count, _zone_total_ht = {}, {}, {} 
         for _zone in zone_classes.iterkeys():
             _zone_n_exp[_zone] = {}
@@ -384,22 +376,39 @@ class StratifiedMSCreator(EmptyMSCreator):
             _zone_group_counts[_zone] = {} 
             _zone_group_stories[_zone] = {}
             _zone_group_weight[_zone] = {}
+            _zone_samples[_zone] = {}
             _zone_total_area[_zone] = 0
             _zone_total_count[_zone] = 0
             _zone_total_ht[_zone] = 0
 
-        # associate group to ratio value
-        for _rec in layer_features(tmp_join_layer):
-            _ht = _rec.attributeMap()[svy_ht_idx].toInt()[0]
-            _samp_grp = str(_rec.attributeMap()[svy_samp_idx].toString())            
-            _tax_str = str(_rec.attributeMap()[tax_idx].toString())
-            try:
-                self._taxonomy.parse(_tax_str)            
-                self.increment_dict(_zone_group_counts[_zone], _samp_grp, 1)
-                self.increment_dict(_zone_group_stories[_zone], _samp_grp, _ht)
-            except Exception as err:
-                logAPICall.log("Error processing record %s" % err, logAPICall.WARNING)
-            
+        # join survey with zones, and tally samples of each zone in single pass
+        # - count and stories for each sampling group
+        # - count, floor area and total area for each building type and sampling group,
+        #   weight of sampling group is applied once known 
+        logAPICall.log('merge survey & zone', logAPICall.DEBUG)
+        for batch in layer_zone_join(svy_layer, [HT_FIELD_NAME, GRP_FIELD_NAME, TAX_FIELD_NAME, AREA_FIELD_NAME],
+                                     zone_layer, [zone_field]):
+            for _idx in xrange(len(batch[TAX_FIELD_NAME])):
+                _zone_str = str(batch[zone_field][_idx])
+                _ht = field_to_int(batch[HT_FIELD_NAME][_idx])
+                _samp_grp = str(batch[GRP_FIELD_NAME][_idx])
+                _tax_str = str(batch[TAX_FIELD_NAME][_idx])
+                _sample_size = field_to_float(batch[AREA_FIELD_NAME][_idx])
+                try:
+                    self._taxonomy.parse(_tax_str)
+                except Exception as err:
+                    logAPICall.log("error processing sample with building type: %s" % _tax_str, logAPICall.WARNING)
+                    continue
+                self.increment_dict(_zone_group_counts[_zone_str], _samp_grp, 1)
+                self.increment_dict(_zone_group_stories[_zone_str], _samp_grp, _ht)
+                _tally = _zone_samples[_zone_str].get((_tax_str, _samp_grp))
+                if _tally is None:
+                    _tally = _zone_samples[_zone_str][(_tax_str, _samp_grp)] = [0, 0, 0]
+                _tally[0] += 1
+                _tally[1] += _sample_size
+                _tally[2] += _sample_size*_ht
+        
+        logAPICall.log('compile zone statistics', logAPICall.DEBUG)
         for _zone in zone_classes.iterkeys():
             if len(_zone_group_counts[_zone]) != 3:
                 raise OperatorError("Survey must have 3 sampling groups", self.__class__)
@@ -423,41 +432,25 @@ class StratifiedMSCreator(EmptyMSCreator):
         # - count (n)
         # - floor area (p)
         # - total area (a)
-        for _f in layer_features(tmp_join_layer):
-            _zone_str = str(_f.attributeMap()[zone_idx].toString())
-            _tax_str = str(_f.attributeMap()[tax_idx].toString())            
-            _sample_grp = str(_f.attributeMap()[svy_samp_idx].toString())
-            _sample_size = _f.attributeMap()[svy_size_idx].toDouble()[0]
-            _sample_ht = _f.attributeMap()[svy_size_idx].toDouble()[0]            
+        for _zone in zone_classes.iterkeys():
             group_weight = _zone_group_weight[_zone]
-            try:
-                self._taxonomy.parse(_tax_str)            
-                self.increment_dict(_zone_n_exp[_zone_str], _tax_str, group_weight[_sample_grp])
-                self.increment_dict(_zone_p_exp[_zone_str], _tax_str, _sample_size*group_weight[_sample_grp])
-                self.increment_dict(_zone_a_exp[_zone_str], _tax_str, _sample_size*_ht*group_weight[_sample_grp])
-                self.increment_dict(_zone_e_exp[_zone_str], _tax_str, 0)
-            except Exception as err:
-                logAPICall.log("error processing sample with building type: %s" % _tax_str, logAPICall.WARNING)
-                pass              
+            for (_tax_str, _sample_grp), (_count, _size, _area) in _zone_samples[_zone].iteritems():
+                _weight = group_weight[_sample_grp]
+                self.increment_dict(_zone_n_exp[_zone], _tax_str, _count*_weight)
+                self.increment_dict(_zone_p_exp[_zone], _tax_str, _size*_weight)
+                self.increment_dict(_zone_a_exp[_zone], _tax_str, _area*_weight)
+                self.increment_dict(_zone_e_exp[_zone], _tax_str, 0)
 
         # adjust ratio using footprint ht/area
-        tmp_join_layername2 = 'join_%s' % get_unique_filename()
-        tmp_join_file2 = self._tmp_dir + tmp_join_layername2 + '.shp'        
-        analyzer = QgsOverlayAnalyzer()
-        analyzer.intersection(fp_layer, zone_layer, tmp_join_file2)        
-        tmp_join_layer2 = load_shapefile(tmp_join_file2, tmp_join_layername)
-        
-        zone_idx = layer_field_index(tmp_join_layer2, zone_field)        
-        area_idx = layer_field_index(tmp_join_layer2, area_field)
-        ht_idx = layer_field_index(tmp_join_layer2, ht_field)        
-        for _f in layer_features(tmp_join_layer2):
-            _zone_str = str(_f.attributeMap()[zone_idx].toString())
-            _area = _f.attributeMap()[area_idx].toDouble()[0]
-            _ht = _f.attributeMap()[ht_idx].toDouble()[0]
+        for batch in layer_zone_join(fp_layer, [area_field, ht_field], zone_layer, [zone_field]):
+            for _idx in xrange(len(batch[zone_field])):
+                _zone_str = str(batch[zone_field][_idx])
+                _area = float(batch[area_field][_idx])
+                _ht = float(batch[ht_field][_idx])
 
-            _zone_total_area[_zone_str] += _area
-            _zone_total_count[_zone_str] += 1
-            _zone_total_ht[_zone_str] += _ht
+                _zone_total_area[_zone_str] += _area
+                _zone_total_count[_zone_str] += 1
+                _zone_total_ht[_zone_str] += _ht
         
         # calculate building ratios for each zone        
         for _zone in zone_classes.iterkeys():
@@ -497,16 +490,15 @@ class StratifiedMSCreator(EmptyMSCreator):
             stats = Statistics(self._taxonomy)
 
             # use building ratio to create statistic
+            # building types are already distinct, each is added once with its count
+            cases = {}
             for _tax_str, _e_exp in _zone_e_exp[_zone].iteritems():
-                stats.add_case(_tax_str, self._parse_order, self._parse_modifiers, add_times=int(_e_exp*1000))                                            
+                cases[_tax_str] = (int(_e_exp*1000), None, None)
+            self._add_cases(stats, cases)
             # finalize call is required 
             stats.finalize()
             ms.assign(MappingSchemeZone(_zone), stats)            
         
-        # clean up
-        del tmp_join_layer, analyzer
-        remove_shapefile(tmp_join_file)
-        
         # assign output        
         self.outputs[0].value = ms
         self.outputs[1].value = _zone_a_exp    
@@ -0,0 +1,146 @@
+# Copyright (c) 2011-2013, ImageCat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+module contains class for collecting run statistics of operators
+"""
+import os
+import time
+import json
+import functools
+from threading import Lock
+
+from sidd.constants import logAPICall
+from utils.memory import process_peak_rss
+from utils.cache import SHAPEFILE_EXTENSIONS, INDEX_EXTENSIONS
+
+class OperatorProfiler(object):
+    """
+    collect statistics for each operator run
+    - wall and cpu time
+    - features read from input layers and written to output layers
+    - bytes of output files written by operator into temporary directory
+    - peak memory (resident set size) of process in bytes
+
+    NOTE: cpu time and peak memory are process wide. with operators
+          running concurrently, these values include other operators
+    """
+
+    # constructor / destructor
+    ##################################
+
+    def __init__(self, tmp_dir=None):
+        """ constructor """
+        self.tmp_dir = tmp_dir
+        self._lock = Lock()
+        self.reset()
+
+    # public method
+    ##################################
+
+    def reset(self):
+        """ clear all collected statistics """
+        self.records = []
+        self.start_time = time.time()
+
+    def wrap(self, operator, func):
+        """ return function that runs given operator method with profiling """
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            return self.profile(operator, func, *args, **kw)
+        return wrapper
+
+    def profile(self, operator, func, *args, **kw):
+        """ run func and record statistics for given operator """
+        start_wall, start_cpu = time.time(), self._cpu_time()
+        try:
+            return func(*args, **kw)
+        finally:
+            wall_time = time.time() - start_wall
+            features_read = self._feature_count(getattr(operator, '_inputs', []))
+            features_written = self._feature_count(getattr(operator, '_outputs', []))
+            if wall_time > 0:
+                throughput = max(features_read, features_written) / wall_time
+            else:
+                throughput = 0
+            record = {
+                'operator': operator.__class__.__name__,
+                'name': operator.name,
+                'wall_time': wall_time,
+                'cpu_time': self._cpu_time() - start_cpu,
+                'features_read': features_read,
+                'features_written': features_written,
+                'features_per_second': throughput,
+                'output_bytes': self._output_size(getattr(operator, '_outputs', [])),
+                'peak_rss': process_peak_rss(),
+            }
+            with self._lock:
+                self.records.append(record)
+            logAPICall.log('%(operator)s completed in %(wall_time).2fs (cpu %(cpu_time).2fs), %(features_per_second).0f features/s' % record,
+                           logAPICall.DEBUG)
+
+    def report(self):
+        """ return collected statistics as dictionary """
+        with self._lock:
+            return {
+                'total_time': time.time() - self.start_time,
+                'steps': list(self.records),
+            }
+
+    def save(self, path):
+        """ write collected statistics into JSON file """
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    # internal helper methods
+    ##################################
+
+    def _cpu_time(self):
+        times = os.times()
+        return times[0] + times[1]
+
+    def _output_size(self, data_list):
+        """
+        total size of files within given list of OperatorData, including
+        all files of shapefile. only files in tmp_dir are counted if set
+        """
+        total = 0
+        for data in data_list:
+            if not isinstance(data.value, basestring):
+                continue
+            path = os.path.abspath(data.value)
+            if self.tmp_dir is not None and not path.startswith(os.path.abspath(self.tmp_dir)):
+                continue
+            if path.lower().endswith('.shp'):
+                files = [path[:-4] + _ext for _ext in SHAPEFILE_EXTENSIONS + INDEX_EXTENSIONS]
+            else:
+                files = [path]
+            for _file in files:
+                try:
+                    total += os.path.getsize(_file)
+                except OSError:
+                    pass
+        return total
+
+    def _feature_count(self, data_list):
+        """ total features in all layers within given list of OperatorData """
+        count = 0
+        for data in data_list:
+            if hasattr(data.value, 'featureCount'):
+                try:
+                    count += data.value.featureCount()
+                except:
+                    pass
+        return count
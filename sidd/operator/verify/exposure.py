@@ -16,7 +16,7 @@
 """
 module contains class for applying mapping scheme
 """
-from utils.shapefile import layer_features, layer_field_index
+from utils.shapefile import layer_feature_batches
 
 from sidd.constants import logAPICall, CNT_FIELD_NAME
 from sidd.operator import Operator, OperatorError
@@ -52,9 +52,8 @@ class ExposureAnalyzer(Operator):
     def _get_exposure_total(self, exposure, cnt_field):
         total_exposure=0
         try:
-            cnt_idx = layer_field_index(exposure, cnt_field)
-            for f in layer_features(exposure):
-                total_exposure += f.attributeMap()[cnt_idx].toDouble()[0]                
+            for batch in layer_feature_batches(exposure, [cnt_field]):
+                total_exposure += sum(batch[cnt_field])
         except Exception as err:
             raise OperatorError("error reading count from exposure: %s" % err, self.__class__)
         return total_exposure
@@ -81,12 +80,10 @@ class ExposureFragmentationAnalyzer(ExposureAnalyzer):
         
         frac_count, rec_count = 0, 0
         try:
-            cnt_idx = layer_field_index(exposure, CNT_FIELD_NAME)
-            for f in layer_features(exposure):
-                rec_count += 1
-                count = f.attributeMap()[cnt_idx].toDouble()[0]
-                if count < 1:
-                    frac_count+=1
+            for batch in layer_feature_batches(exposure, [CNT_FIELD_NAME]):
+                counts = batch[CNT_FIELD_NAME]
+                rec_count += len(counts)
+                frac_count += len([count for count in counts if count < 1])
         except Exception as err:
             raise OperatorError("error reading exposure: %s" % err, self.__class__)
         
@@ -128,9 +125,8 @@ class ExposureZoneCountAnalyzer(ExposureAnalyzer):
             # get total building count from zone
             total_zone = 0 
             
-            cnt_idx = layer_field_index(zone_layer, cnt_field)
-            for f in layer_features(zone_layer):                
-                total_zone += f.attributeMap()[cnt_idx].toDouble()[0]
+            for batch in layer_feature_batches(zone_layer, [cnt_field]):
+                total_zone += sum(batch[cnt_field])
         except Exception as err:
             raise OperatorError("error reading count from zone: %s" % err, self.__class__)        
 
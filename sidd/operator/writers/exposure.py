@@ -16,23 +16,28 @@
 """
 module to support exposure export 
 """
-import bsddb
 import os
 import csv
 
 from PyQt4.QtCore import QVariant
-from qgis.core import QgsVectorFileWriter, QgsFeature, QgsField
+from qgis.core import QgsField, QgsFeature
 
-from utils.shapefile import copy_shapefile, shapefile_to_kml, load_shapefile, layer_features, layer_field_index
+from utils.shapefile import copy_shapefile, shapefile_to_kml, load_shapefile, layer_features, layer_field_index, \
+                            remove_shapefile, FeatureSink
 from utils.system import get_unique_filename
+from utils.accumulator import KeyValueAggregator, keep_first
 
-from sidd.constants import logAPICall, GID_FIELD_NAME, MAX_FEATURES_IN_MEMORY
+from sidd.constants import logAPICall, GID_FIELD_NAME, TAX_FIELD_NAME, TAX_ID_FIELD_NAME
+from sidd.taxonomy import TaxonomyDictionary, get_lookup_file
 from sidd.operator import OperatorError
 from sidd.operator.data import OperatorDataTypes
 
 from writer import NullWriter
 
 class ExposureSHPWriter(NullWriter):
+    # GID with feature id
+    bytes_per_record = 100
+
     def __init__(self, options=None, name="Grid Writer"):
         """ constructor """
         super(ExposureSHPWriter, self).__init__(options, name)
@@ -63,48 +68,115 @@ class ExposureSHPWriter(NullWriter):
         try:
             exp_layer = load_shapefile(input_file, 'exposure_%s' % get_unique_filename())
             
-            # store id of distinct features            
-            total_features = exp_layer.dataProvider().featureCount()
-            if total_features > MAX_FEATURES_IN_MEMORY:
-                # use bsddb to store id in case number of features is too large
-                tmp_db_file = '%sdb_%s.db' % (self._tmp_dir, get_unique_filename())
-                db = bsddb.btopen(tmp_db_file, 'c')
-                use_db = True
-            else:
-                # in memory dictionary, should be much faster, but could fail
-                # if memory is limited
-                db = {}
-                use_db = False
-                        
-            # get field index for GID
+            # first feature for each GID, only GID is read.
+            # features for same GID are usually written together, so only
+            # first of consecutive features with same GID is added
+            # spills to disk in case number of features is too large
+            first_features = KeyValueAggregator(self._tmp_dir, self._max_records(), keep_first,
+                                                self._memory_budget())
             gid_idx = layer_field_index(exp_layer, GID_FIELD_NAME)
+            last_gid = None
+            for feature in layer_features(exp_layer, [GID_FIELD_NAME], with_geometry=False):
+                gid = feature.attributeMap()[gid_idx].toInt()[0]
+                if gid != last_gid:
+                    first_features.add(gid, feature.id())
+                    last_gid = gid
+            
+            # same features ordered by feature id
+            export_features = KeyValueAggregator(self._tmp_dir, self._max_records(), keep_first,
+                                                 self._memory_budget())
+            for gid, fid in first_features.items():
+                export_features.add(fid, gid)
+            first_features.close()
+            
+            # only write out once, geometry is only exported for these features
             fields = {
                 0: QgsField(GID_FIELD_NAME, QVariant.Int),
             }            
-            writer = QgsVectorFileWriter(output_file, "utf-8", fields, 
-                                         exp_layer.dataProvider().geometryType(), 
-                                         exp_layer.crs(), "ESRI Shapefile")
-            out_feature = QgsFeature()
-            for feature in layer_features(exp_layer):
-                gid = str(feature.attributeMap()[gid_idx].toString())
-                # only write out once 
-                if not db.has_key(gid):
-                    db[gid]= '1'    # bsddb only accepts string 
-                    out_feature.addAttribute(0, gid)
-                    out_feature.setGeometry(feature.geometry())
-                    writer.addFeature(out_feature)
+            writer = FeatureSink(output_file, fields, 
+                                 exp_layer.dataProvider().geometryType(), exp_layer.crs())
+            # features are read by id in increasing order, so geometry
+            # is only read for exported features
+            provider = exp_layer.dataProvider()
+            feature = QgsFeature()
+            for fid, gid in export_features.items():
+                if provider.featureAtId(fid, feature, True, []):
+                    writer.write([gid], feature.geometry())
                     
             # clean up
-            del writer                
-            if use_db:
-                db.close()
-                os.remove(tmp_db_file)
+            writer.close()
+            export_features.close()
 
-            # copy associated attribute file            
-            copy_shapefile(input_file, output_dbf, extensions=['.dbf'])
+            # copy associated attribute file, expand taxonomy IDs if required
+            dictionary = self._read_dictionary(input_file)
+            if dictionary is not None and self._expand_taxonomy():
+                self._write_expanded(exp_layer, output_dbf, dictionary, False)
+            else:
+                copy_shapefile(input_file, output_dbf, extensions=['.dbf'])
+                if dictionary is not None:
+                    dictionary.write(get_lookup_file(output_file))
         except Exception as err:
             raise OperatorError("error creating shapefile: %s" % err, self.__class__)
 
+    # internal helper methods
+    ###########################
+
+    def _read_dictionary(self, input_file):
+        """ taxonomy dictionary of exposure file, None if exposure does not use taxonomy IDs """
+        lookup_file = get_lookup_file(input_file)
+        if not os.path.exists(lookup_file):
+            return None
+        dictionary = TaxonomyDictionary()
+        dictionary.read(lookup_file)
+        return dictionary
+
+    def _export_fields(self, fields, expand):
+        """ exported fields, with taxonomy ID replaced by taxonomy string if expanded """
+        export_fields = {}
+        for fidx, field in fields.iteritems():
+            if expand and field.name() == TAX_ID_FIELD_NAME:
+                field = QgsField(TAX_FIELD_NAME, QVariant.String, "", 255)
+            export_fields[fidx] = field
+        return export_fields
+
+    def _export_rows(self, exp_layer, dictionary=None, with_geometry=False):
+        """
+        generator of (attribute values, geometry) for all exposure features. 
+        taxonomy ID is replaced by taxonomy string if dictionary is given
+        """
+        fields = exp_layer.dataProvider().fields()
+        for feature in layer_features(exp_layer, with_geometry=with_geometry):
+            row = []
+            for fidx, value in feature.attributeMap().iteritems():
+                # retrieve data according to field type
+                if dictionary is not None and fields[fidx].name() == TAX_ID_FIELD_NAME:
+                    row.append(dictionary.get_string(value.toInt()[0]))
+                elif fields[fidx].type() == QVariant.Int:
+                    row.append(value.toInt()[0])
+                elif fields[fidx].type() == QVariant.Double:
+                    row.append(value.toDouble()[0])
+                else:
+                    row.append(str(value.toString()))
+            if with_geometry:
+                yield row, feature.geometry()
+            else:
+                yield row, None
+
+    def _write_expanded(self, exp_layer, output_file, dictionary, with_geometry=True):
+        """ 
+        write exposure into output_file with taxonomy IDs expanded into taxonomy strings
+        only attribute table is written if with_geometry is False
+        """
+        fields = self._export_fields(exp_layer.dataProvider().fields(), True)
+        if with_geometry:
+            geometry_type = exp_layer.dataProvider().geometryType()
+        else:
+            geometry_type = None
+        writer = FeatureSink(output_file, fields, geometry_type, exp_layer.crs())
+        for row, geometry in self._export_rows(exp_layer, dictionary, with_geometry):
+            writer.write(row, geometry)
+        writer.close()
+
 class ExposureCSVWriter(ExposureSHPWriter):
     def __init__(self, options=None, name="Grid Writer"):
         """ constructor """
@@ -118,22 +190,18 @@ class ExposureCSVWriter(ExposureSHPWriter):
                 
         try:
             exp_layer = load_shapefile(input_file, 'exposure_%s' % get_unique_filename())
+            # taxonomy IDs are expanded if required, otherwise lookup table is exported 
+            dictionary = self._read_dictionary(input_file)
+            if dictionary is not None and not self._expand_taxonomy():
+                dictionary.write(get_lookup_file(output_file))
+                dictionary = None
             # get field headers/types
-            fields = exp_layer.dataProvider().fields()
+            fields = self._export_fields(exp_layer.dataProvider().fields(), dictionary is not None)
             csvfile = open(output_file, 'wb')
             csvwriter = csv.writer(csvfile, delimiter=',',
                                    quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
             csvwriter.writerow([f.name() for f in fields.values()])
-            for feature in layer_features(exp_layer):
-                row = []
-                for fidx, value in feature.attributeMap().iteritems():
-                    # retrieve data according to field type
-                    if fields[fidx].type() == QVariant.Int:
-                        row.append(value.toInt()[0])
-                    elif fields[fidx].type() == QVariant.Double:
-                        row.append(value.toDouble()[0])
-                    else:
-                        row.append(str(value.toString()))
+            for row, geometry in self._export_rows(exp_layer, dictionary):
                 csvwriter.writerow(row)
             csvfile.close()
         except Exception as err:
@@ -150,7 +218,24 @@ class ExposureKMLWriter(ExposureSHPWriter):
         input_file = self.inputs[0].value
         output_file = self.inputs[1].value
         
-        shapefile_to_kml(input_file, output_file)
+        dictionary = self._read_dictionary(input_file)
+        if dictionary is None:
+            shapefile_to_kml(input_file, output_file)
+        elif self._expand_taxonomy():
+            # convert from copy of exposure with taxonomy IDs expanded 
+            tmp_file = '%sexp_%s.shp' % (self._tmp_dir, get_unique_filename())
+            try:
+                exp_layer = load_shapefile(input_file, 'exposure_%s' % get_unique_filename())
+                self._write_expanded(exp_layer, tmp_file, dictionary)
+                del exp_layer
+                shapefile_to_kml(tmp_file, output_file)
+            except Exception as err:
+                raise OperatorError("error exporting KML: %s" % err, self.__class__)
+            finally:
+                remove_shapefile(tmp_file)
+        else:
+            shapefile_to_kml(input_file, output_file)
+            dictionary.write(get_lookup_file(output_file))
 
 class ExposureNRMLWriter(ExposureSHPWriter):
     def __init__(self, options=None, name="Grid Writer"):
@@ -23,15 +23,19 @@ import shutil
 import json
 
 from utils.enum import makeEnum
-from utils.system import get_temp_dir, get_random_name
+from utils.system import get_temp_dir, get_random_name, get_user_dir
+from utils.cache import ShapefileCache
+from utils.memory import MemoryBudget
+from sidd.operator.profiler import OperatorProfiler
 from utils.shapefile import remove_shapefile
 
 from sidd.constants import logAPICall, \
-                           FILE_PROJ_TEMPLATE, \
+                           FILE_PROJ_TEMPLATE, DEFAULT_MEMORY_BUDGET, \
                            FootprintTypes, OutputTypes, SurveyTypes, ZonesTypes, PopGridTypes, \
                            ProjectStatus, ExtrapolateOptions, SyncModes, ExportTypes, MSExportTypes, \
                            ProjectErrors
 from sidd.ms import MappingSchemeZone, MappingScheme, Statistics
+from sidd.taxonomy import TaxonomyDictionary, get_lookup_file
 from sidd.exception import SIDDException, SIDDProjectException, WorkflowException
 from sidd.workflow import Workflow, WorkflowBuilder
 
@@ -47,11 +51,26 @@ class Project (object):
         """ constructor """
         self.temp_dir = get_temp_dir('tmp%s'%get_random_name())
         self.app_config = app_config
+        self.profiler = OperatorProfiler(self.temp_dir)
         self.operator_options = {
             'tmp_dir': self.temp_dir,
+            'profiler': self.profiler,
             'taxonomy':taxonomy,    
             'parse_modifiers':app_config.get('options', 'parse_modifier', True, bool),        
+            'max_workers':app_config.get('options', 'max_workers', 1, int),
+            'memory_layer_features':app_config.get('options', 'memory_layer_features', 0, int),
+            'memory_budget':MemoryBudget(app_config.get('options', 'memory_budget', DEFAULT_MEMORY_BUDGET, float)),
+            # grid cell x zone coverage, kept for rebuilding exposure with same zones
+            'grid_coverage':{},
+            # taxonomy string => ID, used in exposure created by project
+            'taxonomy_dictionary':TaxonomyDictionary(),
+            'export.expand_taxonomy':app_config.get('options', 'expand_taxonomy', True, bool),
         }
+        # shapefile cache reused across projects, disabled if cache size is not set
+        cache_size = app_config.get('options', 'cache_size', 0, float)
+        if cache_size > 0:
+            cache_dir = app_config.get('options', 'cache_dir', get_user_dir() + 'cache/')
+            self.operator_options['cache'] = ShapefileCache(cache_dir, cache_size)
         self.reset()
 
         self.project_file = None
@@ -171,6 +190,7 @@ class Project (object):
         self.output_type = OutputTypes.Grid
 
         self.exposure = None
+        self.profile = None
         
         self.export_type = ExportTypes.Shapefile
         self.export_path = ''
@@ -252,7 +272,7 @@ class Project (object):
     def build_exposure_total_steps(self):
         if not self.workflow.ready:
             raise SIDDException('exposure workflow not complete')
-        return self.workflow.steps()
+        return self.workflow.steps(self.operator_options.get('max_workers', 1))
 
     @logAPICall
     def build_exposure_steps(self):
@@ -265,12 +285,18 @@ class Project (object):
         
         for zone in self.ms.zones:
             zone.stats.refresh_leaves(with_modifier=True, order_attributes=True)
+        self.profiler.reset()
         
         if getattr(self, 'exposure', None) is not None:
             del self.exposure
             remove_shapefile(self.exposure_file)
+            lookup_file = get_lookup_file(self.exposure_file)
+            if os.path.exists(lookup_file):
+                os.remove(lookup_file)
         
-        for op in self.workflow.nextstep():
+        # independent operators (e.g. data loaders) are grouped into one step
+        # and processed concurrently if max_workers is set
+        for op in self.workflow.nextstep(self.operator_options.get('max_workers', 1)):
             yield op
         
         # when all steps are completed, set resulting exposure
@@ -280,6 +306,7 @@ class Project (object):
             self.exposure_grid = self.workflow.operator_data['exposure_grid'].value
         
         logAPICall.log('exposure data created %s' % self.exposure_file, logAPICall.INFO)    
+        self.save_profile()
 
     @logAPICall
     def build_ms(self):
@@ -376,7 +403,24 @@ class Project (object):
                 pass
                 
         logAPICall.log('result verification completed', logAPICall.INFO)
+        self.save_profile()
     
+    @logAPICall
+    def save_profile(self):
+        """ 
+        save statistics of operators run since last exposure build
+        report is stored next to project file, or in temp directory for unsaved project
+        """
+        self.profile = self.profiler.report()
+        if self.project_file is not None:
+            self.profile_file = '%s.profile.json' % self.project_file[0:self.project_file.rfind('.')]
+        else:
+            self.profile_file = '%sprofile.json' % self.temp_dir
+        try:
+            self.profiler.save(self.profile_file)
+        except Exception as err:
+            logAPICall.log('failed to save profile %s: %s' % (self.profile_file, err), logAPICall.WARNING)
+
     @logAPICall
     def export_data(self):
         """ export exposure data """
@@ -389,6 +433,7 @@ class Project (object):
             # process workflow 
             export_workflow.process()
             logAPICall.log('data export completed', logAPICall.INFO)            
+            self.save_profile()
         except Exception as err:
             raise SIDDException("error exporting data\n" % err)
     
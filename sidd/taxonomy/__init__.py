@@ -22,6 +22,7 @@ from taxonomy import (Taxonomy, TaxonomyAttributeGroup, TaxonomyAttribute,
                       TaxonomyAttributeSinglecodeValue,
                       TaxonomyAttributePairValue)
 from exception import TaxonomyError, TaxonomyParseError
+from dictionary import TaxonomyDictionary, get_lookup_file
 
 def get_taxonomy(name):
     if name.upper() == 'GEM':
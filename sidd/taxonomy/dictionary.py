@@ -0,0 +1,103 @@
+# Copyright (c) 2011-2013, ImageCat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+dictionary encoding of taxonomy strings
+"""
+import csv
+from threading import Lock
+
+from sidd.constants import TAX_ID_FIELD_NAME, TAX_FIELD_NAME
+from exception import TaxonomyError
+
+def get_lookup_file(shapefile):
+    """ lookup table file kept with given dictionary encoded shapefile """
+    return '%s_tax.csv' % shapefile[0:shapefile.rfind('.')]
+
+class TaxonomyDictionary(object):
+    """
+    maps each distinct taxonomy string to a small integer ID
+
+    IDs are assigned from 1 in order strings are first added, and are kept
+    for the life of the dictionary, so all exposure created in a project
+    uses the same IDs. lookup table is stored as CSV file with ID and
+    taxonomy string of each entry
+    """
+    # constructor / destructor
+    ##################################
+
+    def __init__(self):
+        """ constructor """
+        self._ids = {}
+        self._strings = {}
+        self._next_id = 1
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    # public method
+    ##################################
+
+    def get_id(self, tax_str):
+        """ ID of given taxonomy string, new ID is assigned if not yet added """
+        tax_id = self._ids.get(tax_str)
+        if tax_id is not None:
+            return tax_id
+        with self._lock:
+            # check again, may have been added by other thread
+            tax_id = self._ids.get(tax_str)
+            if tax_id is None:
+                tax_id = self._add(tax_str, self._next_id)
+        return tax_id
+
+    def get_string(self, tax_id):
+        """ taxonomy string for given ID, None if ID is not known """
+        return self._strings.get(tax_id)
+
+    def items(self):
+        """ list of (ID, taxonomy string) ordered by ID """
+        return sorted(self._strings.iteritems())
+
+    def write(self, path):
+        """ write lookup table to given file """
+        with open(path, 'wb') as lookup_file:
+            writer = csv.writer(lookup_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow([TAX_ID_FIELD_NAME, TAX_FIELD_NAME])
+            for tax_id, tax_str in self.items():
+                writer.writerow([tax_id, tax_str])
+
+    def read(self, path):
+        """ add all entries from lookup table file, with their IDs """
+        with open(path, 'rb') as lookup_file:
+            reader = csv.reader(lookup_file, delimiter=',', quotechar='"')
+            # skip header
+            reader.next()
+            with self._lock:
+                for row in reader:
+                    tax_id, tax_str = int(float(row[0])), row[1]
+                    if self._strings.get(tax_id, tax_str) != tax_str:
+                        raise TaxonomyError('ID %s is already used by %s' % (tax_id, self._strings[tax_id]))
+                    self._add(tax_str, tax_id)
+
+    # internal helper methods
+    ##################################
+
+    def _add(self, tax_str, tax_id):
+        """ add entry, must be called with lock held """
+        self._ids[tax_str] = tax_id
+        self._strings[tax_id] = tax_str
+        self._next_id = max(self._next_id, tax_id + 1)
+        return tax_id
@@ -21,11 +21,20 @@ import os
 import re
 import copy
 from operator import attrgetter
+from collections import OrderedDict
+from threading import Lock
 
 from sidd.constants import logAPICall
 from sidd.taxonomy import Taxonomy, TaxonomyAttributeGroup, TaxonomyAttribute, TaxonomyAttributeValue, TaxonomyAttributeCode
 from sidd.taxonomy import TaxonomyError, TaxonomyParseError
 from sidd.taxonomy import TaxonomyAttributeMulticodeValue, TaxonomyAttributePairValue, TaxonomyAttributeSinglecodeValue
+
+# patterns for each format of taxonomy value
+MULTICODE_PATTERN = re.compile('\w+(\+\w+)+')
+PAIR_PATTERN = re.compile('\w+\:\d*')
+CODE_PATTERN = re.compile('\w+')
+# number of parsed taxonomy strings kept
+PARSE_CACHE_SIZE = 10000
 
 class GemTaxonomy(Taxonomy):
     """
@@ -37,6 +46,10 @@ class GemTaxonomy(Taxonomy):
         db_path = os.path.dirname( __file__ ) + os.path.sep + self.__GEM_TAXONOMY_FILE
         if not os.path.exists(db_path):
             raise TaxonomyError("gem taxonomy db not found")
+
+        # taxonomy string => parsed values, least recently used first
+        self.__parsed = OrderedDict()
+        self.__parse_lock = Lock()
 
         # open associated sqlite DB and load attributes
         self.__initialized = False
@@ -122,14 +135,36 @@ class GemTaxonomy(Taxonomy):
 
     @logAPICall
     def parse(self, taxonomy_str):
-        str_attrs = str(taxonomy_str).split('/')
+        """
+        parse taxonomy string into tuple of taxonomy values
+        NOTE: parsed values are cached and shared by all callers,
+              so they must not be modified
+        """
+        taxonomy_str = str(taxonomy_str)
+        with self.__parse_lock:
+            attributes = self.__parsed.pop(taxonomy_str, None)
+            if attributes is not None:
+                # move to end as most recently used
+                self.__parsed[taxonomy_str] = attributes
+                return attributes
+        
+        attributes = tuple(self.__parse(taxonomy_str))
+        with self.__parse_lock:
+            self.__parsed[taxonomy_str] = attributes
+            if len(self.__parsed) > PARSE_CACHE_SIZE:
+                self.__parsed.popitem(last=False)
+        return attributes
+
+    def __parse(self, taxonomy_str):
+        """ parse taxonomy string into list of taxonomy values """
+        str_attrs = taxonomy_str.split('/')
         if len(str_attrs)== 0:
             raise TaxonomyParseError("Incorrect format")
 
         attributes = []
         for attr in str_attrs:
             # determine type
-            if re.match('\w+(\+\w+)+', attr):
+            if MULTICODE_PATTERN.match(attr):
                 # multiple codes, split and search each
                 levels = attr.split('+')
                 for lvl in levels:
@@ -139,7 +174,7 @@ class GemTaxonomy(Taxonomy):
                     codeValue = GemTaxonomyAttributeSinglecodeValue(code.attribute)
                     codeValue.add_value(code)
                     attributes.append(codeValue)
-            elif re.match('\w+\:\d*', attr):
+            elif PAIR_PATTERN.match(attr):
                 # code:value format
                 (type_id, val) = attr.split(':')
                 if not self.__codes.has_key(type_id):
@@ -148,7 +183,7 @@ class GemTaxonomy(Taxonomy):
                 codeValue = GemTaxonomyAttributePairValue(code.attribute)
                 codeValue.add_value(code, val)
                 attributes.append(codeValue)
-            elif re.match('\w+', attr):
+            elif CODE_PATTERN.match(attr):
                 # code only, search code table
                 if not self.__codes.has_key(attr):
                     raise TaxonomyParseError('%s is not a valid taxonomy code' %(attr))
@@ -164,7 +199,7 @@ class GemTaxonomy(Taxonomy):
     @logAPICall
     def to_string2(self, taxonomy_values, order_attributes=False, fill_missing=False):
         """ serialize a set of taxonomy values into GEM specific taxonomy string """
-        vals = self.parse("/".join([str(n) for n in taxonomy_values]))        
+        vals = list(self.parse("/".join([str(n) for n in taxonomy_values])))
         if (fill_missing):
             to_add = [g.name for g in self.attribute_groups]
             for v in vals:
@@ -175,7 +210,7 @@ class GemTaxonomy(Taxonomy):
             str_add = []
             for name in to_add:
                 str_add.append(self.get_attribute_group_by_name(name).default)
-            vals = vals + self.parse("/".join(str_add))
+            vals = vals + list(self.parse("/".join(str_add)))
             order_attributes=True
 
         if (order_attributes):
@@ -193,8 +228,17 @@ class GemTaxonomy(Taxonomy):
  
     @logAPICall
     def to_string(self, taxonomy_values, order_attributes=False, fill_missing=False):
-        """ serialize a set of taxonomy values into GEM specific taxonomy string """
-        vals = self.parse("/".join([str(n) for n in taxonomy_values]))
+        """ 
+        serialize a set of taxonomy values into GEM specific taxonomy string 
+        taxonomy_values can be parsed taxonomy values or strings 
+        """
+        vals = []
+        for n in taxonomy_values:
+            if isinstance(n, TaxonomyAttributeValue):
+                # already parsed
+                vals.append(n)
+            else:
+                vals.extend(self.parse(n))
         if not order_attributes:
             out_str = []
             for idx, v in enumerate(vals):
@@ -211,9 +255,7 @@ class GemTaxonomy(Taxonomy):
             out_str[0], out_str[3] = 'DX','DY'
             vals.sort(key=lambda val:val.code.attribute.group.order*100+val.code.attribute.order)
             for v in vals:
-                g_name = v.attribute.group.name
-                idxlist = [i for i,val in enumerate(self._output_str) if val==g_name]
-                for idx in idxlist:
+                for idx in self._output_idx.get(v.attribute.group.name, []):
                     if out_str[idx] == '':
                         out_str[idx] = str(v)
                     else:
@@ -253,6 +295,10 @@ class GemTaxonomy(Taxonomy):
         for row in c:
             output_str.append(str(row[1]))                  
         self._output_str = output_str[:3]+output_str
+        # attribute group name => positions in output string
+        self._output_idx = {}
+        for idx, name in enumerate(self._output_str):
+            self._output_idx.setdefault(name, []).append(idx)
         sql = """
             select g.order_in_basic,  g.attribute, max(a.level) levels, g.format
             from dic_gem_attributes g
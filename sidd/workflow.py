@@ -17,6 +17,8 @@
 SIDD workflow manager
 """
 from xml.etree.ElementTree import ElementTree, fromstring
+from threading import Thread
+from Queue import Queue, Empty
 
 from sidd.exception import WorkflowException
 from sidd.constants import logAPICall, WorkflowErrors, \
@@ -70,31 +72,91 @@ class Workflow(object):
         self.build_workflow(workflow.parse(xml_file))
 
     @logAPICall
-    def nextstep(self):
+    def nextstep(self, max_workers=1):
         """ 
         generator for each step in the process
         can be used as
         for step in workflow.nextstep():
             # do something with step        
+        
+        with max_workers > 1, operators that do not depend on each other
+        are grouped into a single OperatorBatch step running them concurrently
         """
-        for op in self.operators:
-            yield op
+        if max_workers <= 1:
+            for op in self.operators:
+                yield op
+            return
+        for batch in self.batches():
+            if len(batch) == 1:
+                yield batch[0]
+            else:
+                yield OperatorBatch(batch, max_workers)
             
     @logAPICall        
-    def steps(self):
-        """ return number of operators """
-        return len(self.operators)
+    def steps(self, max_workers=1):
+        """ return number of steps returned by nextstep """
+        if max_workers <= 1:
+            return len(self.operators)
+        return len(self.batches())
 
     @logAPICall
-    def process(self):
+    def process(self, max_workers=1):
         """ 
-        process entire workflow according to step defined         
+        process entire workflow according to step defined
+        independent operators are run concurrently if max_workers > 1
         """
         if not self.ready:
             return
-        for op in self.nextstep():
+        for op in self.nextstep(max_workers):
             op.do_operation()        
 
+    @logAPICall
+    def dependencies(self):
+        """
+        return for each operator the set of indices of operators it depends on.
+        dependencies are derived from OperatorData objects shared between operators:
+        - an operator depends on the last operator writing to any of its inputs
+        - an operator writing to a data depends on all previous readers and writer
+          of the same data, so that ordering in the operator list is preserved
+        """
+        writers = {}
+        readers = {}
+        deps = []
+        for idx, op in enumerate(self.operators):
+            op_deps = set()
+            for data in getattr(op, '_inputs', []):
+                key = id(data)
+                if writers.has_key(key):
+                    op_deps.add(writers[key])
+                readers.setdefault(key, []).append(idx)
+            for data in getattr(op, '_outputs', []):
+                key = id(data)
+                if writers.has_key(key):
+                    op_deps.add(writers[key])
+                op_deps.update(readers.get(key, []))
+                writers[key] = idx
+            op_deps.discard(idx)
+            deps.append(op_deps)
+        return deps
+
+    @logAPICall
+    def batches(self):
+        """
+        return operators grouped into list of batches.
+        operators in the same batch do not depend on each other and all
+        their dependencies are in earlier batches. order of operators 
+        within a batch follows order in workflow.operators
+        """
+        deps = self.dependencies()
+        level = []
+        for idx in range(len(self.operators)):
+            # dependencies always refer to earlier operators
+            level.append(max([level[d]+1 for d in deps[idx]] or [0]))
+        batches = [[] for i in range(max(level or [-1])+1)]
+        for idx, op in enumerate(self.operators):
+            batches[level[idx]].append(op)
+        return batches
+
     # internal help functions
     ##################################    
     def reset(self):
@@ -134,6 +196,57 @@ class Workflow(object):
             self.operators[op_id] = operator
         self.ready=False
 
+class OperatorBatch(object):
+    """
+    group of independent operators processed concurrently as a single workflow step
+    
+    NOTE: operators are run in threads. each operator works on its own
+          layers and temporary files, which must not be shared within a batch.
+          QGIS layers are created one at a time and handed over to the main 
+          thread (see utils.shapefile), but QGIS 1.x does not guarantee that 
+          data providers of different layers can be read concurrently. 
+          if operators fail only with max_workers > 1, set max_workers to 1
+    """
+    def __init__(self, operators, max_workers):
+        self.operators = operators
+        self.max_workers = max_workers
+
+    @property
+    def name(self):
+        return ", ".join([op.name for op in self.operators])
+
+    @logAPICall
+    def do_operation(self):
+        """ 
+        run all operators in batch, re-raise first error encountered 
+        once all operators have completed
+        """
+        tasks = Queue()
+        for op in self.operators:
+            tasks.put(op)
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    op = tasks.get_nowait()
+                except Empty:
+                    return
+                try:
+                    op.do_operation()
+                except Exception as err:
+                    logAPICall.log('operator %s failed: %s' % (op.name, err), logAPICall.WARNING)
+                    errors.append(err)
+
+        threads = [Thread(target=worker) 
+                   for i in range(min(self.max_workers, len(self.operators)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            raise errors[0]
+
 class WorkflowBuilder(object):
     """
     class for building workflow from project    
@@ -19,7 +19,8 @@ import os
 # import sidd packages for testing
 from sidd.constants import ExtrapolateOptions
 from sidd.ms import MappingScheme, MappingSchemeZone, \
-                    Statistics, StatisticNode, StatisticError, StatisticNodeError
+                    Statistics, StatisticNode, StatisticModifier, \
+                    StatisticError, StatisticNodeError
 from sidd.taxonomy import get_taxonomy
 
 from common import SIDDTestCase
@@ -66,6 +67,38 @@ class MSTestCase(SIDDTestCase):
             ms2.get_assignment_by_name("ALL").to_xml().strip().__len__()
         )
   
+    def test_WeightedCases(self):
+        import csv
+        from collections import OrderedDict
+        survey = csv.reader(open(self.survey_file , 'r'), delimiter=',', quotechar='"')
+        survey.next()
+        tax_strings = [row[2] for row in survey]
+        
+        # aggregated cases build same tree as adding cases one by one
+        stats = Statistics(self.taxonomy)
+        cases = OrderedDict()
+        for tax_string in tax_strings:
+            stats.add_case(tax_string, parse_order=self.ms_parse_order)
+            cases[tax_string] = (cases.get(tax_string, (0,))[0] + 1, None, None)
+        stats.finalize()
+        stats2 = Statistics(self.taxonomy)
+        self.assertEqual(stats2.add_cases(cases, parse_order=self.ms_parse_order), [])
+        stats2.finalize()
+        self.assertEqual(stats.to_xml(), stats2.to_xml())
+        
+        # weighted case is counted once for each time
+        stats = Statistics(self.taxonomy)
+        stats2 = Statistics(self.taxonomy)
+        for tax_string in tax_strings[:10]:
+            for i in range(3):
+                stats.add_case(tax_string, parse_order=self.ms_parse_order)
+            stats2.add_case(tax_string, parse_order=self.ms_parse_order, add_times=3)
+        self.assertEqual(stats.get_tree().count, 30)
+        self.assertEqual(stats2.get_tree().count, 30)
+        stats.finalize()
+        stats2.finalize()
+        self.assertEqual(stats.to_xml(), stats2.to_xml())
+
     def test_SaveMS(self):
         tmp_ms_file = self.test_tmp_dir + "tmp_ms.xml"
         ms = self.test_BuildMS(skipTest=True)        
@@ -135,4 +168,133 @@ class MSTestCase(SIDDTestCase):
         self.assertEqual(total_samples, sum([s[1] for s in samples]))
         samples = stats.get_samples(total_samples, ExtrapolateOptions.Fraction)
         self.assertAlmostEqual(total_samples, sum([s[1] for s in samples]), places=2)
+        
+        # random walk follows distribution of leaves
+        total_samples = 20000
+        expected = {}
+        for val, wt, node in stats.leaves:
+            expected[val] = expected.get(val, 0) + wt
+        samples = stats.get_samples(total_samples, ExtrapolateOptions.RandomWalk)
+        self.assertEqual(total_samples, sum([s[1] for s in samples]))
+        for val, count, size, cost in samples:
+            self.assertAlmostEqual(float(count) / total_samples, expected[val], delta=0.02)
+
+    def test_LookupIndexes(self):
+        ms = self.test_LoadMS(skipTest=True, statsOnly=False)
+        stats = ms.get_assignment_by_name("ALL")
+        self.assertTrue(stats is ms.zones[0].stats)
+        self.assertTrue(ms.get_assignment_by_name("no such zone") is None)
+        
+        # node lookups
+        node = stats.get_tree().children[0]
+        leaf = node
+        while not leaf.is_leaf:
+            leaf = leaf.children[-1]
+        self.assertTrue(node.get_child(node.children[-1].value) is node.children[-1])
+        self.assertTrue(stats.has_node(leaf))
+        self.assertTrue(ms.get_assignment_by_node(leaf) is stats)
+        
+        # deleted node is no longer found
+        stats.delete_branch(leaf)
+        self.assertFalse(stats.has_node(leaf))
+        self.assertTrue(ms.get_assignment_by_node(leaf) is None)
+        
+        # new zone is indexed
+        stats2 = Statistics(self.taxonomy)
+        stats2.finalize()
+        ms.assign(MappingSchemeZone('ZONE2'), stats2)
+        self.assertTrue(ms.get_assignment_by_name('ZONE2') is stats2)
+        self.assertTrue(ms.get_assignment_by_node(stats2.get_tree()) is stats2)
+        
+        # renamed zone is found by new name only
+        zone = [z for z in ms.zones if z.stats is stats2][0]
+        zone.name = 'ZONE3'
+        self.assertTrue(ms.get_assignment_by_name('ZONE3') is stats2)
+        self.assertTrue(ms.get_assignment_by_name('ZONE2') is None)
+        
+        # child values changed in place are found
+        self.assertTrue(node.get_child('no such value') is None)
+        values = [str(child.value) for child in node.children]
+        values[-1] = 'NEW_VALUE'
+        node.update_children(node.children[0].name, values, [0] * (len(values) - 1) + [100])
+        self.assertTrue(node.get_child('NEW_VALUE') is node.children[-1])
+        
+    def test_CloneNode(self):
+        stats = self.test_LoadMS(skipTest=True, statsOnly=True)
+        root = stats.get_tree()
+        self.assertFalse(hasattr(root, '__dict__'))
+        
+        # clone is detached copy with same content
+        node = root.children[0]
+        clone = node.clone
+        self.assertTrue(clone.parent is None)
+        self.assertEqual(clone.to_xml(), node.to_xml())
+        for child in clone.children:
+            self.assertTrue(child.parent is clone)
+        
+        # changes to clone do not affect original
+        clone.children[0].weight = -1
+        clone.modifiers.append(StatisticModifier('User', clone.level))
+        self.assertNotEqual(clone.to_xml(), node.to_xml())
+        
+    def test_ReleaseMS(self):
+        import gc
+        import weakref
+        from utils.memory import process_rss
+        
+        # discarded tree is freed without garbage collection
+        ms = self.test_LoadMS(skipTest=True, statsOnly=False)
+        stats = ms.get_assignment_by_name("ALL")
+        stats.refresh_leaves()
+        ms_ref = weakref.ref(ms)
+        root_ref = weakref.ref(stats.get_tree())
+        leaf_ref = weakref.ref(stats.leaves[0][2])
+        del stats
+        del ms
+        self.assertTrue(ms_ref() is None)
+        self.assertTrue(root_ref() is None)
+        self.assertTrue(leaf_ref() is None)
+        
+        # memory stays flat while mapping schemes are built and discarded
+        def build_and_discard(iterations):
+            for i in range(iterations):
+                ms = self.test_BuildMS(skipTest=True)
+                for zone, stats in ms.assignments():
+                    stats.refresh_leaves()
+                    stats.get_samples(100, ExtrapolateOptions.RandomWalk)
+                ms = self.test_LoadMS(skipTest=True, statsOnly=False)
+            del ms
+            gc.collect()
+        build_and_discard(3)
+        start_rss = process_rss()
+        build_and_discard(20)
+        end_rss = process_rss()
+        self.assertEqual(len(gc.garbage), 0)
+        if start_rss is not None:
+            self.assertTrue(end_rss - start_rss < 4 * 1024 * 1024)
+        
+    def test_LeafTable(self):
+        ms = self.test_LoadMS(skipTest=True, statsOnly=False)
+        zone_name = ms.zones[0].name
+        stats = ms.get_assignment_by_name(zone_name)
+        self.assertTrue(ms.get_leaf_table('no such zone') is None)
+        
+        # compiled once and reused
+        table = ms.get_leaf_table(zone_name)
+        self.assertTrue(table is ms.get_leaf_table(zone_name))
+        self.assertEqual(len(table), len(stats.leaves))
+        self.assertAlmostEqual(sum(table.weights), 1)
+        
+        # compiled again after tree is modified
+        node = stats.get_tree().children[0]
+        branch = node.children[0].clone
+        existing = [str(child.value) for child in node.children]
+        branch.value = [code for code in ['CIP', 'PC', 'CIPPS'] if code not in existing][0]
+        stats.add_branch(node, branch)
+        table2 = ms.get_leaf_table(zone_name)
+        self.assertFalse(table is table2)
+        self.assertTrue(table2 is ms.get_leaf_table(zone_name))
+        self.assertTrue(len(table2) > len(table))
+        self.assertTrue([value for value in table2.values if value.find(branch.value) >= 0])
+        self.assertAlmostEqual(sum(table2.weights), 1)
     
@@ -90,6 +90,61 @@ class OperatorTestCase(SIDDTestCase):
         Operator.get_operator('sidd.operator.processors.GridWriter',
                               self.operator_options)
 
+    def test_OperatorProfiler(self):
+        from sidd.operator.profiler import OperatorProfiler
+        profiler = OperatorProfiler(self.test_tmp_dir)
+        options = self.operator_options.copy()
+        options['profiler'] = profiler
+        
+        loader = FootprintLoader(options)
+        loader.inputs = [
+            OperatorData(OperatorDataTypes.Shapefile, self.fp_path),
+        ]
+        loader.outputs = [
+            OperatorData(OperatorDataTypes.Footprint),
+            OperatorData(OperatorDataTypes.Shapefile),
+        ]
+        loader.do_operation()
+        
+        report = profiler.report()
+        self.assertEqual(len(report['steps']), 1)
+        step = report['steps'][0]
+        self.assertEqual(step['operator'], 'FootprintLoader')
+        self.assertEqual(step['features_written'], self.fp_feature_count)
+        self.assertTrue(step['output_bytes'] > 0)
+        # in bytes
+        self.assertTrue(step['peak_rss'] is None or step['peak_rss'] > 1024 * 1024)
+        self._clean_layer(loader.outputs)
+
+    def test_OperatorBatch(self):
+        from sidd.workflow import OperatorBatch
+        def make_loader(fp_path):
+            loader = FootprintLoader(self.operator_options)
+            loader.inputs = [
+                OperatorData(OperatorDataTypes.Shapefile, fp_path),
+            ]
+            loader.outputs = [
+                OperatorData(OperatorDataTypes.Footprint),
+                OperatorData(OperatorDataTypes.Shapefile),
+            ]
+            return loader
+        
+        # operators run concurrently, outputs same as run one by one
+        loaders = [make_loader(self.fp_path), make_loader(self.fp3_path)]
+        OperatorBatch(loaders, 2).do_operation()
+        self.assertEqual(loaders[0].outputs[0].value.dataProvider().featureCount(), self.fp_feature_count)
+        self.assertEqual(loaders[1].outputs[0].value.dataProvider().featureCount(), self.fp3_feature_count)
+        self.assertNotEqual(loaders[0].outputs[1].value, loaders[1].outputs[1].value)
+        for loader in loaders:
+            self.assertTrue(os.path.exists(loader.outputs[1].value))
+            self._clean_layer(loader.outputs)
+        
+        # error is raised once other operators in batch have completed
+        loaders = [make_loader(self.test_data_dir + 'missing.shp'), make_loader(self.fp_path)]
+        self.assertRaises(Exception, OperatorBatch(loaders, 2).do_operation)
+        self.assertEqual(loaders[1].outputs[0].value.dataProvider().featureCount(), self.fp_feature_count)
+        self._clean_layer(loaders[1].outputs)
+
     # test loaders
     ##################################
 
@@ -523,6 +578,26 @@ class OperatorTestCase(SIDDTestCase):
         self._clean_layer(zone_data)
         self._clean_layer(merger.outputs)
 
+    def test_ZoneGridCoverage(self):
+        logging.debug('test_ZoneGridCoverage')
+        
+        zone_data = self.test_LoadZone2(True, 2)
+        self.operator_options['grid_coverage'] = {}
+        merger = ZoneToGrid(self.operator_options)
+        coverage = merger._zone_coverage(zone_data[0].value)
+        self.assertEqual(len(coverage.zones), self.zone2_feature_count)
+        
+        # entire zone is distributed to grid cells
+        distributed = coverage.distribute(dict((zone, 1.0) for zone in coverage.zones))
+        self.assertAlmostEqual(sum(distributed), self.zone2_feature_count, places=4)
+        
+        # same zones, coverage is reused
+        self.assertTrue(merger._zone_coverage(zone_data[0].value) is coverage)
+        self.assertEqual(len(self.operator_options['grid_coverage']), 1)
+        
+        # cleanup
+        self._clean_layer(zone_data)
+
     def test_ZoneFootprintToGridJoin(self, skipTest=False):
         logging.debug('test_ZoneFootprintJoin %s' % skipTest)
         
@@ -694,6 +769,42 @@ class OperatorTestCase(SIDDTestCase):
             return ms_creator.outputs        
         self.assertEquals(type(ms_creator.outputs[0].value), MappingScheme)        
 
+    def test_CreateMSFromCSVSurveyZone(self):
+        # CSV survey has no area, cost or height fields
+        loader = CSVSurveyLoader(self.operator_options)
+        loader.inputs = [
+            OperatorData(OperatorDataTypes.File, self.test_data_dir + 'survey.csv'),
+            OperatorData(OperatorDataTypes.StringAttribute, 'CSV'),
+            OperatorData(OperatorDataTypes.StringAttribute, None),
+        ]
+        loader.outputs = [
+            OperatorData(OperatorDataTypes.Survey),
+            OperatorData(OperatorDataTypes.Shapefile),
+        ]
+        loader.do_operation()
+        zone_data = self.test_LoadZone(True, 3)
+        
+        ms_creator = SurveyZonesMSCreator(self.operator_options)
+        ms_creator.set_inputs([
+            loader.outputs[0],
+            zone_data[0],
+            OperatorData(OperatorDataTypes.StringAttribute, self.zone3_field),
+        ])
+        ms_creator.set_outputs([
+            OperatorData(OperatorDataTypes.MappingScheme)
+        ])
+        ms_creator.do_operation()
+        self._clean_layer(zone_data)
+        self._clean_layer(loader.outputs)
+        
+        # survey points are within zones, all are counted
+        ms = ms_creator.outputs[0].value
+        total = 0
+        for zone, stats in ms.assignments():
+            stats.refresh_leaves()
+            total += len(stats.leaves)
+        self.assertTrue(total > 0)
+
     def test_CreateMSFromSurveyOnly(self, skipTest=False):
         logging.debug('test_CreateMSFromSurveyZone %s' % skipTest)
         
@@ -144,6 +144,13 @@ class ProjectTestCase(SIDDTestCase):
         self.assertTrue(workflow.ready)
         self.assertEqual(len(workflow.errors), 0)
 
+        # footprint and zone loaders are independent, remaining steps are sequential
+        batches = workflow.batches()
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(len(batches[0]), 2)
+        self.assertEqual(workflow.steps(max_workers=2), 3)
+        self.assertEqual(workflow.steps(), 4)
+
         # test case, zonecount and ms to grid, no exception
         proj.set_footprint(FootprintTypes.None) # remove footprint
         proj.set_zones(ZonesTypes.LanduseCount, self.zone_path, self.zone_field, self.bldgcount_field)
@@ -193,4 +200,29 @@ class ProjectTestCase(SIDDTestCase):
         proj.build_exposure()
         self.assertTrue(os.path.exists(proj.exposure_file))
         del proj
+
+    def test_BatchArguments(self):
+        import sys
+        import getopt
+        import subprocess
+        from SIDD_batch import parse_args, log_files, EXIT_USAGE, EXIT_FILE_NOT_FOUND
+        
+        self.assertEqual(parse_args(['-w', '2', '-n', 'a.sidd']), (2, None, False, ['a.sidd']))
+        self.assertEqual(parse_args(['-h']), None)
+        for argv in [['-w', 'x', 'a.sidd'], ['-w', '0', 'a.sidd'], ['-q', 'a.sidd'], []]:
+            self.assertRaises(getopt.GetoptError, parse_args, argv)
+        
+        # projects with same name are logged into separate files
+        logs = log_files(['a/p.sidd', 'b/p.sidd', 'c/q.sidd'], self.test_tmp_dir)
+        self.assertEqual(len(set(logs)), 3)
+        self.assertEqual(logs[0], os.path.join(self.test_tmp_dir, 'p.log'))
+        
+        # exit codes
+        def run_batch(*args):
+            return subprocess.call([sys.executable, 'SIDD_batch.py'] + list(args))
+        self.assertEqual(run_batch('-w', '0', 'a.sidd'), EXIT_USAGE)
+        missing_file = self.test_tmp_dir + 'missing.sidd'
+        self.assertEqual(run_batch('-w', '1', '-n', '-l', self.test_tmp_dir, missing_file), 
+                         EXIT_FILE_NOT_FOUND)
+        self.assertTrue(os.path.exists(self.test_tmp_dir + 'missing.log'))
         
\ No newline at end of file
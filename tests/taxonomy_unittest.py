@@ -16,7 +16,10 @@
 #
 
 # import sidd packages for testing
-from sidd.taxonomy import get_taxonomy, TaxonomyAttributePairValue
+import os
+
+from sidd.taxonomy import get_taxonomy, TaxonomyAttributePairValue, TaxonomyParseError, \
+                          TaxonomyDictionary
 
 from common import SIDDTestCase
 
@@ -60,6 +63,44 @@ class TaxonomyTestCase(SIDDTestCase):
         self.assertEquals(len(attrs), 5)
         self.assertTrue(isinstance(self._get_attribute_by_name(attrs, 'Height'), TaxonomyAttributePairValue))
 
+    def test_ParseCache(self):
+        tax_string = 'MUR+CLBRS+MOL/LWAL/RWO+RWO1/FE+FM1/HEX:3/Y99/IRHO/RES+RES2C'
+        attrs = self.taxonomy.parse(tax_string)
+        # parsed values are shared 
+        self.assertTrue(isinstance(attrs, tuple))
+        self.assertTrue(attrs is self.taxonomy.parse(tax_string))
+        
+        # invalid string always fails
+        for i in range(2):
+            with self.assertRaises(TaxonomyParseError):
+                self.taxonomy.parse('MUR/NOT_A_CODE')
+        
+        # parsed values serialize same as strings
+        str_attrs = [str(attr) for attr in attrs]
+        self.assertEqual(self.taxonomy.to_string(attrs), tax_string)
+        self.assertEqual(self.taxonomy.to_string(attrs), self.taxonomy.to_string(str_attrs))
+        self.assertEqual(self.taxonomy.to_string(attrs, True), self.taxonomy.to_string(str_attrs, True))
+
+    def test_Dictionary(self):
+        tax_strings = ['MUR+CLBRS+MOL/HEX:3/RES+RES2C', 'CR+CIP/LFINF+DNO/HBET:1,3', 'W/HEX:1']
+        dictionary = TaxonomyDictionary()
+        ids = [dictionary.get_id(tax_string) for tax_string in tax_strings]
+        self.assertEqual(ids, [1, 2, 3])
+        # same string always gets same ID
+        self.assertEqual(dictionary.get_id(tax_strings[1]), 2)
+        self.assertEqual(len(dictionary), 3)
+        self.assertEqual(dictionary.get_string(3), tax_strings[2])
+        self.assertTrue(dictionary.get_string(4) is None)
+        
+        # lookup table keeps IDs
+        lookup_file = self.test_tmp_dir + 'tax_lookup.csv'
+        dictionary.write(lookup_file)
+        dictionary2 = TaxonomyDictionary()
+        dictionary2.read(lookup_file)
+        os.remove(lookup_file)
+        self.assertEqual(dictionary2.items(), dictionary.items())
+        self.assertEqual(dictionary2.get_id('UNK'), 4)
+
     def _get_attribute_by_name(self, attrs, name):
         value = None
         for val in attrs:
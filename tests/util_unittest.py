@@ -14,6 +14,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+
 # import sidd packages for testing
 from common import SIDDTestCase
 
@@ -33,6 +35,377 @@ class UtilsTestCase(SIDDTestCase):
             lat2, lon2 = grid_to_latlon(grid)
             self.assertAlmostEqual(lat, lat2, places=4)
             self.assertAlmostEqual(lon, lon2, places=4)
-            
+
+    def test_GridArrays(self):
+        from utils.grid import latlon_to_grid, grid_to_latlon, \
+                               latlon_to_grids, grids_to_latlon, grid_unique, grid_bincount
+        lats = [  33.995833,  -5.6625,    -3.1375,    6.12083,   33.995833]
+        lons = [-112.004167, 106.104167, -12.412541, 85.22916, -112.004167]
+        grids = latlon_to_grids(lats, lons)
+        self.assertEqual(list(grids), [latlon_to_grid(lat, lon) for lat, lon in zip(lats, lons)])
+        lats2, lons2 = grids_to_latlon(grids)
+        self.assertEqual(zip(lats2, lons2), [grid_to_latlon(grid) for grid in grids])
+        
+        self.assertEqual(list(grid_unique(grids)), sorted(set(grids)))
+        counts = grid_bincount(grids)
+        self.assertEqual(counts[grids[0]], 2)
+        self.assertEqual(counts[grids[1]], 1)
+        totals = grid_bincount(grids, weights=[1.5, 2, 2, 2, 0.5], keys=['A', 'A', 'B', 'B', 'B'])
+        self.assertEqual(totals[('A', grids[0])], 1.5)
+        self.assertEqual(totals[('B', grids[0])], 0.5)
+        self.assertEqual(len(totals), 5)
+
+    def test_GridCoverage(self):
+        from utils.grid import latlon_to_grid, grid_coverage
+        cell = 1 / 120.0
+        
+        # rectangle split evenly between two cells
+        wkt = 'POLYGON ((%.10f %.10f,%.10f %.10f,%.10f %.10f,%.10f %.10f,%.10f %.10f))' % (
+            10.2*cell, 20.2*cell, 10.2*cell, 20.8*cell, 11.8*cell, 20.8*cell, 11.8*cell, 20.2*cell, 10.2*cell, 20.2*cell)
+        coverage = dict(grid_coverage(wkt))
+        self.assertEqual(sorted(coverage.keys()), 
+                         sorted([latlon_to_grid(20.5*cell, 10.5*cell), latlon_to_grid(20.5*cell, 11.5*cell)]))
+        for ratio in coverage.values():
+            self.assertAlmostEqual(ratio, 0.5)
+        
+        # triangle across several cells, all of polygon is assigned
+        wkt = 'POLYGON ((-0.011 0.5,0.023 0.52,0.001 0.487,-0.011 0.5))'
+        coverage = dict(grid_coverage(wkt))
+        self.assertTrue(len(coverage) > 4)
+        self.assertAlmostEqual(sum(coverage.values()), 1.0)
+        
+    def test_GridCoverageTiles(self):
+        from utils.grid import grid_cell_areas, grid_tiles, GridCoverage
+        wkt = 'POLYGON ((-0.011 0.5,0.023 0.52,0.001 0.487,-0.011 0.5))'
+        
+        # each cell is in exactly one tile
+        tiles = grid_tiles(wkt, tile_rows=2)
+        self.assertTrue(len(tiles) > 1)
+        tiled = {}
+        for row_min, row_max in tiles:
+            for grid_id, area in grid_cell_areas(wkt, row_min, row_max):
+                self.assertFalse(tiled.has_key(grid_id))
+                tiled[grid_id] = area
+        cells = dict(grid_cell_areas(wkt))
+        self.assertEqual(sorted(tiled.keys()), sorted(cells.keys()))
+        for grid_id, area in cells.iteritems():
+            self.assertAlmostEqual(tiled[grid_id], area)
+        
+        # same coverage computed by worker processes
+        serial, parallel = GridCoverage(), GridCoverage()
+        serial.add_zones([1, 2], [wkt, wkt])
+        parallel.add_zones([1, 2], [wkt, wkt], max_workers=2)
+        self.assertEqual(len(serial), len(parallel))
+        for (grid1, zone1, ratio1), (grid2, zone2, ratio2) in zip(sorted(serial.entries()), sorted(parallel.entries())):
+            self.assertEqual((grid1, zone1), (grid2, zone2))
+            self.assertAlmostEqual(ratio1, ratio2)
+        
+    def test_LayerFeatures(self):
+        from utils.shapefile import load_shapefile, layer_features, layer_field_index, _field_index_cache
+        zone_layer = load_shapefile(self.test_data_dir + 'zones2.shp', 'zones2')
+        
+        # field lookup is case insensitive
+        self.assertEqual(layer_field_index(zone_layer, 'LandUse'), layer_field_index(zone_layer, 'LANDUSE'))
+        self.assertEqual(layer_field_index(zone_layer, 'NotAField'), -1)
+        
+        # only requested field is read, without geometry
+        cnt_idx = layer_field_index(zone_layer, 'NumBldg')
+        total_count, total_bldg = 0, 0
+        for f in layer_features(zone_layer, ['NumBldg'], False):
+            self.assertEqual(f.attributeMap().keys(), [cnt_idx])
+            total_count += 1
+            total_bldg += f.attributeMap()[cnt_idx].toDouble()[0]
+        self.assertEqual(total_count, 546)
+        self.assertEqual(total_bldg, 292377)
+        
+        # only features within extent
+        extent = zone_layer.extent()
+        extent.scale(0.5)
+        self.assertTrue(0 < len([f for f in layer_features(zone_layer, [], False, extent)]) < 546)
+        
+        # field lookup is kept only while layer is in use
+        self.assertTrue(zone_layer in _field_index_cache)
+        cache_size = len(_field_index_cache)
+        del zone_layer
+        self.assertEqual(len(_field_index_cache), cache_size - 1)
+        
+    def test_LayerSpatialIndex(self):
+        from utils.shapefile import load_shapefile, copy_shapefile, layer_features
+        zone_file = self.test_tmp_dir + 'zones2.shp'
+        copy_shapefile(self.test_data_dir + 'zones2.shp', zone_file)
+        
+        # spatial index is only created when layer is queried by extent
+        zone_layer = load_shapefile(zone_file, 'zones2')
+        self.assertEqual(len([f for f in layer_features(zone_layer, [], False)]), 546)
+        self.assertFalse(os.path.exists(self.test_tmp_dir + 'zones2.qix'))
+        extent = zone_layer.extent()
+        extent.scale(0.5)
+        [f for f in layer_features(zone_layer, [], False, extent)]
+        self.assertTrue(os.path.exists(self.test_tmp_dir + 'zones2.qix'))
+        del zone_layer
+        
+    def test_LayerFeatureBatches(self):
+        from utils.shapefile import load_shapefile, layer_feature_batches
+        zone_layer = load_shapefile(self.test_data_dir + 'zones2.shp', 'zones2')
+        
+        total_count, total_bldg = 0, 0
+        for batch in layer_feature_batches(zone_layer, ['LandUse', 'NumBldg'], 100, with_centroid=True):
+            self.assertTrue(len(batch['LandUse']) <= 100)
+            self.assertEqual(len(batch['LandUse']), len(batch['x']))
+            total_count += len(batch['LandUse'])
+            total_bldg += sum(batch['NumBldg'])
+        self.assertEqual(total_count, 546)
+        self.assertEqual(total_bldg, 292377)
+        
+        # field not in layer
+        batches = layer_feature_batches(zone_layer, ['NotAField'])
+        self.assertRaises(Exception, batches.next)
+        del zone_layer
+
+    def test_LayerWriter(self):
+        from PyQt4.QtCore import QVariant
+        from qgis.core import QGis, QgsCoordinateReferenceSystem, QgsFeature, QgsField, QgsGeometry, QgsPoint
+        from utils.shapefile import LayerWriter, is_memory_layer, layer_feature_batches
+        crs = QgsCoordinateReferenceSystem(4326, QgsCoordinateReferenceSystem.PostgisCrsId)
+        fields = {0 : QgsField('GID', QVariant.Int)}
+        
+        def write_layer(output_file, max_features):
+            writer = LayerWriter(output_file, fields, QGis.WKBPoint, crs, max_features)
+            f = QgsFeature()
+            for gid in range(3):
+                f.setGeometry(QgsGeometry.fromPoint(QgsPoint(gid, gid)))
+                f.addAttribute(0, QVariant(gid))
+                writer.addFeature(f)
+            return writer, writer.layer('points')
+        
+        # small layer is kept in memory
+        output_file = self.test_tmp_dir + 'points1.shp'
+        writer, layer = write_layer(output_file, 5)
+        self.assertTrue(writer.in_memory)
+        self.assertTrue(is_memory_layer(layer))
+        self.assertFalse(os.path.exists(output_file))
+        batch = layer_feature_batches(layer, ['GID'], with_centroid=True).next()
+        self.assertEqual(list(batch['GID']), [0, 1, 2])
+        self.assertEqual(list(batch['x']), [0.0, 1.0, 2.0])
+        
+        # written to file when over limit
+        output_file = self.test_tmp_dir + 'points2.shp'
+        writer, layer = write_layer(output_file, 2)
+        self.assertFalse(writer.in_memory)
+        self.assertFalse(is_memory_layer(layer))
+        self.assertTrue(os.path.exists(output_file))
+        self.assertEqual(layer.dataProvider().featureCount(), 3)
+        del layer
+        
+        # values written as list, in memory or to file
+        for output_file, max_features in [(self.test_tmp_dir + 'rects1.shp', 5), (self.test_tmp_dir + 'rects2.shp', 2)]:
+            writer = LayerWriter(output_file, fields, QGis.WKBPolygon, crs, max_features)
+            for gid in range(3):
+                writer.write_rect([gid], gid, gid, gid + 1, gid + 1)
+            self.assertEqual(writer.in_memory, max_features > 3)
+            layer = writer.layer('rects')
+            batch = layer_feature_batches(layer, ['GID'], with_centroid=True).next()
+            self.assertEqual(list(batch['GID']), [0, 1, 2])
+            self.assertEqual(list(batch['x']), [0.5, 1.5, 2.5])
+            del layer
+        
+    def test_FeatureSink(self):
+        from PyQt4.QtCore import QVariant
+        from qgis.core import QGis, QgsCoordinateReferenceSystem, QgsField
+        from utils.shapefile import FeatureSink, load_shapefile, layer_feature_batches
+        crs = QgsCoordinateReferenceSystem(4326, QgsCoordinateReferenceSystem.PostgisCrsId)
+        fields = {
+            0 : QgsField('GID', QVariant.Int),
+            1 : QgsField('ZONE', QVariant.String),
+        }
+        
+        # features are buffered, written out in batches of 2
+        output_file = self.test_tmp_dir + 'sink.shp'
+        writer = FeatureSink(output_file, fields, QGis.WKBPoint, crs, batch_size=2)
+        for gid in range(5):
+            writer.write_point([gid, 'Z%d' % gid], gid, gid)
+        writer.close()
+        
+        layer = load_shapefile(output_file, 'sink')
+        self.assertEqual(layer.dataProvider().featureCount(), 5)
+        batch = layer_feature_batches(layer, ['GID', 'ZONE'], with_centroid=True).next()
+        self.assertEqual(list(batch['GID']), range(5))
+        self.assertEqual(batch['ZONE'], ['Z%d' % gid for gid in range(5)])
+        self.assertEqual(list(batch['y']), [0.0, 1.0, 2.0, 3.0, 4.0])
+        del layer
+        
+    def test_ZoneIndex(self):
+        import osgeo.ogr as ogr
+        from utils.shapefile import load_shapefile, layer_feature_batches, layer_zone_join, ZoneIndex
+        zone_layer = load_shapefile(self.test_data_dir + 'zones2.shp', 'zones2')
+        index = ZoneIndex(zone_layer, ['LandUse'])
+        self.assertEqual(index.count, 546)
+        
+        # same zone as testing each zone geometry
+        batch = layer_feature_batches(zone_layer, [], with_centroid=True, with_geometry=True).next()
+        geometries = [ogr.CreateGeometryFromWkt(wkt) for wkt in batch['geometry']]
+        for x, y in zip(batch['x'], batch['y']):
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint_2D(x, y)
+            expected = -1
+            for zone_id, geom in enumerate(geometries):
+                if geom.Intersects(point):
+                    expected = zone_id
+                    break
+            self.assertEqual(index.locate(x, y), expected)
+        extent = zone_layer.extent()
+        self.assertEqual(index.locate(extent.xMinimum()-1, extent.yMinimum()-1), -1)
+        
+        # join zone attributes to points
+        total = 0
+        for joined in layer_zone_join(zone_layer, ['NumBldg'], zone_layer, ['LandUse']):
+            self.assertEqual(len(joined['LandUse']), len(joined['NumBldg']))
+            total += len(joined['x'])
+        self.assertTrue(0 < total <= 546)
+        del zone_layer
+        
+    def test_CellAccumulator(self):
+        from utils.accumulator import CellAccumulator
+        acc_file = self.test_tmp_dir + 'acc.dat'
+        accumulator = CellAccumulator(acc_file, tile_size=4)
+        
+        # cells in different tiles, including negative row/col
+        accumulator.add('B', 5, -3)
+        accumulator.add('A', 1, 2, 2)
+        accumulator.add_cells(['A', 'A', 'B'], [1, -6, 5], [2, 9, -3])
+        accumulator.add_cells(['A'], [0], [9], [0.5])
+        self.assertEqual(list(accumulator.cells()),
+                         [('B', 5, -3, 2), ('A', -6, 9, 1), ('A', 0, 9, 0.5), ('A', 1, 2, 3)])
+        
+        # temporary file removed
+        accumulator.close()
+        self.assertFalse(os.path.exists(acc_file))
+        
+    def test_KeyValueAggregator(self):
+        import glob
+        from utils.accumulator import KeyValueAggregator, keep_first
+        
+        # in memory only
+        totals = KeyValueAggregator(self.test_tmp_dir, 100)
+        totals.add_items([(('B', 1), 2), (('A', 3), 1), (('B', 1), 0.5)])
+        self.assertEqual(list(totals.items()), [(('A', 3), 1), (('B', 1), 2.5)])
+        totals.close()
+        
+        # spilled into sorted runs and merged
+        totals = KeyValueAggregator(self.test_tmp_dir, 3)
+        expected = {}
+        for i in range(100):
+            key = (i % 7, str(i % 2))
+            totals.add(key, i)
+            expected[key] = expected.get(key, 0) + i
+        self.assertTrue(len(glob.glob(self.test_tmp_dir + 'kv_*.run')) > 0)
+        self.assertEqual(list(totals.items()), sorted(expected.items()))
+        totals.close()
+        self.assertEqual(len(glob.glob(self.test_tmp_dir + 'kv_*.run')), 0)
+        
+        # first value added is kept for each key
+        first = KeyValueAggregator(self.test_tmp_dir, 2, keep_first)
+        for i in range(10):
+            first.add(i % 3, i)
+        self.assertEqual(list(first.items()), [(0, 0), (1, 1), (2, 2)])
+        first.close()
+        
+        # runs merged in passes, order of values for same key is kept
+        first = KeyValueAggregator(self.test_tmp_dir, 2, keep_first, fan_in=3)
+        for i in range(50):
+            first.add(i % 5, i)
+        self.assertTrue(len(glob.glob(self.test_tmp_dir + 'kv_*.run')) > 3)
+        self.assertEqual(list(first.items()), [(i, i) for i in range(5)])
+        self.assertTrue(len(glob.glob(self.test_tmp_dir + 'kv_*.run')) < 3)
+        first.close()
+        self.assertEqual(len(glob.glob(self.test_tmp_dir + 'kv_*.run')), 0)
+        
+    def test_MemoryBudget(self):
+        import glob
+        from utils.memory import MemoryBudget, process_rss, process_peak_rss, MIN_RECORDS, CHECK_INTERVAL
+        from utils.accumulator import KeyValueAggregator
+        if process_rss() is None:
+            return
+        
+        # both reported in bytes, sampled differently so only roughly comparable
+        peak = process_peak_rss()
+        if peak is not None:
+            self.assertTrue(peak > process_rss() / 2)
+        
+        large = MemoryBudget(1e15)
+        self.assertFalse(large.exceeded())
+        self.assertTrue(large.max_records(100) > large.max_records(100, 4) > MIN_RECORDS)
+        
+        # budget already used up, minimum is still allowed
+        small = MemoryBudget(1)
+        self.assertTrue(small.exceeded())
+        self.assertEqual(small.max_records(100), MIN_RECORDS)
+        
+        # aggregator spills once memory exceeds budget, regardless of max_keys
+        totals = KeyValueAggregator(self.test_tmp_dir, CHECK_INTERVAL * 10, budget=small)
+        for i in range(CHECK_INTERVAL * 2):
+            totals.add(i, 1)
+        self.assertEqual(len(glob.glob(self.test_tmp_dir + 'kv_*.run')), 2)
+        self.assertEqual(len(list(totals.items())), CHECK_INTERVAL * 2)
+        totals.close()
+        
+    def test_ShapefileCache(self):
+        from utils.cache import ShapefileCache
+        cache_dir = self.test_tmp_dir + 'cache/'
+        cache = ShapefileCache(cache_dir, 70)
+        
+        # fake shapefile, only content matters for cache
+        def make_file(name, size):
+            base = self.test_tmp_dir + name
+            for ext in ['.shp', '.dbf']:
+                with open(base + ext, 'w') as out:
+                    out.write('x' * size)
+            return base + '.shp'
+        
+        input1 = make_file('input1', 10)
+        input2 = make_file('input2', 30)
+        key1 = cache.get_key('test', [input1], ['a'])
+        self.assertNotEqual(key1, cache.get_key('test', [input1], ['b']))
+        self.assertNotEqual(key1, cache.get_key('test', [input2], ['a']))
+        self.assertFalse(cache.fetch(key1, self.test_tmp_dir + 'output1.shp'))
+        
+        # store and fetch, fetched file is identified by the same key
+        cache.store(key1, input1)
+        output1 = self.test_tmp_dir + 'output1.shp'
+        self.assertTrue(cache.fetch(key1, output1))
+        self.assertEqual(os.path.getsize(output1), 10)
+        self.assertEqual(cache.signature(output1), key1)
+        
+        # index persists across instances
+        cache = ShapefileCache(cache_dir, 70)
+        self.assertTrue(cache.has_key(key1))
+        
+        # least recently used entry is evicted when over size limit
+        key2 = cache.get_key('test', [input2])
+        cache.store(key2, input2)
+        self.assertFalse(cache.has_key(key1))
+        self.assertTrue(cache.has_key(key2))
+        
+        # entries stored through other instance on same directory are kept
+        shared_dir = self.test_tmp_dir + 'shared_cache/'
+        cache = ShapefileCache(shared_dir, 1000)
+        other = ShapefileCache(shared_dir, 1000)
+        cache.store(key1, input1)
+        other.store(key2, input2)
+        self.assertTrue(cache.has_key(key2))
+        key3 = cache.get_key('test', [input1], ['c'])
+        cache.store(key3, input1)
+        for key in [key1, key2, key3]:
+            self.assertTrue(other.has_key(key))
+        
+        # other data kept in cache
+        key4 = cache.get_key('data', [], ['d'])
+        self.assertEqual(other.fetch_data(key4), None)
+        cache.store_data(key4, {'a':[1, 2.5]})
+        self.assertEqual(other.fetch_data(key4), {'a':[1, 2.5]})
+        
+        # no temporary files left in cache
+        self.assertEqual([_file for _file in os.listdir(shared_dir) if _file.find('.tmp') >= 0], [])
+        
         
         
\ No newline at end of file
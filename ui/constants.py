@@ -187,6 +187,9 @@ SIDD_UI_STRINGS = {
     "widget.result.dq.tests.count._note":QApplication.translate('app.result', 'NOTE: Distribution from Zone to Grid could cause minor error in total count.', None, QApplication.UnicodeUTF8),
     "widget.result.dq.tests.fragmentation":QApplication.translate('app.result', 'Number of Fractional Records', None, QApplication.UnicodeUTF8),
     "widget.result.dq.tests.fragmentation.record_count":QApplication.translate('app.result', 'Total Records in Generated Exposure: %.0f', None, QApplication.UnicodeUTF8),
+    "widget.result.profile.total_time":QApplication.translate('app.result', 'Processing Time: %.2f seconds', None, QApplication.UnicodeUTF8),
+    "widget.result.profile.step":QApplication.translate('app.result', '  %s: %.2fs (cpu %.2fs), %d features read, %d features written, %.0f features/s', None, QApplication.UnicodeUTF8),
+    "widget.result.profile.file":QApplication.translate('app.result', 'Full processing report saved in %s', None, QApplication.UnicodeUTF8),
     "widget.result.dq.tests.fragmentation.fraction_count":QApplication.translate('app.result', 'Total Records with Fractional Building Count: %.0f', None, QApplication.UnicodeUTF8),
     
 
@@ -214,6 +217,7 @@ SIDD_UI_STRINGS = {
     "dlg.result.bldgcount":QApplication.translate('app.result.info', 'Building Count', None, QApplication.UnicodeUTF8),
     # operator processing messages
     ######################
+    "message.sidd.workflow.OperatorBatch":QApplication.translate('app.processing', 'Processing Multiple Steps ...', None, QApplication.UnicodeUTF8),
     "message.sidd.operator.loaders.footprint.FootprintLoader":QApplication.translate('app.processing', 'Loading Building Footprints ...', None, QApplication.UnicodeUTF8),
     "message.sidd.operator.loaders.footprint.FootprintHtLoader":QApplication.translate('app.processing', 'Loading Building Footprints with Heights  ...', None, QApplication.UnicodeUTF8),
     "message.sidd.operator.loaders.ms.MappingSchemeLoader":QApplication.translate('app.processing', 'Loading Mapping Scheme  ...', None, QApplication.UnicodeUTF8),
@@ -18,9 +18,11 @@ dialog for editing mapping scheme branches
 """
 from PyQt4.QtGui import QDialog, QCloseEvent, QAbstractItemView
 from PyQt4.QtCore import Qt, pyqtSlot, QSettings, QVariant, QString, QAbstractTableModel
+from qgis.core import QgsField
 from operator import itemgetter
 
-from sidd.constants import logAPICall, SIDD_COMPANY, SIDD_APP_NAME, SIDD_VERSION, CNT_FIELD_NAME
+from sidd.constants import logAPICall, SIDD_COMPANY, SIDD_APP_NAME, SIDD_VERSION, \
+                           CNT_FIELD_NAME, TAX_FIELD_NAME, TAX_ID_FIELD_NAME
 
 from ui.constants import logUICall, UI_PADDING
 from ui.qt.dlg_res_detail_ui import Ui_tablePreviewDialog
@@ -70,28 +72,36 @@ class DialogResult(Ui_tablePreviewDialog, QDialog):
     ###############################     
     
     @logUICall
-    def showExposureData(self, header, selected):
+    def showExposureData(self, header, selected, dictionary=None):
         """
         display selected rows with header
+        taxonomy ID is shown as taxonomy string if dictionary is given
         """
         fnames =[]      # retrieve field name as table headers
         cnt_sum = 0     # total number of buildings 
                 
-        # find index for building count field
+        # find index for building count and taxonomy fields
         cnt_idx = -1
+        tax_idx = -1
         for i, f in header.iteritems():
             fnames.append(f.name())
             if f.name() == CNT_FIELD_NAME:
                 cnt_idx = i        
+            elif f.name() == TAX_FIELD_NAME or f.name() == TAX_ID_FIELD_NAME:
+                tax_idx = i
         if cnt_idx <> -1:   # building count index is found
             # increment building count
             for s in selected:
                 cnt_sum  += s[cnt_idx].toDouble()[0]
+        if tax_idx <> -1 and header[tax_idx].name() == TAX_ID_FIELD_NAME and dictionary is not None:
+            # replace taxonomy ID with taxonomy string
+            header, selected = self.decodeTaxonomy(header, selected, tax_idx, dictionary)
                 
         # display result 
         self.resultDetailModel = ResultDetailTableModel(header.values(), selected)        
         self.ui.table_result.setModel(self.resultDetailModel)
-        self.ui.table_result.sortByColumn(3, Qt.AscendingOrder)        
+        if tax_idx <> -1:
+            self.ui.table_result.sortByColumn(header.keys().index(tax_idx), Qt.AscendingOrder)        
         # display exposure specific ui elements         
         self.ui.txt_bldgcount.setVisible(True) 
         self.ui.lb_bldgcount.setVisible(True)
@@ -107,6 +117,25 @@ class DialogResult(Ui_tablePreviewDialog, QDialog):
         self.ui.txt_bldgcount.setVisible(False) 
         self.ui.lb_bldgcount.setVisible(False)
 
+    # internal helper methods
+    ###############################     
+    
+    def decodeTaxonomy(self, header, selected, tax_idx, dictionary):
+        """ 
+        copy of header and selected rows with taxonomy ID field replaced by taxonomy string.
+        ID not found in dictionary is shown as is 
+        """
+        header = dict(header)
+        header[tax_idx] = QgsField(TAX_FIELD_NAME, QVariant.String)
+        decoded = []
+        for s in selected:
+            row = dict(s)
+            tax_id = row[tax_idx].toInt()[0]
+            tax_str = dictionary.get_string(tax_id)
+            row[tax_idx] = QVariant(tax_str if tax_str is not None else str(tax_id))
+            decoded.append(row)
+        return header, decoded
+
 class ResultDetailTableModel(QAbstractTableModel):
     """
     table model supporting visualization of result detail
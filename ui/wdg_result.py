@@ -28,7 +28,7 @@ from qgis.core import QGis, QgsMapLayerRegistry, QgsCoordinateReferenceSystem, \
                       QgsCoordinateTransform, QgsFeature, QgsRectangle, QgsPoint, \
                       QgsStyleV2, QgsFeatureRendererV2
 
-from utils.shapefile import load_shapefile, layer_field_index, layer_features
+from utils.shapefile import load_shapefile, layer_field_index, layer_features, layer_spatial_index
 from sidd.constants import ExportTypes, ExtrapolateOptions
 
 from ui.constants import logUICall, get_ui_string, UI_PADDING
@@ -382,7 +382,8 @@ class WidgetResult(Ui_widgetResult, QWidget):
             if len(selected)>0:
                 # display result if exists
                 if cur_layer_idx == self.EXPOSURE:
-                    self.dlgResultDetail.showExposureData(provider.fields(), selected)                    
+                    self.dlgResultDetail.showExposureData(provider.fields(), selected, 
+                                                          self._project.operator_options.get('taxonomy_dictionary'))                    
                 else:
                     self.dlgResultDetail.showInfoData(provider.fields(), selected)
                 self.dlgResultDetail.exec_()
@@ -485,6 +486,17 @@ class WidgetResult(Ui_widgetResult, QWidget):
                 for title, value in report.iteritems():
                     report_lines.append( get_ui_string('widget.result.dq.tests.%s.%s' % (key, title), value) )
                 report_lines.append('')                    
+            
+            # processing time for each step
+            profile = getattr(self._project, 'profile', None)
+            if profile is not None:
+                report_lines.append(get_ui_string('widget.result.profile.total_time', profile['total_time']))
+                for step in profile['steps']:
+                    report_lines.append(get_ui_string('widget.result.profile.step', 
+                                                      (step['name'], step['wall_time'], step['cpu_time'],
+                                                       step['features_read'], step['features_written'],
+                                                       step['features_per_second'])))
+                report_lines.append(get_ui_string('widget.result.profile.file', self._project.profile_file))
             self.ui.txt_dq_test_details.setText("\n".join(report_lines))
 
 
@@ -527,6 +539,8 @@ class WidgetResult(Ui_widgetResult, QWidget):
             if self.map_layers[index] is not None:
                 self.removeDataLayer(index)
             self.map_layers[index] = layer
+            # map canvas and info tool query layer by extent
+            layer_spatial_index(layer)
             self.registry.addMapLayer(layer)
             layer.setRendererV2(self.map_layer_renderer[index])            
         except:
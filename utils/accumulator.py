@@ -0,0 +1,307 @@
+# Copyright (c) 2011-2013, ImageCat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+accumulators for tallying values during aggregation of large data sets
+"""
+import os
+import mmap
+import heapq
+import struct
+import operator
+import cPickle
+from array import array
+from itertools import izip
+
+from utils.system import get_unique_filename
+from utils.memory import CHECK_INTERVAL
+
+# cells on each side of a tile
+TILE_SIZE = 64
+CELL_FORMAT = 'd'
+# items written to run file in each pickle
+RUN_CHUNK_SIZE = 1000
+# maximum number of run files merged at once
+MERGE_FAN_IN = 64
+
+def keep_first(value, new_value):
+    """ combine function for KeyValueAggregator, keeping first value added for key """
+    return value
+
+class KeyValueAggregator(object):
+    """
+    aggregate values by key. key can be number, string or tuple of these
+
+    values are combined into in-memory dictionary. once it holds max_keys
+    keys, its content is written into temporary run file sorted by key and
+    a new dictionary is started. items() does k-way merge of all runs, so
+    memory used is bounded by max_keys regardless of number of distinct keys.
+    with more than fan_in runs, runs are first merged in passes of fan_in
+    runs each, so number of files open at once is bounded as well.
+    values for same key are combined with combine function (sum by default),
+    in the order they were added.
+    with memory budget given, dictionary is also written out once process
+    memory approaches the budget, and max_keys is lowered to the number of
+    keys held at that point
+    """
+
+    # constructor / destructor
+    ##################################
+
+    def __init__(self, tmp_dir, max_keys, combine=operator.add, budget=None, fan_in=MERGE_FAN_IN):
+        """ constructor """
+        self._max_keys = max_keys
+        self._combine = combine
+        self._budget = budget
+        self._fan_in = max(2, fan_in)
+        self._values = {}
+        self._run_files = []
+        self._run_count = 0
+        self._run_name = '%skv_%s' % (tmp_dir, get_unique_filename())
+
+    # public method
+    ##################################
+
+    def add(self, key, value=1):
+        """ combine value into given key """
+        values = self._values
+        if key in values:
+            values[key] = self._combine(values[key], value)
+        else:
+            values[key] = value
+            if len(values) >= self._max_keys:
+                self._spill()
+            elif self._budget is not None and len(values) % CHECK_INTERVAL == 0 \
+                    and self._budget.exceeded():
+                # keys held now is what fits in memory, later runs are
+                # bounded by count without checking memory again
+                self._max_keys = len(values)
+                self._budget = None
+                self._spill()
+
+    def add_items(self, items):
+        """ combine sequence of (key, value) """
+        for key, value in items:
+            self.add(key, value)
+
+    def items(self):
+        """ generator of (key, combined value) ordered by key """
+        in_memory = sorted(self._values.iteritems())
+        if len(self._run_files) == 0:
+            for key, value in in_memory:
+                yield key, value
+            return
+        # leave room for in-memory items in final merge
+        while len(self._run_files) >= self._fan_in:
+            self._merge_pass()
+        runs = [self._read_run(run_file) for run_file in self._run_files]
+        runs.append(in_memory)
+        for key, value in self._merge(runs):
+            yield key, value
+
+    def close(self):
+        """ release memory and remove temporary run files """
+        self._values = {}
+        for run_file in self._run_files:
+            if os.path.exists(run_file):
+                os.remove(run_file)
+        self._run_files = []
+
+    # internal helper methods
+    ##################################
+
+    def _spill(self):
+        """ write content of dictionary into new run file """
+        self._run_files.append(self._write_run(sorted(self._values.iteritems())))
+        self._values = {}
+
+    def _merge_pass(self):
+        """ merge each group of fan_in consecutive runs into a single run """
+        merged_files = []
+        for start in xrange(0, len(self._run_files), self._fan_in):
+            group = self._run_files[start:start+self._fan_in]
+            if len(group) == 1:
+                merged_files.append(group[0])
+                continue
+            merged_files.append(self._write_run(self._merge([self._read_run(run_file) for run_file in group])))
+            for run_file in group:
+                os.remove(run_file)
+        self._run_files = merged_files
+
+    def _merge(self, runs):
+        """
+        generator of (key, combined value) from given sorted runs of
+        (key, value). runs must be in order they were written, so for the
+        same key values are combined in order they were added
+        """
+        combine = self._combine
+        numbered = [((key, idx, value) for key, value in run) for idx, run in enumerate(runs)]
+        merged = heapq.merge(*numbered)
+        try:
+            current_key, _idx, current_value = merged.next()
+        except StopIteration:
+            return
+        for key, _idx, value in merged:
+            if key == current_key:
+                current_value = combine(current_value, value)
+            else:
+                yield current_key, current_value
+                current_key, current_value = key, value
+        yield current_key, current_value
+
+    def _write_run(self, items):
+        """ write sorted (key, value) into new run file, return its path """
+        run_file = '%s_%d.run' % (self._run_name, self._run_count)
+        self._run_count += 1
+        chunk = []
+        with open(run_file, 'wb') as run:
+            for item in items:
+                chunk.append(item)
+                if len(chunk) == RUN_CHUNK_SIZE:
+                    cPickle.dump(chunk, run, cPickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if len(chunk) > 0:
+                cPickle.dump(chunk, run, cPickle.HIGHEST_PROTOCOL)
+        return run_file
+
+    def _read_run(self, run_file):
+        """ generator of (key, value) from run file """
+        with open(run_file, 'rb') as run:
+            while True:
+                try:
+                    items = cPickle.load(run)
+                except EOFError:
+                    return
+                for item in items:
+                    yield item
+
+class CellAccumulator(object):
+    """
+    tally of values for grid cells identified by (zone, row, col)
+
+    cells are grouped into square tiles, and only tiles with at least one
+    value are allocated (tiled-sparse). tiles are kept in a memory-mapped
+    temporary file, so memory used is bounded by the operating system page
+    cache instead of the number of cells. update of a cell is constant time.
+    """
+
+    # constructor / destructor
+    ##################################
+
+    def __init__(self, tmp_file, tile_size=TILE_SIZE):
+        """ constructor """
+        self._tmp_file = tmp_file
+        self._file = open(tmp_file, 'w+b')
+        self._map = None
+        self._capacity = 0
+        self._cell = struct.Struct(CELL_FORMAT)
+        self._tile_size = tile_size
+        self._tile_bytes = tile_size * tile_size * self._cell.size
+        # zone => zone index, zones are kept in order of first appearance
+        self._zones = {}
+        self._zone_list = []
+        # (zone index, tile row, tile col) => offset of tile in file
+        self._tiles = {}
+
+    # public method
+    ##################################
+
+    def add(self, zone, row, col, value=1):
+        """ add value to cell (row, col) of zone """
+        offset = self._cell_offset(zone, row, col)
+        self._cell.pack_into(self._map, offset,
+                             self._cell.unpack_from(self._map, offset)[0] + value)
+
+    def add_cells(self, zones, rows, cols, values=None):
+        """
+        add values (1 for each cell if not given) to cells given as
+        sequences of zone, row, col
+        """
+        # tally within batch first, so each cell is updated once
+        totals = {}
+        get = totals.get
+        if values is None:
+            for cell in izip(zones, rows, cols):
+                totals[cell] = get(cell, 0) + 1
+        else:
+            for zone, row, col, value in izip(zones, rows, cols, values):
+                cell = (zone, row, col)
+                totals[cell] = get(cell, 0) + value
+        for (zone, row, col), total in totals.iteritems():
+            self.add(zone, row, col, total)
+
+    def cells(self):
+        """
+        generator of (zone, row, col, value) for all cells with value,
+        ordered by zone, then row, then col
+        """
+        size = self._tile_size
+        row_bytes = size * self._cell.size
+        # single sort groups tiles by zone index, then tile row
+        tiles = sorted(self._tiles.iteritems())
+        start = 0
+        while start < len(tiles):
+            # all tiles in same tile row of same zone
+            zone_idx, tile_row, _tile_col = tiles[start][0]
+            zone = self._zone_list[zone_idx]
+            end = start
+            while end < len(tiles) and tiles[end][0][0:2] == (zone_idx, tile_row):
+                end += 1
+            for _row in range(size):
+                row = tile_row * size + _row
+                for (_zone_idx, _tile_row, tile_col), offset in tiles[start:end]:
+                    row_offset = offset + _row * row_bytes
+                    values = array(CELL_FORMAT, self._map[row_offset:row_offset+row_bytes])
+                    for _col, value in enumerate(values):
+                        if value != 0:
+                            yield zone, row, tile_col * size + _col, value
+            start = end
+
+    def close(self):
+        """ release memory map and remove temporary file """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        if os.path.exists(self._tmp_file):
+            os.remove(self._tmp_file)
+
+    # internal helper methods
+    ##################################
+
+    def _cell_offset(self, zone, row, col):
+        """ offset in file of given cell, tile is allocated if required """
+        zone_idx = self._zones.get(zone)
+        if zone_idx is None:
+            zone_idx = self._zones[zone] = len(self._zone_list)
+            self._zone_list.append(zone)
+        size = self._tile_size
+        tile_key = (zone_idx, row // size, col // size)
+        tile_offset = self._tiles.get(tile_key)
+        if tile_offset is None:
+            tile_offset = self._tiles[tile_key] = self._allocate_tile()
+        return tile_offset + ((row % size) * size + (col % size)) * self._cell.size
+
+    def _allocate_tile(self):
+        """ allocate space for a new tile at end of file, return its offset """
+        offset = len(self._tiles) * self._tile_bytes
+        if offset + self._tile_bytes > self._capacity:
+            # double file size, so growing is amortized constant time
+            self._capacity = max(self._tile_bytes, self._capacity * 2)
+            if self._map is not None:
+                self._map.close()
+            self._file.truncate(self._capacity)
+            self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        return offset
@@ -0,0 +1,329 @@
+# Copyright (c) 2011-2013, ImageCat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+persistent content-addressed cache for shapefiles created during processing
+"""
+
+import os
+import time
+import json
+import shutil
+import cPickle
+import hashlib
+from threading import RLock
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
+SHAPEFILE_EXTENSIONS = ['.shp', '.shx', '.dbf', '.prj', '.qpj']
+# spatial index is kept with cached file if created, but not part of its signature
+INDEX_EXTENSIONS = ['.qix']
+# other data kept in cache as pickled object
+DATA_EXTENSION = '.dat'
+
+class DirectoryLock(object):
+    """
+    exclusive lock shared by all processes using the same lock file.
+    NOTE: not reentrant, and not for use by multiple threads at once
+    """
+
+    # constructor / destructor
+    ##################################
+
+    def __init__(self, lock_file):
+        """ constructor """
+        self.lock_file = lock_file
+        self._file = None
+
+    # public method
+    ##################################
+
+    def acquire(self):
+        """ block until lock is acquired """
+        self._file = open(self.lock_file, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except IOError:
+                # LK_LOCK gives up after 10 seconds, keep waiting
+                pass
+
+    def release(self):
+        """ release lock """
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+class ShapefileCache(object):
+    """
+    persistent cache for shapefiles created by operators.
+
+    each cached shapefile is identified by a key, computed from the
+    operation name, the signature of its input files and relevant options.
+    - signature of an original input file is its path, size and modified time
+    - signature of a file created from cache (or stored into the cache) is
+      the key it was created with. this allows results derived from cached
+      files to be cached as well
+    other data (e.g. grid coverage of zones) can be kept in cache as well,
+    see store_data.
+    least recently used entries are evicted when total size exceeds max_size
+
+    cache directory can be shared by several processes (e.g. batch runs).
+    index is re-read under a lock file before each change, and index and
+    cached files are written into temporary files then renamed, so other
+    processes never see partially written entries
+    """
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'cache.lock'
+
+    # constructor / destructor
+    ##################################
+
+    def __init__(self, cache_dir, max_size):
+        """ constructor """
+        self.cache_dir = cache_dir
+        if not self.cache_dir.endswith('/'):
+            self.cache_dir += '/'
+        self.max_size = max_size
+        self._derived = {}
+        self._lock = RLock()
+        self._lock_depth = 0
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # created by other process
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        self._dir_lock = DirectoryLock(self.cache_dir + self.LOCK_FILE)
+        self._index = {}
+        with self._locked():
+            pass
+
+    # public method
+    ##################################
+
+    def get_key(self, operation, files=[], params=[]):
+        """
+        create cache key for given operation
+        files:  list of input shapefiles
+        params: list of additional values affecting the result
+        """
+        md5 = hashlib.md5()
+        md5.update(str(operation))
+        for _file in files:
+            md5.update('|%s' % self.signature(_file))
+        for _param in params:
+            md5.update('|%s' % repr(_param))
+        return md5.hexdigest()
+
+    def signature(self, input_file):
+        """ return signature for given file """
+        input_file = os.path.abspath(str(input_file))
+        with self._lock:
+            if self._derived.has_key(input_file):
+                return self._derived[input_file]
+        # file itself and shapefile sidecar files if any
+        base = input_file[0:input_file.rfind('.')]
+        sig = [input_file]
+        for _file in [input_file] + [base + _ext for _ext in SHAPEFILE_EXTENSIONS]:
+            if os.path.exists(_file):
+                stat = os.stat(_file)
+                sig.append('%s:%d:%d' % (_file[len(base):], stat.st_size, int(stat.st_mtime)))
+        return ','.join(sig)
+
+    def has_key(self, key):
+        """ test if key exists in cache """
+        with self._locked():
+            return self._index.has_key(key) and os.path.exists(self._cache_file(key))
+
+    def fetch(self, key, output_file):
+        """
+        copy cached shapefile for given key into output_file
+        return True if key is found, False otherwise
+        """
+        with self._locked():
+            if not self.has_key(key):
+                return False
+            self._copy(self._cache_file(key), output_file)
+            self._index[key]['last_used'] = time.time()
+            self._write_index()
+            self._derived[os.path.abspath(output_file)] = key
+            return True
+
+    def store(self, key, input_file):
+        """ store shapefile in cache with given key """
+        with self._locked():
+            self._remove_files(key)
+            tmp_file = '%s%s.tmp%d.shp' % (self.cache_dir, key, os.getpid())
+            self._copy(input_file, tmp_file)
+            self._rename(tmp_file, self._cache_file(key))
+            self._index[key] = {
+                'size':self._size(self._cache_file(key)),
+                'last_used':time.time(),
+            }
+            self._derived[os.path.abspath(input_file)] = key
+            self._evict()
+            self._write_index()
+
+    def fetch_data(self, key):
+        """ object stored in cache with given key, None if key is not found """
+        with self._locked():
+            data_file = self._data_file(key)
+            if not self._index.has_key(key) or not os.path.exists(data_file):
+                return None
+            with open(data_file, 'rb') as data:
+                obj = cPickle.load(data)
+            self._index[key]['last_used'] = time.time()
+            self._write_index()
+            return obj
+
+    def store_data(self, key, obj):
+        """ store object (must be picklable) in cache with given key """
+        with self._locked():
+            self._remove_files(key)
+            tmp_file = '%s%s.tmp%d%s' % (self.cache_dir, key, os.getpid(), DATA_EXTENSION)
+            with open(tmp_file, 'wb') as data:
+                cPickle.dump(obj, data, cPickle.HIGHEST_PROTOCOL)
+            self._replace(tmp_file, self._data_file(key))
+            self._index[key] = {
+                'size':self._size(self._data_file(key)),
+                'last_used':time.time(),
+            }
+            self._evict()
+            self._write_index()
+
+    def clear(self):
+        """ remove all entries from cache """
+        with self._locked():
+            for key in self._index.keys():
+                self._remove(key)
+            self._write_index()
+
+    # internal helper methods
+    ##################################
+
+    @contextmanager
+    def _locked(self):
+        """
+        hold thread and directory locks, nested use within same thread is allowed.
+        index is re-read once directory lock is acquired, so changes made by
+        other processes are kept
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                self._dir_lock.acquire()
+                self._index = self._read_index()
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._dir_lock.release()
+
+    def _cache_file(self, key):
+        return '%s%s.shp' % (self.cache_dir, key)
+
+    def _data_file(self, key):
+        return '%s%s%s' % (self.cache_dir, key, DATA_EXTENSION)
+
+    def _copy(self, input_file, output_file):
+        input_base = input_file[0:input_file.rfind('.')]
+        output_base = output_file[0:output_file.rfind('.')]
+        for _ext in SHAPEFILE_EXTENSIONS + INDEX_EXTENSIONS:
+            if os.path.exists(input_base + _ext):
+                shutil.copyfile(input_base + _ext, output_base + _ext)
+
+    def _size(self, input_file):
+        base = input_file[0:input_file.rfind('.')]
+        size = 0
+        for _ext in SHAPEFILE_EXTENSIONS + INDEX_EXTENSIONS + [DATA_EXTENSION]:
+            if os.path.exists(base + _ext):
+                size += os.path.getsize(base + _ext)
+        return size
+
+    def _rename(self, input_file, output_file):
+        """ rename all files of shapefile, replacing existing files """
+        input_base = input_file[0:input_file.rfind('.')]
+        output_base = output_file[0:output_file.rfind('.')]
+        for _ext in SHAPEFILE_EXTENSIONS + INDEX_EXTENSIONS:
+            if os.path.exists(input_base + _ext):
+                self._replace(input_base + _ext, output_base + _ext)
+
+    def _replace(self, input_file, output_file):
+        """ rename file, replacing existing file """
+        if os.name == 'nt' and os.path.exists(output_file):
+            # rename does not replace on windows. this is only safe
+            # because all changes to cache are made under directory lock
+            os.remove(output_file)
+        os.rename(input_file, output_file)
+
+    def _remove_files(self, key):
+        base = self._cache_file(key)[0:-4]
+        for _ext in SHAPEFILE_EXTENSIONS + INDEX_EXTENSIONS + [DATA_EXTENSION]:
+            if os.path.exists(base + _ext):
+                try:
+                    os.remove(base + _ext)
+                except:
+                    pass
+
+    def _remove(self, key):
+        self._remove_files(key)
+        del self._index[key]
+
+    def _evict(self):
+        """ remove least recently used entries until total size is within max_size """
+        total = sum([entry['size'] for entry in self._index.values()])
+        entries = sorted(self._index.items(), key=lambda item: item[1]['last_used'])
+        for key, entry in entries:
+            if total <= self.max_size:
+                break
+            total -= entry['size']
+            self._remove(key)
+
+    def _read_index(self):
+        try:
+            with open(self.cache_dir + self.INDEX_FILE, 'r') as index_file:
+                return json.load(index_file)
+        except:
+            return {}
+
+    def _write_index(self):
+        index_path = self.cache_dir + self.INDEX_FILE
+        tmp_path = '%s.tmp%d' % (index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as index_file:
+                json.dump(self._index, index_file)
+            self._replace(tmp_path, index_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
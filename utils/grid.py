@@ -16,7 +16,18 @@
 """
 GEM implementation specific
 """
+import sys
+from array import array
+from itertools import izip
+from math import floor, ceil, cos, radians
+from multiprocessing import Pool
+
+import osgeo.ogr as ogr
+
 HALF_CELL=0.00416666666666667 # 1/240.0
+CELLS_PER_DEGREE=120
+# grid rows in each tile processed by worker process (1 degree)
+TILE_ROWS=120
 def latlon_to_grid(lat, lon):
     """
     algorithm by Paul Henshaw 
@@ -80,3 +91,249 @@ def grid_to_latlon(grid_id):
     else:
         lon = -((65535 - lon_id + 0.5) / 120.0)
     return lat, lon
+
+def latlon_to_grids(lats, lons):
+    """
+    latlon_to_grid for sequences of lat/lon
+    return array of grid_id, same result as calling latlon_to_grid on each pair
+    """
+    _round, _half = round, HALF_CELL
+    return array('l', [int(_round((lon-_half)*120, 0)) << 16 | int(_round((lat-_half)*120, 0)) & 65535
+                       for lat, lon in izip(lats, lons)])
+
+def grids_to_latlon(grid_ids):
+    """
+    grid_to_latlon for sequence of grid_id
+    return (array of lat, array of lon), same result as calling grid_to_latlon on each id
+    """
+    lats, lons = array('d'), array('d')
+    append_lat, append_lon = lats.append, lons.append
+    half_id = 65535/2
+    for grid_id in grid_ids:
+        lon_id, lat_id = grid_id >> 16, grid_id & 65535
+        if lat_id < half_id:
+            append_lat((lat_id + 0.5)/ 120.0)
+        else:
+            append_lat(-((65535 - lat_id + 0.5) / 120.0))
+        if lon_id < half_id:
+            append_lon((lon_id + 0.5) / 120.0)
+        else:
+            append_lon(-((65535 - lon_id + 0.5) / 120.0))
+    return lats, lons
+
+def grid_unique(grid_ids):
+    """ sorted array of distinct grid_id in given sequence """
+    return array('l', sorted(set(grid_ids)))
+
+def grid_bincount(grid_ids, weights=None, keys=None):
+    """
+    tally for each grid_id in given sequence
+    - weights: value to add for each grid_id, 1 if not given
+    - keys: additional key for each grid_id, tally is then by (key, grid_id)
+    return dictionary of grid_id (or (key, grid_id)) => total
+    """
+    if keys is not None:
+        grid_ids = izip(keys, grid_ids)
+    totals = {}
+    get = totals.get
+    if weights is None:
+        for grid_id in grid_ids:
+            totals[grid_id] = get(grid_id, 0) + 1
+    else:
+        for grid_id, weight in izip(grid_ids, weights):
+            totals[grid_id] = get(grid_id, 0) + weight
+    return totals
+
+def grid_coverage(geometry):
+    """
+    fraction of given polygon within each 30 arc-second grid cell it overlaps
+    geometry is WKT in lat/lon. generator of (grid_id, fraction), where fraction 
+    is ratio of polygon area (in mercator projection) falling within the cell
+    """
+    cells = grid_cell_areas(geometry)
+    total = sum(area for grid_id, area in cells)
+    for grid_id, area in cells:
+        yield grid_id, area / total
+
+def grid_cell_areas(geometry, row_min=None, row_max=None):
+    """
+    list of (grid_id, area) for each 30 arc-second grid cell overlapped by given polygon
+    geometry is WKT in lat/lon, area is in degree squared scaled to mercator projection.
+    row_min, row_max limits result to cells in given grid rows
+
+    only cells within bounding box of polygon are visited. polygon is clipped 
+    into one strip per grid row first, then each strip into cells. 
+    cells in a strip fully covered by polygon need no further clipping
+    """
+    polygon = ogr.CreateGeometryFromWkt(geometry)
+    if polygon is None or polygon.IsEmpty():
+        return []
+    (x_min, x_max, y_min, y_max) = polygon.GetEnvelope()
+    col_min = int(floor(x_min * CELLS_PER_DEGREE))
+    col_max = int(ceil(x_max * CELLS_PER_DEGREE))
+    if row_min is None:
+        row_min = int(floor(y_min * CELLS_PER_DEGREE))
+    else:
+        # only part of polygon within given rows is required
+        polygon = polygon.Intersection(_rect(col_min, row_min, col_max, row_max))
+        if polygon is None or polygon.IsEmpty():
+            return []
+    if row_max is None:
+        row_max = int(ceil(y_max * CELLS_PER_DEGREE))
+    cell_size = 1.0 / CELLS_PER_DEGREE
+    cell_area = cell_size * cell_size
+
+    cells = []
+    for row in range(row_min, max(row_max, row_min+1)):
+        strip = polygon.Intersection(_rect(col_min, row, col_max, row+1))
+        if strip is None or strip.IsEmpty() or strip.GetArea() == 0:
+            continue
+        strip_area = strip.GetArea()
+        lat = (row + 0.5) * cell_size
+        # mercator area of cell relative to cell at equator
+        scale = 1.0 / cos(radians(lat)) ** 2
+
+        (s_x_min, s_x_max, s_y_min, s_y_max) = strip.GetEnvelope()
+        s_col_min = int(floor(s_x_min * CELLS_PER_DEGREE))
+        s_col_max = max(int(ceil(s_x_max * CELLS_PER_DEGREE)), s_col_min+1)
+        strip_full = strip_area >= (s_col_max - s_col_min) * cell_area * (1 - 1e-9)
+        for col in range(s_col_min, s_col_max):
+            if strip_full:
+                area = cell_area
+            elif s_col_max - s_col_min == 1:
+                area = strip_area
+            else:
+                part = strip.Intersection(_rect(col, row, col+1, row+1))
+                if part is None or part.IsEmpty():
+                    continue
+                area = part.GetArea()
+            if area <= 0:
+                continue
+            lon = (col + 0.5) * cell_size
+            cells.append((latlon_to_grid(lat, lon), area * scale))
+    return cells
+
+def grid_tiles(geometry, tile_rows=TILE_ROWS):
+    """
+    split rows of grid cells overlapped by given polygon into tiles of tile_rows rows.
+    list of (row_min, row_max). tiles are aligned to the grid and do not overlap, 
+    so each grid cell belongs to exactly one tile
+    """
+    polygon = ogr.CreateGeometryFromWkt(geometry)
+    if polygon is None or polygon.IsEmpty():
+        return []
+    (x_min, x_max, y_min, y_max) = polygon.GetEnvelope()
+    row_min = int(floor(y_min * CELLS_PER_DEGREE))
+    row_max = max(int(ceil(y_max * CELLS_PER_DEGREE)), row_min+1)
+    # align tiles to multiple of tile_rows
+    first = int(floor(float(row_min) / tile_rows)) * tile_rows
+    return [(max(row, row_min), min(row+tile_rows, row_max)) 
+            for row in range(first, row_max, tile_rows)]
+
+def worker_processes_allowed():
+    """
+    test if pool of worker processes can be started from current program.
+    on windows, each worker process starts a new python interpreter that
+    re-imports the main module of the program. this works for scripts that
+    only start the program under if __name__=='__main__' (SIDD_ui.pyw and
+    SIDD_batch.py), but not for frozen executables or interactive/embedded
+    interpreters (e.g. QGIS python console), where main module is not a file
+    """
+    if sys.platform != 'win32':
+        # worker processes are forked
+        return True
+    if getattr(sys, 'frozen', False):
+        return False
+    main_module = sys.modules.get('__main__')
+    return getattr(main_module, '__file__', None) is not None
+
+def _tile_cell_areas(task):
+    """ grid_cell_areas for (zone column, geometry, row_min, row_max), run in worker process """
+    (column, geometry, row_min, row_max) = task
+    return column, grid_cell_areas(geometry, row_min, row_max)
+
+class GridCoverage(object):
+    """
+    sparse grid cell x zone coverage matrix
+    each entry is (grid_id, zone, ratio), where ratio is zone area within the grid cell
+    over total zone area (see grid_coverage). counts for each zone are distributed 
+    to grid cells by multiplying with the ratios, without any geometry operation
+    """
+    def __init__(self):
+        """ constructor """
+        self.zones = []
+        self.grid_ids = array('l')
+        self.columns = array('l')
+        self.ratios = array('d')
+
+    def __len__(self):
+        return len(self.ratios)
+
+    def add_zone(self, zone, geometry):
+        """ add entries for given zone, with geometry as WKT in lat/lon """
+        column = len(self.zones)
+        self.zones.append(zone)
+        for grid_id, ratio in grid_coverage(geometry):
+            self.grid_ids.append(grid_id)
+            self.columns.append(column)
+            self.ratios.append(ratio)
+
+    def add_zones(self, zones, geometries, max_workers=1):
+        """
+        add entries for all given zones. with max_workers > 1, each zone is split into 
+        tiles of grid rows (see grid_tiles) and tiles are processed in a pool of 
+        worker processes, so that large zones are also processed in parallel.
+        NOTE: zones are processed in current process if worker processes
+              cannot be started safely (see worker_processes_allowed)
+        """
+        if max_workers <= 1 or not worker_processes_allowed():
+            for zone, geometry in izip(zones, geometries):
+                self.add_zone(zone, geometry)
+            return
+
+        first_column = len(self.zones)
+        self.zones.extend(zones)
+        tasks = []
+        for column, geometry in enumerate(geometries):
+            for row_min, row_max in grid_tiles(geometry):
+                tasks.append((column, geometry, row_min, row_max))
+        zone_cells = [[] for zone in zones]
+        pool = Pool(processes=max_workers)
+        try:
+            for column, cells in pool.imap_unordered(_tile_cell_areas, tasks):
+                zone_cells[column].extend(cells)
+        finally:
+            pool.close()
+            pool.join()
+
+        # merge tiles, ratio is relative to total area of zone from all tiles
+        for column, cells in enumerate(zone_cells):
+            total = sum(area for grid_id, area in cells)
+            for grid_id, area in sorted(cells):
+                self.grid_ids.append(grid_id)
+                self.columns.append(first_column + column)
+                self.ratios.append(area / total)
+
+    def entries(self):
+        """ generator of (grid_id, zone, ratio) for all entries """
+        zones = self.zones
+        for grid_id, column, ratio in izip(self.grid_ids, self.columns, self.ratios):
+            yield grid_id, zones[column], ratio
+
+    def distribute(self, zone_values):
+        """ 
+        value of each entry as zone value x ratio, in same order as entries
+        zone_values is dictionary of zone => value, zones not in dictionary are 0
+        """
+        values = [zone_values.get(zone, 0) for zone in self.zones]
+        return array('d', [values[column] * ratio for column, ratio in izip(self.columns, self.ratios)])
+
+def _rect(col_min, row_min, col_max, row_max):
+    """ OGR polygon for rectangle between given grid lines """
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for col, row in [(col_min, row_min), (col_min, row_max), (col_max, row_max), 
+                     (col_max, row_min), (col_min, row_min)]:
+        ring.AddPoint_2D(float(col) / CELLS_PER_DEGREE, float(row) / CELLS_PER_DEGREE)
+    rect = ogr.Geometry(ogr.wkbPolygon)
+    rect.AddGeometry(ring)
+    return rect
@@ -0,0 +1,135 @@
+# Copyright (c) 2011-2013, ImageCat Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+process memory monitoring, used to choose between in-memory and
+file-based algorithms
+"""
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD),
+                    ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t),
+                    ('PeakPagefileUsage', ctypes.c_size_t)]
+else:
+    ctypes = None
+
+# records allowed in memory even if budget is already used up
+MIN_RECORDS = 1000
+# number of records added between checks of process memory
+CHECK_INTERVAL = 10000
+# fraction of budget at which memory is considered used up
+HIGH_WATER_MARK = 0.9
+
+def process_rss():
+    """ current resident memory of process in bytes, None if not available """
+    if ctypes is not None:
+        counters = _win_memory_counters()
+        if counters is None:
+            return None
+        return counters.WorkingSetSize
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except:
+        # NOTE: peak memory from getrusage is not used here, it never
+        #       goes down so budget would stay exceeded once reached
+        return None
+
+def process_peak_rss():
+    """ peak resident memory of process in bytes, None if not available """
+    if ctypes is not None:
+        counters = _win_memory_counters()
+        if counters is None:
+            return None
+        return counters.PeakWorkingSetSize
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # reported in bytes on mac
+        return peak
+    # reported in KB on linux and other unix
+    return peak * 1024
+
+def _win_memory_counters():
+    """ memory counters of current process on windows, None if call fails """
+    try:
+        counters = _PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters
+    except:
+        return None
+
+class MemoryBudget(object):
+    """
+    memory budget (in bytes) of process
+
+    operators size their in-memory structures from the budget still
+    available, given an estimate of bytes used by each record, and check
+    exceeded() while running to switch to file-based algorithms once
+    process memory approaches the budget
+    """
+
+    # constructor / destructor
+    ##################################
+
+    def __init__(self, budget):
+        """ constructor """
+        self.budget = budget
+
+    # public method
+    ##################################
+
+    def available(self):
+        """ bytes still available within budget """
+        rss = process_rss()
+        if rss is None:
+            # memory used is not known, allow half of budget
+            return self.budget / 2
+        return max(0, self.budget * HIGH_WATER_MARK - rss)
+
+    def max_records(self, bytes_per_record, share=1):
+        """
+        number of records of given size that can be kept in memory,
+        with available memory split in given number of shares
+        """
+        return max(MIN_RECORDS, int(self.available() / share / bytes_per_record))
+
+    def exceeded(self):
+        """ test if process memory approaches the budget """
+        rss = process_rss()
+        return rss is not None and rss >= self.budget * HIGH_WATER_MARK
@@ -19,9 +19,35 @@ shapefile helper functions
 import os
 import shutil 
 import osgeo.ogr as ogr
+import osgeo.osr as osr
+from array import array
+from itertools import izip
+from math import sqrt
+from threading import Lock
+from weakref import WeakKeyDictionary
 
-from qgis.core import QgsVectorLayer, QgsFeature
+from PyQt4.QtCore import QVariant, QCoreApplication
+from qgis.core import QGis, QgsVectorLayer, QgsFeature, QgsGeometry, QgsRectangle
 from utils.system import get_random_name
+from utils.memory import CHECK_INTERVAL
+
+# number of features read at a time by layer_feature_batches
+BATCH_SIZE = 10000
+# maximum number of cells in each direction for ZoneIndex
+ZONE_INDEX_CELLS = 128
+
+# field name to index lookup for each layer, see layer_field_index
+# keyed by layer object, entry is dropped when layer is released
+_field_index_cache = WeakKeyDictionary()
+
+# layers with spatial index created, see layer_spatial_index
+_spatial_indexed_layers = WeakKeyDictionary()
+
+# guards both layer caches above
+_layer_cache_lock = Lock()
+
+# layers are created one at a time, see _new_layer
+_layer_lock = Lock()
 
 # internal helper methods
 ###########################
@@ -30,19 +56,36 @@ def _str_icmp(left, right):
     """ compare two strings """
     return str(left).upper() == str(right).upper()
 
+def _new_layer(uri, layer_name, provider):
+    """
+    create vector layer with given data provider.
+    NOTE: QGIS provider registry is not thread safe, so layers are created
+          one at a time. layer created in worker thread (see OperatorBatch)
+          is moved to main thread of application, where it is used once
+          worker thread completes
+    """
+    with _layer_lock:
+        layer = QgsVectorLayer(uri, layer_name, provider)
+    app = QCoreApplication.instance()
+    if app is not None and layer.thread() != app.thread():
+        layer.moveToThread(app.thread())
+    return layer
+
 # method on shapefile
 ###########################
-def load_shapefile(input_file, layer_name):    
-    """ create a vector layer from given shapefile file """
+def load_shapefile(input_file, layer_name, spatial_index=False):    
+    """
+    create a vector layer from given shapefile file
+    spatial index is only created if spatial_index is set, otherwise
+    it is created by layer_spatial_index when needed
+    """
     _layer = False
     if os.path.exists(input_file):
-        _layer = QgsVectorLayer(input_file, layer_name, 'ogr')
-        # create spatial index if missing
-        # QGIS spatial index file has ,qix extension  
+        _layer = _new_layer(input_file, layer_name, 'ogr')
         if _layer.dataProvider() is None:
             raise Exception('Error Loading Shapefile %s\n'%input_file)
-        if not os.path.exists('%s.qix'%input_file[:-4]):
-            _layer.dataProvider().createSpatialIndex()       
+        if spatial_index:
+            layer_spatial_index(_layer)
     return _layer
 
 def shapefile_fields(input_file):
@@ -65,7 +108,7 @@ def shapefile_projection(input_file):
 
 def remove_shapefile(input_file):    
     base = input_file[0:input_file.rfind('.')]
-    for _ext in ['.shp', '.shx', '.dbf', '.prj', '.xml', '.qpj']:
+    for _ext in ['.shp', '.shx', '.dbf', '.prj', '.xml', '.qpj', '.qix']:
         if (os.path.exists(base + _ext)):
             try:
                 os.remove(base + _ext)
@@ -93,15 +136,32 @@ def shapefile_to_kml(input_file, output_file):
 
 # method on layers (loaded shapefile)
 ###########################
-def layer_field_exists(layer, field):
-    """ determine if given vector layer constains field """
+def is_memory_layer(layer):
+    """ determine if given vector layer is held in memory instead of a file """
+    provider = layer.dataProvider()
+    return provider is not None and str(provider.name()) == 'memory'
+
+def layer_spatial_index(layer):
+    """
+    create spatial index for given vector layer if missing.
+    must be called before spatial query (select by extent) on layer
+    QGIS spatial index file has .qix extension and is reused next
+    time the same shapefile is loaded
+    """
     provider = layer.dataProvider()
     if provider is None:
-        return False
-    for _idx, _field in provider.fields().iteritems():
-        if _str_icmp(field, _field.name()):
-            return True
-    return False
+        return
+    with _layer_cache_lock:
+        if _spatial_indexed_layers.get(layer, False):
+            return
+        source = str(layer.source()).split('|')[0]
+        if is_memory_layer(layer) or not os.path.exists('%s.qix' % source[:-4]):
+            provider.createSpatialIndex()
+        _spatial_indexed_layers[layer] = True
+
+def layer_field_exists(layer, field):
+    """ determine if given vector layer constains field """
+    return layer_field_index(layer, field) != -1
 
 def layer_field_index(layer, field):
     """
@@ -110,10 +170,15 @@ def layer_field_index(layer, field):
     provider = layer.dataProvider()
     if provider is None:
         return -1
-    for _idx, _field in provider.fields().iteritems():
-        if _str_icmp(field, _field.name()):
-            return _idx
-    return -1
+    # field names are looked up for each layer only once
+    with _layer_cache_lock:
+        indices = _field_index_cache.get(layer)
+        if indices is None:
+            indices = {}
+            for _idx, _field in provider.fields().iteritems():
+                indices.setdefault(str(_field.name()).upper(), _idx)
+            _field_index_cache[layer] = indices
+    return indices.get(str(field).upper(), -1)
 
 def layer_multifields_stats(layer, fields):
     """ return value distribution for field in given vector layer """
@@ -130,10 +195,9 @@ def layer_multifields_stats(layer, fields):
         
     f = QgsFeature()
     stats = {}
-    provider.select(f_indices, provider.extent())
+    provider.select(f_indices, provider.extent(), False)
     provider.rewind()
-    for _idx in range(provider.featureCount()):
-        provider.nextFeature(f)
+    while provider.nextFeature(f):
         # create compound key
         _key = ''
         for idx in f_indices:
@@ -151,18 +215,528 @@ def layer_field_stats(layer, field):
     """ aggregate stats for field in layer """
     return layer_multifields_stats(layer, [field])
 
-def layer_features(layer):
-    """ generator for traversing all features within given vector layer """
+def layer_features(layer, fields=None, with_geometry=True, extent=None):
+    """
+    generator for traversing all features within given vector layer
+    - fields: only read given fields, all fields if None
+    - with_geometry: set to False if feature geometry is not used
+    - extent: only return features intersecting given QgsRectangle
+    NOTE: attributeMap of returned feature only contains the fields read,
+          keyed by same index as returned by layer_field_index
+    """
     provider = layer.dataProvider()
     if provider is None:
         raise Exception('Error accessing layer features in %s\n' % layer.name())
-    provider.select(provider.attributeIndexes())
+    if fields is None:
+        f_indices = provider.attributeIndexes()
+    else:
+        f_indices = []
+        for field in fields:
+            idx = layer_field_index(layer, field)
+            if idx == -1:
+                raise Exception('%s field does not exist in %s\n' % (field, layer.name()))
+            f_indices.append(idx)
+    if extent is None:
+        provider.select(f_indices, QgsRectangle(), with_geometry)
+    else:
+        layer_spatial_index(layer)
+        provider.select(f_indices, extent, with_geometry, True)
     f = QgsFeature()
     provider.rewind()
-    for _idx in range(provider.featureCount()):
-        provider.nextFeature(f)
+    while provider.nextFeature(f):
         yield f
 
+def _memory_layer_batches(layer, fields, batch_size, with_centroid, with_geometry):
+    """ layer_feature_batches for layer without underlying datasource """
+    provider = layer.dataProvider()
+    columns = []
+    for field in fields:
+        idx = layer_field_index(layer, field)
+        if idx == -1:
+            raise Exception('%s field does not exist in %s\n' % (field, layer.name()))
+        columns.append((field, idx, provider.fields()[idx].type()))
+
+    def new_batch():
+        batch = {}
+        for field, idx, field_type in columns:
+            if field_type == QVariant.Int:
+                batch[field] = array('l')
+            elif field_type == QVariant.Double:
+                batch[field] = array('d')
+            else:
+                batch[field] = []
+        if with_centroid:
+            batch['x'] = array('d')
+            batch['y'] = array('d')
+        if with_geometry:
+            batch['geometry'] = []
+        return batch
+
+    batch, batch_count = new_batch(), 0
+    for _f in layer_features(layer, fields, with_centroid or with_geometry):
+        attributes = _f.attributeMap()
+        for field, idx, field_type in columns:
+            if field_type == QVariant.Int:
+                batch[field].append(attributes[idx].toInt()[0])
+            elif field_type == QVariant.Double:
+                batch[field].append(attributes[idx].toDouble()[0])
+            else:
+                batch[field].append(str(attributes[idx].toString()))
+        if with_centroid:
+            centroid = _f.geometry().centroid().asPoint()
+            batch['x'].append(centroid.x())
+            batch['y'].append(centroid.y())
+        if with_geometry:
+            batch['geometry'].append(str(_f.geometry().exportToWkt()))
+        batch_count += 1
+        if batch_count == batch_size:
+            yield batch
+            batch, batch_count = new_batch(), 0
+    if batch_count > 0:
+        yield batch
+
+def field_to_float(value):
+    """
+    value from layer_feature_batches as floating point. string fields 
+    not set or not numeric (e.g. survey loaded from CSV) are 0.0
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def field_to_int(value):
+    """ value from layer_feature_batches as integer, 0 if not set or not numeric """
+    return int(field_to_float(value))
+
+def layer_feature_batches(layer, fields, batch_size=BATCH_SIZE,
+                          with_centroid=False, with_geometry=False):
+    """
+    generator for traversing features within given vector layer in batches
+    each batch is a dictionary of columns, keyed by field name
+    - integer field as array('l'), real field as array('d'), others as list of str
+    - 'x', 'y' as array('d') of feature centroids if with_centroid is set
+    - 'geometry' as list of WKT if with_geometry is set
+    features are read directly from the underlying OGR datasource to avoid
+    creating QgsFeature/QVariant for each feature
+    """
+    if is_memory_layer(layer):
+        # no datasource to read from, read through provider instead
+        for batch in _memory_layer_batches(layer, fields, batch_size, with_centroid, with_geometry):
+            yield batch
+        return
+    ds = ogr.Open(str(layer.source()).split('|')[0])
+    if ds is None:
+        raise Exception('Error accessing layer features in %s\n' % layer.name())
+    ogr_layer = ds.GetLayer(0)
+    layer_defn = ogr_layer.GetLayerDefn()
+
+    # retrieve index and type for all fields
+    columns = []
+    for field in fields:
+        idx = layer_defn.GetFieldIndex(str(field))
+        if idx == -1:
+            raise Exception('%s field does not exist in %s\n' % (field, layer.name()))
+        columns.append((field, idx, layer_defn.GetFieldDefn(idx).GetType()))
+
+    def new_batch():
+        batch = {}
+        for field, idx, field_type in columns:
+            if field_type == ogr.OFTInteger:
+                batch[field] = array('l')
+            elif field_type == ogr.OFTReal:
+                batch[field] = array('d')
+            else:
+                batch[field] = []
+        if with_centroid:
+            batch['x'] = array('d')
+            batch['y'] = array('d')
+        if with_geometry:
+            batch['geometry'] = []
+        return batch
+
+    batch, batch_count = new_batch(), 0
+    ogr_layer.ResetReading()
+    _f = ogr_layer.GetNextFeature()
+    while _f is not None:
+        for field, idx, field_type in columns:
+            if field_type == ogr.OFTInteger:
+                batch[field].append(_f.GetFieldAsInteger(idx))
+            elif field_type == ogr.OFTReal:
+                batch[field].append(_f.GetFieldAsDouble(idx))
+            else:
+                batch[field].append(_f.GetFieldAsString(idx))
+        if with_centroid or with_geometry:
+            geom = _f.GetGeometryRef()
+        if with_centroid:
+            if geom.GetGeometryType() != ogr.wkbPoint:
+                geom = geom.Centroid()
+            batch['x'].append(geom.GetX())
+            batch['y'].append(geom.GetY())
+        if with_geometry:
+            batch['geometry'].append(_f.GetGeometryRef().ExportToWkt())
+        batch_count += 1
+        if batch_count == batch_size:
+            yield batch
+            batch, batch_count = new_batch(), 0
+        _f = ogr_layer.GetNextFeature()
+    if batch_count > 0:
+        yield batch
+    del ogr_layer, ds
+
+# point in polygon join
+###########################
+class ZoneIndex(object):
+    """
+    grid index over polygons of zone layer for locating zone containing a point
+    - zone extent is divided into grid cells, each zone geometry is clipped 
+      to cells it overlaps, so only small parts of zones are tested for each point
+    - cells covered entirely by one zone need no geometry test at all
+    - values contains zone attributes as columns (see layer_feature_batches)
+      and is indexed by zone id returned from locate
+    """
+    def __init__(self, layer, fields, max_cells=ZONE_INDEX_CELLS):
+        """ constructor """
+        self.values = {}
+        for field in fields:
+            self.values[field] = []
+        geometries = []
+        for batch in layer_feature_batches(layer, fields, with_geometry=True):
+            for field in fields:
+                self.values[field].extend(batch[field])
+            for wkt in batch['geometry']:
+                geometries.append(ogr.CreateGeometryFromWkt(wkt))
+        self.count = len(geometries)
+
+        # grid cells, roughly 16 cells per zone
+        envelopes = [geom.GetEnvelope() for geom in geometries if geom is not None]
+        if len(envelopes) == 0:
+            self._cells = {}
+            self._x_min = self._y_min = self._x_max = self._y_max = 0
+            self._cols, self._cell_x, self._cell_y = 1, 1, 1
+            return
+        self._x_min = min(env[0] for env in envelopes)
+        self._x_max = max(env[1] for env in envelopes)
+        self._y_min = min(env[2] for env in envelopes)
+        self._y_max = max(env[3] for env in envelopes)
+        self._cols = min(max_cells, int(sqrt(self.count)*4)+1)
+        self._cell_x = ((self._x_max - self._x_min) / self._cols) or 1
+        self._cell_y = ((self._y_max - self._y_min) / self._cols) or 1
+
+        # for each cell, either zone id covering entire cell
+        # or list of (zone id, envelope, part of zone geometry within cell)
+        self._cells = {}
+        for zone_id, geom in enumerate(geometries):
+            if geom is None:
+                continue
+            (x_min, x_max, y_min, y_max) = geom.GetEnvelope()
+            for col in range(self._col(x_min), self._col(x_max)+1):
+                for row in range(self._row(y_min), self._row(y_max)+1):
+                    cell = self._cells.setdefault((col, row), [])
+                    if not isinstance(cell, list):
+                        # already covered by other zone
+                        continue
+                    cell_geom = self._cell_geometry(col, row)
+                    if geom.Contains(cell_geom):
+                        self._cells[(col, row)] = zone_id
+                        continue
+                    part = geom.Intersection(cell_geom)
+                    if part is not None and not part.IsEmpty():
+                        cell.append((zone_id, part.GetEnvelope(), part))
+
+    def locate(self, x, y):
+        """ return id of zone containing given point, -1 if not in any zone """
+        if x < self._x_min or x > self._x_max or y < self._y_min or y > self._y_max:
+            return -1
+        cell = self._cells.get((self._col(x), self._row(y)), None)
+        if cell is None:
+            return -1
+        if not isinstance(cell, list):
+            return cell
+        point = None
+        for zone_id, (x_min, x_max, y_min, y_max), part in cell:
+            if x < x_min or x > x_max or y < y_min or y > y_max:
+                continue
+            if point is None:
+                point = ogr.Geometry(ogr.wkbPoint)
+                point.AddPoint_2D(x, y)
+            # point on zone boundary is considered within zone, same as intersection
+            if part.Intersects(point):
+                return zone_id
+        return -1
+
+    def locate_points(self, xs, ys):
+        """ return array of zone ids for given point coordinates """
+        return array('l', [self.locate(x, y) for x, y in izip(xs, ys)])
+
+    def _col(self, x):
+        # points on upper boundary of extent belong to last cell
+        return min(int((x - self._x_min) / self._cell_x), self._cols-1)
+
+    def _row(self, y):
+        return min(int((y - self._y_min) / self._cell_y), self._cols-1)
+
+    def _cell_geometry(self, col, row):
+        x_min = self._x_min + col * self._cell_x
+        y_min = self._y_min + row * self._cell_y
+        return ogr.CreateGeometryFromWkt('POLYGON ((%.12f %.12f,%.12f %.12f,%.12f %.12f,%.12f %.12f,%.12f %.12f))' % (
+            x_min, y_min, x_min, y_min + self._cell_y, x_min + self._cell_x, y_min + self._cell_y,
+            x_min + self._cell_x, y_min, x_min, y_min))
+
+def layer_zone_join(layer, fields, zone_layer, zone_fields, batch_size=BATCH_SIZE):
+    """
+    join features of point layer with attributes of zone containing each point
+    in place of intersection, without writing intermediate shapefile.
+    generator of batches as in layer_feature_batches, with
+    - given fields from point layer, and 'x', 'y' of points
+    - given zone_fields from zone containing the point
+    points not within any zone are excluded from result.
+    zone_fields take precedence over fields with same name in point layer
+    """
+    index = ZoneIndex(zone_layer, zone_fields)
+    for batch in layer_feature_batches(layer, fields, batch_size, with_centroid=True):
+        zone_ids = index.locate_points(batch['x'], batch['y'])
+        selected = [idx for idx, zone_id in enumerate(zone_ids) if zone_id != -1]
+        joined = {}
+        for key, values in batch.iteritems():
+            joined[key] = _select_values(values, selected)
+        selected_zones = [zone_ids[idx] for idx in selected]
+        for field in zone_fields:
+            joined[field] = _select_values(index.values[field], selected_zones)
+        yield joined
+
+def _select_values(values, indices):
+    """ values at given indices, keeping column type """
+    if isinstance(values, array):
+        return array(values.typecode, [values[idx] for idx in indices])
+    return [values[idx] for idx in indices]
+
+# layer writer
+###########################
+class FeatureSink(object):
+    """
+    write features into shapefile through OGR, used in place of QgsVectorFileWriter
+    - fields is dictionary of QgsField keyed by attribute index, same as QgsVectorFileWriter
+    - features are buffered and written batch_size at a time within a transaction
+    - besides addFeature(QgsFeature), write/write_point/write_rect take
+      attribute values as python list (in order of field index) so that
+      QgsFeature and QVariant do not need to be created for each feature
+    close() must be called to complete writing
+    """
+    # QVariant type to OGR field type
+    FIELD_TYPES = {
+        QVariant.Int: ogr.OFTInteger,
+        QVariant.Double: ogr.OFTReal,
+        QVariant.String: ogr.OFTString,
+    }
+    # QGIS to OGR geometry type
+    GEOMETRY_TYPES = {
+        QGis.WKBPoint: ogr.wkbPoint,
+        QGis.WKBLineString: ogr.wkbLineString,
+        QGis.WKBPolygon: ogr.wkbPolygon,
+        QGis.WKBMultiPoint: ogr.wkbMultiPoint,
+        QGis.WKBMultiLineString: ogr.wkbMultiLineString,
+        QGis.WKBMultiPolygon: ogr.wkbMultiPolygon,
+        # attribute table (.dbf) only
+        None: ogr.wkbNone,
+    }
+
+    def __init__(self, output_file, fields, geometry_type, crs, batch_size=BATCH_SIZE):
+        """ constructor """
+        self.output_file = output_file
+        self.batch_size = batch_size
+        driver = ogr.GetDriverByName('ESRI Shapefile')
+        if os.path.exists(output_file):
+            driver.DeleteDataSource(output_file)
+        self._ds = driver.CreateDataSource(output_file)
+        if self._ds is None:
+            raise Exception('Error creating shapefile %s\n' % output_file)
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(str(crs.toWkt()))
+        layer_name = os.path.splitext(os.path.basename(output_file))[0]
+        self._layer = self._ds.CreateLayer(layer_name, srs,
+                                           self.GEOMETRY_TYPES.get(geometry_type, ogr.wkbUnknown))
+
+        # create fields in order of field index
+        self._keys = sorted(fields.keys())
+        self._types = []
+        for key in self._keys:
+            field_type = self.FIELD_TYPES.get(fields[key].type(), ogr.OFTString)
+            field_defn = ogr.FieldDefn(str(fields[key].name()), field_type)
+            if field_type == ogr.OFTString:
+                field_defn.SetWidth(fields[key].length() if fields[key].length() > 0 else 254)
+            self._layer.CreateField(field_defn)
+            self._types.append(field_type)
+        self._defn = self._layer.GetLayerDefn()
+        self._features = []
+
+    def addFeature(self, feature):
+        """ add QgsFeature """
+        attributes = feature.attributeMap()
+        values = []
+        for key, field_type in zip(self._keys, self._types):
+            if not attributes.has_key(key) or attributes[key].isNull():
+                values.append(None)
+            elif field_type == ogr.OFTInteger:
+                values.append(attributes[key].toInt()[0])
+            elif field_type == ogr.OFTReal:
+                values.append(attributes[key].toDouble()[0])
+            else:
+                values.append(unicode(attributes[key].toString()).encode('utf-8'))
+        self.write(values, feature.geometry())
+        return True
+
+    def geometry(self, geometry):
+        """
+        convert given geometry (QgsGeometry, WKT or OGR geometry) into OGR geometry
+        can be used to convert geometry once if written with multiple features
+        """
+        if geometry is None or isinstance(geometry, ogr.Geometry):
+            return geometry
+        if isinstance(geometry, basestring):
+            return ogr.CreateGeometryFromWkt(geometry)
+        return ogr.CreateGeometryFromWkt(str(geometry.exportToWkt()))
+
+    def write(self, values, geometry):
+        """ add feature with given attribute values and geometry """
+        feature = ogr.Feature(self._defn)
+        for idx, value in enumerate(values):
+            if value is not None:
+                feature.SetField(idx, value)
+        if geometry is not None:
+            feature.SetGeometry(self.geometry(geometry))
+        self._features.append(feature)
+        if len(self._features) >= self.batch_size:
+            self._flush()
+
+    def write_point(self, values, x, y):
+        """ add feature with given attribute values and point geometry """
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(x, y)
+        self.write(values, point)
+
+    def write_rect(self, values, x_min, y_min, x_max, y_max):
+        """ add feature with given attribute values and rectangle geometry """
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in [(x_min, y_min), (x_min, y_max), (x_max, y_max), (x_max, y_min), (x_min, y_min)]:
+            ring.AddPoint_2D(x, y)
+        rect = ogr.Geometry(ogr.wkbPolygon)
+        rect.AddGeometry(ring)
+        self.write(values, rect)
+
+    def close(self):
+        """ write remaining features and close shapefile """
+        if self._ds is None:
+            return
+        self._flush()
+        self._defn, self._layer, self._ds = None, None, None
+
+    def _flush(self):
+        """ write buffered features """
+        self._layer.StartTransaction()
+        for feature in self._features:
+            self._layer.CreateFeature(feature)
+        self._layer.CommitTransaction()
+        self._features = []
+
+class LayerWriter(object):
+    """
+    create vector layer from features, used in place of QgsVectorFileWriter
+    features are kept in a memory layer until more than max_features are added,
+    or process memory approaches given memory budget, after which all features
+    are written into output_file as shapefile.
+    same as FeatureSink, write/write_rect take attribute values as python list
+    (in order of field index). once switched to shapefile, values are passed
+    on without creating QgsFeature and QVariant for each feature
+    """
+    # memory provider geometry type names
+    MEMORY_GEOMETRY_TYPES = {
+        QGis.WKBPoint: 'Point',
+        QGis.WKBLineString: 'LineString',
+        QGis.WKBPolygon: 'Polygon',
+        QGis.WKBMultiPoint: 'MultiPoint',
+        QGis.WKBMultiLineString: 'MultiLineString',
+        QGis.WKBMultiPolygon: 'MultiPolygon',
+    }
+
+    def __init__(self, output_file, fields, geometry_type, crs, max_features=0, budget=None):
+        """ constructor """
+        self.output_file = output_file
+        self.fields = fields
+        self.geometry_type = geometry_type
+        self.crs = crs
+        self.max_features = max_features
+        self.budget = budget
+        self._features = []
+        self._writer = None
+        self.in_memory = True
+        if max_features <= 0 or not self.MEMORY_GEOMETRY_TYPES.has_key(geometry_type):
+            self._create_file()
+
+    def addFeature(self, feature):
+        """ add feature, feature is copied so caller can reuse the same object """
+        if not self.in_memory:
+            return self._writer.addFeature(feature)
+        self._add(QgsFeature(feature))
+        return True
+
+    def write(self, values, geometry):
+        """ add feature with given attribute values and geometry (QgsGeometry, WKT or OGR geometry) """
+        if not self.in_memory:
+            return self._writer.write(values, geometry)
+        feature = QgsFeature()
+        for key, value in izip(sorted(self.fields.keys()), values):
+            if value is not None:
+                feature.addAttribute(key, QVariant(value))
+        if geometry is not None:
+            if isinstance(geometry, ogr.Geometry):
+                geometry = geometry.ExportToWkt()
+            if isinstance(geometry, basestring):
+                geometry = QgsGeometry.fromWkt(geometry)
+            feature.setGeometry(geometry)
+        self._add(feature)
+
+    def write_rect(self, values, x_min, y_min, x_max, y_max):
+        """ add feature with given attribute values and rectangle geometry """
+        if not self.in_memory:
+            return self._writer.write_rect(values, x_min, y_min, x_max, y_max)
+        self.write(values, QgsGeometry.fromRect(QgsRectangle(x_min, y_min, x_max, y_max)))
+
+    def layer(self, layer_name):
+        """ complete writing and return created layer """
+        if not self.in_memory:
+            self._writer.close()
+            return load_shapefile(self.output_file, layer_name)
+
+        uri = '%s?crs=epsg:%d' % (self.MEMORY_GEOMETRY_TYPES[self.geometry_type], self.crs.epsg())
+        layer = _new_layer(uri, layer_name, 'memory')
+        provider = layer.dataProvider()
+        provider.addAttributes([self.fields[key] for key in sorted(self.fields.keys())])
+        layer.updateFieldMap()
+        provider.addFeatures(self._features)
+        layer.updateExtents()
+        self._features = []
+        return layer
+
+    def _add(self, feature):
+        """ keep feature in memory, switch to shapefile if there are too many """
+        self._features.append(feature)
+        if len(self._features) > self.max_features:
+            # too many features to keep in memory
+            self._create_file()
+        elif self.budget is not None and len(self._features) % CHECK_INTERVAL == 0 \
+                and self.budget.exceeded():
+            # running out of memory
+            self._create_file()
+
+    def _create_file(self):
+        """ switch to writing shapefile, features collected so far are written first """
+        self.in_memory = False
+        self._writer = FeatureSink(self.output_file, self.fields, self.geometry_type, self.crs)
+        for feature in self._features:
+            self._writer.addFeature(feature)
+        self._features = []
+
 # complex methods 
 ###########################
 def load_shapefile_verify(input_file, layer_name, fields):